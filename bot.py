@@ -1,25 +1,39 @@
 import os
+import html
+import time
 import asyncio
+import functools
 import logging
+from datetime import datetime
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
-from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 import database as db
+import diagnostics
+import manual_mailing as mailing
+from log_setup import fields, setup_logging
+from campaigns import CampaignCache
+from delivery import STATUS_DELIVERED, STATUS_FAILED, DeliveryLog, format_delivery_report
+from pacing import LoadMonitor
+from payloads import CompiledMessage, compile_message, reply_keyboard
+from text_router import TextRouter
+from throttling import ThrottlingMiddleware
+from update_queue import UpdateQueueMiddleware
+from warm_state import MediaFileCache, SubscriptionCache, load_snapshot, save_snapshot
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Настройка логирования: вывод в отдельном потоке, частые события - выборочно
+setup_logging(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Инициализация бота
@@ -30,54 +44,140 @@ if not BOT_TOKEN:
 # ID администратора (замените на ваш user_id)
 ADMIN_IDS = [1231038897]  # Замените на ваш user_id
 
+# Количество результатов поиска комментариев на одной странице
+SEARCH_PAGE_SIZE = 5
+
+# Режим диагностики: медленные колбэки, журнал медленных запросов, профилирование
+DIAGNOSTICS = os.getenv("DIAGNOSTICS") == "1"
+SLOW_CALLBACK_SECONDS = float(os.getenv("SLOW_CALLBACK_SECONDS", "0.1"))
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0.05"))
+
+# Ограничение частоты сообщений от одного пользователя:
+# THROTTLE_RATE сообщений в секунду, всплеск до THROTTLE_BURST,
+# лишние откладываются не более чем на THROTTLE_MAX_DELAY секунд
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))
+THROTTLE_BURST = int(os.getenv("THROTTLE_BURST", "5"))
+THROTTLE_MAX_DELAY = float(os.getenv("THROTTLE_MAX_DELAY", "0"))
+
+# Отложенные рассылки замедляются, если входящих апдейтов больше INBOUND_TARGET_RATE
+# в секунду или запись в базу дольше DB_LATENCY_TARGET секунд
+INBOUND_TARGET_RATE = float(os.getenv("INBOUND_TARGET_RATE", "20"))
+DB_LATENCY_TARGET = float(os.getenv("DB_LATENCY_TARGET", "0.05"))
+
+# Обработка апдейтов: не больше UPDATE_CONCURRENCY одновременно, в очереди
+# не больше UPDATE_QUEUE_SIZE - дальше polling ждет, пока очередь разгрузится
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "200"))
+
+# Снимок кэшей для быстрого перезапуска и общий срок на остановку бота:
+# дообработку очереди апдейтов, отправок и запись журнала доставки
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "warm_state.json")
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "20"))
+
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher(storage=MemoryStorage())
 
+# Ограничитель срабатывает до фильтров и обработчиков - лишние апдейты не доходят до базы
+throttling = ThrottlingMiddleware(
+    rate=THROTTLE_RATE,
+    burst=THROTTLE_BURST,
+    max_delay=THROTTLE_MAX_DELAY,
+    exempt_ids=ADMIN_IDS
+)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+
+# Нагрузка на бота для адаптивного темпа рассылок
+load_monitor = LoadMonitor(inbound_target=INBOUND_TARGET_RATE, latency_target=DB_LATENCY_TARGET)
+
+
+@dp.update.outer_middleware()
+async def count_inbound_updates(handler, event, data):
+    """Учет входящих апдейтов в load_monitor"""
+    load_monitor.record_update()
+    return await handler(event, data)
+
+
+# Очередь подключается после учета нагрузки: входящая частота считается
+# в момент получения апдейта, а не в момент обработки
+update_queue = UpdateQueueMiddleware(concurrency=UPDATE_CONCURRENCY, max_size=UPDATE_QUEUE_SIZE)
+dp.update.outer_middleware(update_queue)
+
+# Кэш кампаний (приветственная серия) с горячей перезагрузкой из базы
+campaign_cache = CampaignCache()
+
+# Журнал доставки приветственных сообщений и отложенных рассылок (пакетная запись)
+delivery_log = DeliveryLog()
+
+# Кэши, которые сохраняются в снимок при остановке и загружаются при запуске
+subscription_cache = SubscriptionCache()
+media_file_ids = MediaFileCache()
+
+# Признак остановки: фоновые задачи завершают текущую отправку и выходят
+stopping = asyncio.Event()
+
+# Выполняющиеся задачи планировщика, которые остановка должна дождаться
+running_jobs = set()
+
+# Статические reply-клавиатуры собираются один раз при импорте
+ADMIN_KEYBOARD = reply_keyboard(
+    "📊 Статистика", "📨 Сделать рассылку", "💬 Просмотреть комментарии", columns=2
+)
+SUBSCRIBED_KEYBOARD = reply_keyboard("💬 Оставить комментарий", "📞 Связаться с поддержкой")
+SUBSCRIBE_KEYBOARD = reply_keyboard("✅ Подписаться на рассылку")
+
+# Кнопки reply-клавиатуры маршрутизируются одним поиском в словаре
+text_router = TextRouter()
+
 
 def is_admin(user_id: int) -> bool:
     """Проверка, является ли пользователь администратором"""
     return user_id in ADMIN_IDS
 
 
-async def send_media_message(chat_id: int, message_data: dict):
-    """Универсальная функция отправки сообщения с медиа или без"""
+async def send_cached_media(send, media_field: str, chat_id: int, message: CompiledMessage):
+    """Отправка фото или видео по сохраненному file_id, а без него - по URL
+
+    Если Telegram отклонил сохраненный file_id, он забывается и медиа
+    отправляется по URL заново.
+    """
+    kwargs = dict(chat_id=chat_id, caption=message.text, reply_markup=message.reply_markup,
+                  parse_mode=ParseMode.HTML)
+    file_id = media_file_ids.get(message.media_url)
+    if file_id is not None:
+        try:
+            return await send(**{media_field: file_id}, **kwargs)
+        except TelegramBadRequest as e:
+            logger.warning("⚠️ Сохраненный file_id не принят",
+                           extra=fields(event="file_id_rejected", url=message.media_url, error=e))
+            media_file_ids.discard(message.media_url)
+
+    sent = await send(**{media_field: message.media_url}, **kwargs)
+    media_file_ids.remember(message.media_url, sent)
+    return sent
+
+
+async def send_media_message(chat_id: int, message):
+    """Универсальная функция отправки сообщения с медиа или без
+
+    message - CompiledMessage (предпочтительно, собирается один раз) или
+    словарь сообщения, который будет скомпилирован на месте.
+    """
     try:
-        # Создаем клавиатуру если есть кнопка
-        keyboard = None
-        if message_data.get('button_text') and message_data.get('button_url'):
-            builder = InlineKeyboardBuilder()
-            builder.button(
-                text=message_data['button_text'],
-                url=message_data['button_url']
-            )
-            keyboard = builder.as_markup()
+        if not isinstance(message, CompiledMessage):
+            message = compile_message(message)
 
         # Отправляем сообщение в зависимости от типа медиа
-        media_type = message_data.get('media_type')
-        media_url = message_data.get('media_url')
-
-        if media_type == 'photo' and media_url:
-            await bot.send_photo(
-                chat_id=chat_id,
-                photo=media_url,
-                caption=message_data['text'],
-                reply_markup=keyboard,
-                parse_mode=ParseMode.HTML
-            )
-        elif media_type == 'video' and media_url:
-            await bot.send_video(
-                chat_id=chat_id,
-                video=media_url,
-                caption=message_data['text'],
-                reply_markup=keyboard,
-                parse_mode=ParseMode.HTML
-            )
+        if message.media_type == 'photo':
+            await send_cached_media(bot.send_photo, 'photo', chat_id, message)
+        elif message.media_type == 'video':
+            await send_cached_media(bot.send_video, 'video', chat_id, message)
         else:
             # Просто текстовое сообщение
             await bot.send_message(
                 chat_id=chat_id,
-                text=message_data['text'],
-                reply_markup=keyboard,
+                text=message.text,
+                reply_markup=message.reply_markup,
                 parse_mode=ParseMode.HTML
             )
 
@@ -88,33 +188,118 @@ async def send_media_message(chat_id: int, message_data: dict):
         return False
 
 
+def tracked_job(func):
+    """Задача планировщика, завершения которой дожидается остановка бота"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        task = asyncio.current_task()
+        running_jobs.add(task)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            running_jobs.discard(task)
+    return wrapper
+
+
+@tracked_job
 async def send_scheduled_welcome():
     """Отправка запланированных приветственных сообщений"""
     try:
-        pending_messages = await db.get_pending_messages()
+        # Захват, а не простая выборка: с общей базой PostgreSQL несколько
+        # экземпляров бота не отправят одно сообщение дважды
+        pending_messages = await db.claim_pending_messages()
         logger.info(f"Найдено сообщений для отправки: {len(pending_messages)}")
+        skipped = 0
+
+        for index, message in enumerate(pending_messages):
+            if stopping.is_set():
+                # Остальные захваченные сообщения сразу достанутся следующему запуску
+                await db.release_messages([row[0] for row in pending_messages[index:]])
+                logger.info(f"⏸ Остановка: возвращено в очередь {len(pending_messages) - index} сообщений")
+                break
 
-        for message in pending_messages:
-            message_id, user_id, message_stage, username = message
+            message_id, user_id, message_stage, username, campaign_version = message
 
-            if message_stage < len(db.WELCOME_MESSAGES):
-                msg_data = db.WELCOME_MESSAGES[message_stage]
+            # Пользователь получает серию той версии, с которой начал
+            campaign = await campaign_cache.get(db.WELCOME_CAMPAIGN, campaign_version)
+            if campaign is None:
+                # Захват не снимается: сообщение вернется в работу по истечении
+                # аренды, когда появится корректная версия серии
+                skipped += 1
+                continue
+
+            if message_stage < len(campaign.messages):
+                msg_data = campaign.messages[message_stage]
 
                 # Отправляем сообщение
+                started = time.monotonic()
                 success = await send_media_message(user_id, msg_data)
+                await delivery_log.record(
+                    campaign.id, message_stage, user_id,
+                    STATUS_DELIVERED if success else STATUS_FAILED, time.monotonic() - started
+                )
 
                 if success:
                     # Отмечаем сообщение как отправленное
                     await db.mark_message_sent(message_id)
                     await db.update_welcome_stage(user_id, message_stage)
-                    logger.info(f"✅ Отправлено сообщение {message_stage} пользователю {user_id}")
+                    logger.info(
+                        "✅ Отправлено приветственное сообщение",
+                        extra=fields(event="welcome_sent", user_id=user_id, stage=message_stage)
+                    )
                 else:
                     logger.error(f"❌ Не удалось отправить сообщение {message_stage} пользователю {user_id}")
 
+        if skipped:
+            logger.error(f"❌ Нет корректной версии приветственной серии, пропущено сообщений: {skipped}")
+
     except Exception as e:
         logger.error(f"❌ Ошибка в send_scheduled_welcome: {e}")
 
 
+# Запущенные отложенные рассылки (ссылки держим, чтобы задачи не собрал GC)
+broadcast_tasks = set()
+
+
+async def run_scheduled_broadcast(broadcast_id: int, payload: dict, segment: dict, rate: float,
+                                  window: float = None, campaign_id: int = 0):
+    """Выполнение отложенной рассылки из manual_mailing.py --at"""
+    logger.info(f"📨 Запуск отложенной рассылки {broadcast_id}")
+    try:
+        mailing_data = compile_message(payload)
+        stats = await mailing.run_broadcast(
+            bot, mailing_data, segment, rate, window=window, load_monitor=load_monitor,
+            campaign_id=campaign_id, delivery_log=delivery_log
+        )
+        await db.finish_broadcast(broadcast_id, 'done', stats['success'], stats['failed'])
+        logger.info(
+            f"✅ Отложенная рассылка {broadcast_id} завершена: "
+            f"{stats['success']}/{stats['processed']} за {stats['duration']:.0f}с"
+        )
+    except asyncio.CancelledError:
+        # Рассылка не уложилась в срок остановки бота
+        logger.warning(f"⏸ Отложенная рассылка {broadcast_id} прервана остановкой бота")
+        await db.finish_broadcast(broadcast_id, 'interrupted')
+        raise
+    except Exception as e:
+        logger.error(f"❌ Ошибка отложенной рассылки {broadcast_id}: {e}")
+        await db.finish_broadcast(broadcast_id, 'failed')
+
+
+@tracked_job
+async def start_due_broadcasts():
+    """Запуск отложенных рассылок, время которых наступило"""
+    try:
+        for broadcast_id, payload, segment, rate, window, campaign_id in await db.claim_due_broadcasts():
+            task = asyncio.create_task(
+                run_scheduled_broadcast(broadcast_id, payload, segment, rate, window, campaign_id)
+            )
+            broadcast_tasks.add(task)
+            task.add_done_callback(broadcast_tasks.discard)
+    except Exception as e:
+        logger.error(f"❌ Ошибка в start_due_broadcasts: {e}")
+
+
 @dp.message(CommandStart())
 async def cmd_start(message: types.Message):
     """Обработчик команды /start - показывает кнопку подписки"""
@@ -123,90 +308,85 @@ async def cmd_start(message: types.Message):
     # Проверяем, является ли пользователь администратором
     if is_admin(user.id):
         # Показываем администратору панель управления
-        admin_keyboard = ReplyKeyboardBuilder()
-        admin_keyboard.button(text="📊 Статистика")
-        admin_keyboard.button(text="📨 Сделать рассылку")
-        admin_keyboard.button(text="💬 Просмотреть комментарии")
-        admin_keyboard.adjust(2)
-
         await message.answer(
             "👋 Добро пожаловать в панель администратора!",
-            reply_markup=admin_keyboard.as_markup(resize_keyboard=True)
+            reply_markup=ADMIN_KEYBOARD
         )
         return
 
     # Для обычных пользователей показываем кнопку подписки
-    is_subscribed = await db.is_user_subscribed(user.id)
+    is_subscribed = await subscription_cache.is_subscribed(user.id)
 
     if is_subscribed:
         # Если уже подписан, показываем информацию
-        welcome_keyboard = ReplyKeyboardBuilder()
-        welcome_keyboard.button(text="💬 Оставить комментарий")
-        welcome_keyboard.button(text="📞 Связаться с поддержкой")
-
         await message.answer(
             "✅ Вы уже подписаны на рассылку!\n\n"
             "Вы будете получать уведомления о новых курсах автоматически.",
-            reply_markup=welcome_keyboard.as_markup(resize_keyboard=True)
+            reply_markup=SUBSCRIBED_KEYBOARD
         )
     else:
         # Если не подписан, показываем кнопку подписки
-        subscribe_keyboard = ReplyKeyboardBuilder()
-        subscribe_keyboard.button(text="✅ Подписаться на рассылку")
-
         await message.answer(
             "👋 Добро пожаловать в IT Courses Bot!\n\n"
             "Подпишитесь на рассылку, чтобы получать лучшие курсы "
             "по программированию и искусственному интеллекту.",
-            reply_markup=subscribe_keyboard.as_markup(resize_keyboard=True)
+            reply_markup=SUBSCRIBE_KEYBOARD
         )
 
 
-@dp.message(F.text == "✅ Подписаться на рассылку")
+@text_router.route("✅ Подписаться на рассылку")
 async def subscribe_user(message: types.Message):
     """Обработчик подписки на рассылку"""
     user = message.from_user
 
     try:
-        # Добавляем пользователя в базу
-        await db.add_subscriber(user.id, user.username or "No username", user.first_name or "No name")
+        campaign = await campaign_cache.get(db.WELCOME_CAMPAIGN)
+        if campaign is None:
+            logger.error(f"❌ Нет корректной версии приветственной серии, подписка {user.id} не выполнена")
+            await message.answer("❌ Произошла ошибка при подписке. Попробуйте позже.")
+            return
+
+        # Добавляем пользователя в базу (с версией серии, по которой он пойдет)
+        await db.add_subscriber(
+            user.id, user.username or "No username", user.first_name or "No name", campaign.version
+        )
+        subscription_cache.add(user.id)
 
         # Отправляем первое приветственное сообщение сразу
-        first_message = db.WELCOME_MESSAGES[0]
+        first_message = campaign.messages[0]
         await send_media_message(user.id, first_message)
 
         # Планируем остальные сообщения
         scheduled_count = 0
-        for i, msg_data in enumerate(db.WELCOME_MESSAGES[1:], 1):
-            await db.add_scheduled_message(user.id, i, msg_data["delay_minutes"])
+        for i, msg_data in enumerate(campaign.messages[1:], 1):
+            await db.add_scheduled_message(user.id, i, msg_data.delay_minutes)
             scheduled_count += 1
 
         # Меняем клавиатуру после подписки
-        welcome_keyboard = ReplyKeyboardBuilder()
-        welcome_keyboard.button(text="💬 Оставить комментарий")
-        welcome_keyboard.button(text="📞 Связаться с поддержкой")
-
         await message.answer(
             "🎉 Отлично! Вы успешно подписались на рассылку!\n\n"
             "В ближайшее время вы получите подборки лучших IT-курсов. "
             "Оставайтесь на связи! 📚",
-            reply_markup=welcome_keyboard.as_markup(resize_keyboard=True)
+            reply_markup=SUBSCRIBED_KEYBOARD
         )
 
-        logger.info(f"✅ Пользователь {user.id} подписался на рассылку")
+        logger.info(
+            "✅ Пользователь подписался на рассылку",
+            extra=fields(event="subscriber_added", user_id=user.id, version=campaign.version)
+        )
 
     except Exception as e:
         logger.error(f"❌ Ошибка при подписке пользователя {user.id}: {e}")
         await message.answer("❌ Произошла ошибка при подписке. Попробуйте позже.")
 
 
-@dp.message(F.text == "💬 Оставить комментарий")
+@text_router.route("💬 Оставить комментарий")
 async def start_comment(message: types.Message):
     """Начало процесса комментирования"""
     user = message.from_user
 
     # Проверяем, подписан ли пользователь
-    is_subscribed = await db.is_user_subscribed(user.id)
+    is_subscribed = await subscription_cache.is_subscribed(user.id)
 
     if not is_subscribed:
         await message.answer("❌ Чтобы оставить комментарий, необходимо сначала подписаться на рассылку.")
@@ -218,7 +398,7 @@ async def start_comment(message: types.Message):
     )
 
 
-@dp.message(F.text == "📞 Связаться с поддержкой")
+@text_router.route("📞 Связаться с поддержкой")
 async def contact_support(message: types.Message):
     """Связь с поддержкой"""
     await message.answer(
@@ -229,7 +409,7 @@ async def contact_support(message: types.Message):
     )
 
 
-@dp.message(F.text == "📊 Статистика")
+@text_router.route("📊 Статистика")
 async def show_stats(message: types.Message):
     """Показать статистику (только для администратора)"""
     user = message.from_user
@@ -239,16 +419,27 @@ async def show_stats(message: types.Message):
         return
 
     try:
-        subscribers = await db.get_all_subscribers()
-        all_users = await db.get_all_users()
-        comments = await db.get_all_comments()
+        subscribers_count = await db.count_subscribers()
+        users_count = await db.count_users()
+        comments_count = await db.count_comments()
+        welcome = await campaign_cache.get(db.WELCOME_CAMPAIGN)
+        schedule = f"{len(welcome.messages)} (версия {welcome.version})" if welcome else "нет корректной версии"
 
         stats_text = (
             f"📊 <b>Статистика бота</b>\n\n"
-            f"👥 Активных подписчиков: {len(subscribers)}\n"
-            f"👤 Всего пользователей: {len(all_users)}\n"
-            f"💬 Комментариев: {len(comments)}\n"
-            f"🕒 Сообщений в расписании: {len(db.WELCOME_MESSAGES)}"
+            f"👥 Активных подписчиков: {subscribers_count}\n"
+            f"👤 Всего пользователей: {users_count}\n"
+            f"💬 Комментариев: {comments_count}\n"
+            f"🕒 Сообщений в расписании: {schedule}\n"
+            f"🚦 Ограничено апдейтов: отброшено {throttling.stats['dropped']}, "
+            f"отложено {throttling.stats['delayed']}\n"
+            f"📈 Нагрузка: {load_monitor.inbound_rate:.1f} апд./с, "
+            f"запись в базу {load_monitor.write_latency * 1000:.0f} мс\n"
+            f"🧵 Очередь апдейтов: {update_queue.depth}/{update_queue.max_size}, "
+            f"в обработке {update_queue.in_progress}/{update_queue.concurrency}, "
+            f"ожидание ср. {update_queue.average_wait * 1000:.0f} мс, "
+            f"макс. {update_queue.stats['max_wait'] * 1000:.0f} мс, "
+            f"polling ждал {update_queue.stats['blocked']} раз"
         )
         await message.answer(stats_text, parse_mode=ParseMode.HTML)
 
@@ -257,7 +448,7 @@ async def show_stats(message: types.Message):
         await message.answer("❌ Ошибка получения статистики")
 
 
-@dp.message(F.text == "📨 Сделать рассылку")
+@text_router.route("📨 Сделать рассылку")
 async def start_mailing(message: types.Message):
     """Запуск ручной рассылки (только для администратора)"""
     user = message.from_user
@@ -269,12 +460,15 @@ async def start_mailing(message: types.Message):
     await message.answer(
         "📨 Для запуска рассылки выполните команду:\n\n"
         "<code>python manual_mailing.py</code>\n\n"
-        "в отдельном окне терминала.",
+        "в отдельном окне терминала.\n\n"
+        "Без вопросов и по расписанию (ночью, силами бота):\n"
+        "<code>python manual_mailing.py --template t.json --dry-run</code>\n"
+        "<code>python manual_mailing.py --template t.json --at \"2026-01-01 03:00\"</code>",
         parse_mode=ParseMode.HTML
     )
 
 
-@dp.message(F.text == "💬 Просмотреть комментарии")
+@text_router.route("💬 Просмотреть комментарии")
 async def show_comments(message: types.Message):
     """Просмотр комментариев (только для администратора)"""
     user = message.from_user
@@ -301,7 +495,8 @@ async def show_comments(message: types.Message):
             )
 
         if len(comments) > 5:
-            comments_text += f"... и еще {len(comments) - 5} комментариев"
+            comments_text += f"... и еще {len(comments) - 5} комментариев\n\n"
+            comments_text += "🔎 Для поиска используйте: <code>/search текст</code>"
 
         await message.answer(comments_text, parse_mode=ParseMode.HTML)
 
@@ -310,8 +505,188 @@ async def show_comments(message: types.Message):
         await message.answer("❌ Ошибка получения комментариев")
 
 
-# Обработчик всех текстовых сообщений (для комментариев)
+async def render_search_page(query: str, page: int):
+    """Формирование текста и клавиатуры для страницы результатов поиска"""
+    rows, has_more = await db.search_comments(
+        query, limit=SEARCH_PAGE_SIZE, offset=page * SEARCH_PAGE_SIZE
+    )
+
+    if not rows:
+        if page == 0:
+            return f"🔎 По запросу «{html.escape(query)}» ничего не найдено.", None
+        return "🔎 Больше результатов нет.", None
+
+    text = f"🔎 <b>Результаты поиска:</b> «{html.escape(query)}» (стр. {page + 1})\n\n"
+    for i, row in enumerate(rows, page * SEARCH_PAGE_SIZE + 1):
+        id, user_id, username, first_name, snippet, created_at = row
+        # Экранируем текст и только потом подсвечиваем совпадения
+        snippet = html.escape(snippet).replace("\x02", "<b>").replace("\x03", "</b>")
+        text += (
+            f"{i}. <b>{html.escape(first_name)}</b> (@{html.escape(username)}, id {user_id})\n"
+            f"   📝 {snippet}\n"
+            f"   ⏰ {created_at}\n\n"
+        )
+
+    keyboard = None
+    if page > 0 or has_more:
+        builder = InlineKeyboardBuilder()
+        if page > 0:
+            builder.button(text="◀️ Назад", callback_data=f"search:{page - 1}")
+        if has_more:
+            builder.button(text="Вперед ▶️", callback_data=f"search:{page + 1}")
+        keyboard = builder.as_markup()
+
+    return text, keyboard
+
+
+@dp.message(Command("search"))
+async def search_comments(message: types.Message, command: CommandObject, state: FSMContext):
+    """Полнотекстовый поиск по комментариям (только для администратора)"""
+    user = message.from_user
+
+    if not is_admin(user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer(
+            "🔎 Использование: <code>/search текст</code>\n\n"
+            "Например: <code>/search python курс</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    try:
+        # Запрос храним в состоянии, чтобы не упираться в лимит callback_data
+        await state.update_data(search_query=query)
+        text, keyboard = await render_search_page(query, 0)
+        await message.answer(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+
+    except Exception as e:
+        logger.error(f"Ошибка поиска комментариев: {e}")
+        await message.answer("❌ Ошибка поиска комментариев")
+
+
+@dp.message(Command("reload"))
+async def reload_campaigns(message: types.Message):
+    """Немедленная перезагрузка кампаний из базы (только для администратора)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+
+    try:
+        updated = await campaign_cache.refresh()
+        if updated:
+            await message.answer(f"🔄 Обновлены кампании: {', '.join(updated)}")
+        else:
+            await message.answer("✅ Кампании актуальны, изменений нет")
+
+    except Exception as e:
+        logger.error(f"Ошибка перезагрузки кампаний: {e}")
+        await message.answer("❌ Ошибка перезагрузки кампаний")
+
+
+@dp.message(Command("profile"))
+async def profile_event_loop(message: types.Message, command: CommandObject):
+    """Снятие профиля цикла событий (только для администратора, режим диагностики)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+
+    if not diagnostics.is_enabled():
+        await message.answer("🩺 Диагностика выключена. Запустите бота с DIAGNOSTICS=1")
+        return
+
+    args = (command.args or "").strip()
+    seconds = min(float(args), 60.0) if args.replace(".", "", 1).isdigit() else 5.0
+
+    try:
+        await message.answer(f"🩺 Снимаю профиль {seconds:.0f} с...")
+        path, summary = await diagnostics.dump_profile(seconds)
+        await message.answer(
+            f"🩺 Профиль сохранен: <code>{html.escape(path)}</code>\n\n"
+            f"<pre>{html.escape(summary)}</pre>",
+            parse_mode=ParseMode.HTML
+        )
+
+    except Exception as e:
+        logger.error(f"Ошибка профилирования: {e}")
+        await message.answer(f"❌ Ошибка профилирования: {html.escape(str(e))}")
+
+
+@dp.message(Command("slowlog"))
+async def show_slow_queries(message: types.Message):
+    """Статистика времени запросов к базе (только для администратора)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+
+    if not diagnostics.is_enabled():
+        await message.answer("🩺 Диагностика выключена. Запустите бота с DIAGNOSTICS=1")
+        return
+
+    report = diagnostics.format_query_stats() or "Запросов пока не было"
+    await message.answer(
+        f"🐢 <b>Запросы к базе</b>\n\n<pre>{html.escape(report)}</pre>",
+        parse_mode=ParseMode.HTML
+    )
+
+
+@dp.message(Command("delivery"))
+async def show_delivery_report(message: types.Message, command: CommandObject):
+    """Отчет о доставке по кампаниям и стадиям: /delivery [часов] (только для администратора)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет доступа к этой команде.")
+        return
+
+    try:
+        hours = int(command.args) if command.args else 24
+    except ValueError:
+        await message.answer("Использование: /delivery [часов], например /delivery 72")
+        return
+
+    # Записи из буфера тоже должны попасть в отчет
+    await delivery_log.flush()
+    report = format_delivery_report(await db.get_delivery_report(hours)) or "Отправок не было"
+    await message.answer(
+        f"📬 <b>Доставка за {hours} ч</b>\n\n<pre>{html.escape(report)}</pre>",
+        parse_mode=ParseMode.HTML
+    )
+
+
+@dp.callback_query(F.data.startswith("search:"))
+async def search_comments_page(callback: types.CallbackQuery, state: FSMContext):
+    """Переключение страниц результатов поиска"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет доступа к этой команде.")
+        return
+
+    data = await state.get_data()
+    query = data.get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите команду /search")
+        return
+
+    try:
+        page = max(int(callback.data.split(":", 1)[1]), 0)
+        text, keyboard = await render_search_page(query, page)
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+        await callback.answer()
+
+    except Exception as e:
+        logger.error(f"Ошибка поиска комментариев: {e}")
+        await callback.answer("❌ Ошибка поиска комментариев")
+
+
+# Обработчик всех текстовых сообщений: кнопки и комментарии
 @dp.message(F.text)
+async def route_text_message(message: types.Message):
+    """Маршрутизация текстовых сообщений через text_router"""
+    await text_router.dispatch(message)
+
+
+@text_router.fallback
 async def handle_user_message(message: types.Message):
     """Обработчик всех текстовых сообщений от пользователей"""
     user = message.from_user
@@ -323,55 +698,180 @@ async def handle_user_message(message: types.Message):
         return
 
     # Проверяем, подписан ли пользователь
-    is_subscribed = await db.is_user_subscribed(user.id)
+    is_subscribed = await subscription_cache.is_subscribed(user.id)
 
     if not is_subscribed:
         # Если не подписан, показываем кнопку подписки
-        subscribe_keyboard = ReplyKeyboardBuilder()
-        subscribe_keyboard.button(text="✅ Подписаться на рассылку")
-
         await message.answer(
             "❌ Чтобы отправлять сообщения, необходимо подписаться на рассылку.",
-            reply_markup=subscribe_keyboard.as_markup(resize_keyboard=True)
+            reply_markup=SUBSCRIBE_KEYBOARD
         )
         return
 
     # Сохраняем сообщение как комментарий
     try:
+        started = time.perf_counter()
         await db.add_comment(
             user.id,
             user.username or "No username",
             user.first_name or "No name",
             message.text
         )
+        load_monitor.record_write(time.perf_counter() - started)
 
         await message.answer(
             "✅ Ваш комментарий сохранен!\n\n"
             "Спасибо за ваше мнение! Мы обязательно его учтем. 💫"
         )
-        logger.info(f"💬 Сохранен комментарий от пользователя {user.id}")
+        logger.info("💬 Сохранен комментарий", extra=fields(event="comment_saved", user_id=user.id))
 
     except Exception as e:
         logger.error(f"❌ Ошибка сохранения комментария: {e}")
         await message.answer("❌ Произошла ошибка при сохранении комментария.")
 
 
+def warm_state() -> dict:
+    """Содержимое снимка кэшей"""
+    return {
+        "subscriptions": subscription_cache.snapshot(),
+        "media_file_ids": media_file_ids.snapshot(),
+    }
+
+
+async def save_warm_state():
+    """Запись снимка кэшей (в отдельном потоке, чтобы не задерживать цикл событий)"""
+    try:
+        await asyncio.to_thread(save_snapshot, SNAPSHOT_PATH, warm_state())
+    except Exception as e:
+        logger.error(f"❌ Не удалось сохранить снимок состояния: {e}")
+
+
+def restore_warm_state():
+    """Загрузка кэшей из снимка прошлого запуска
+
+    Возраст снимка целиком не ограничивается: устаревшие подписки отсекает
+    SubscriptionCache.restore, а file_id остаются действительными долго
+    (отклоненный Telegram file_id отбрасывается при отправке).
+    """
+    snapshot = load_snapshot(SNAPSHOT_PATH)
+    if snapshot is None:
+        return
+    subscriptions = subscription_cache.restore(snapshot.get("subscriptions", []))
+    file_ids = media_file_ids.restore(snapshot.get("media_file_ids", {}))
+    logger.info(
+        "♻️ Кэши загружены из снимка",
+        extra=fields(event="warm_state_restored", subscriptions=subscriptions, media_file_ids=file_ids)
+    )
+
+
+async def shutdown(scheduler):
+    """Плавная остановка в пределах SHUTDOWN_TIMEOUT
+
+    Polling к этому моменту уже остановлен. Порядок: новые задачи
+    планировщика не запускаются, очередь апдейтов и начатые отправки
+    дорабатывают, журнал доставки записывается, кэши сохраняются в снимок.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SHUTDOWN_TIMEOUT
+    stopping.set()
+
+    # pause(), а не shutdown(): shutdown отменяет уже выполняющиеся задачи
+    if scheduler is not None and scheduler.running:
+        scheduler.pause()
+
+    left = await update_queue.drain(deadline - loop.time())
+    if left:
+        logger.warning(f"⚠️ Не обработано апдейтов при остановке: {left}")
+
+    tasks = running_jobs | broadcast_tasks
+    if tasks:
+        logger.info(f"⏳ Ожидание фоновых задач: {len(tasks)}")
+        _, unfinished = await asyncio.wait(tasks, timeout=max(deadline - loop.time(), 0))
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            await asyncio.wait(unfinished)
+            logger.warning(f"⚠️ Прервано фоновых задач: {len(unfinished)}")
+
+    if scheduler is not None and scheduler.running:
+        scheduler.shutdown(wait=False)
+
+    await delivery_log.flush()
+    await save_warm_state()
+
+
 async def main():
     """Основная функция запуска бота"""
+    scheduler = None
     try:
+        if DIAGNOSTICS:
+            diagnostics.enable(
+                asyncio.get_running_loop(),
+                slow_callback=SLOW_CALLBACK_SECONDS,
+                slow_query=SLOW_QUERY_SECONDS,
+                modules=(db,)
+            )
+
         # Инициализируем базу данных
         await db.create_tables()
         logger.info("✅ База данных инициализирована")
 
+        await campaign_cache.refresh()
+        logger.info("✅ Кампании загружены")
+
+        restore_warm_state()
+
         # Запускаем планировщик
         scheduler = AsyncIOScheduler()
 
-        # Задача для приветственных сообщений (каждую минуту)
+        # Задача для приветственных сообщений (каждую минуту, первый раз - сразу,
+        # чтобы сообщения, наступившие за время перезапуска, не ждали минуту)
         scheduler.add_job(
             send_scheduled_welcome,
             'interval',
             minutes=1,
-            id='welcome_messages'
+            id='welcome_messages',
+            next_run_time=datetime.now()
+        )
+
+        # Задача для отложенных рассылок (каждую минуту)
+        scheduler.add_job(
+            start_due_broadcasts,
+            'interval',
+            minutes=1,
+            id='scheduled_broadcasts'
+        )
+
+        # Задача для горячей перезагрузки кампаний (каждые 30 секунд)
+        scheduler.add_job(
+            campaign_cache.refresh,
+            'interval',
+            seconds=30,
+            id='campaign_reload'
+        )
+
+        # Пакетная запись журнала доставки (каждые 10 секунд)
+        scheduler.add_job(
+            delivery_log.flush,
+            'interval',
+            seconds=10,
+            id='delivery_log_flush'
+        )
+
+        # Свертка журнала доставки в почасовые итоги (каждые 10 минут)
+        scheduler.add_job(
+            db.rollup_deliveries,
+            'interval',
+            minutes=10,
+            id='delivery_rollup'
+        )
+
+        # Снимок кэшей на случай аварийной остановки (каждые 10 минут)
+        scheduler.add_job(
+            save_warm_state,
+            'interval',
+            minutes=10,
+            id='warm_state_snapshot'
         )
 
         # Задача для очистки старых сообщений (раз в день)
@@ -379,20 +879,28 @@ async def main():
             db.cleanup_old_messages,
             'interval',
             hours=24,
-            id='cleanup'
+            id='cleanup',
+            kwargs={'archive_path': os.getenv("CLEANUP_ARCHIVE_PATH")}
         )
 
         scheduler.start()
         logger.info("✅ Планировщик запущен")
 
+        # Обработчики очереди апдейтов; polling без задач на каждый апдейт,
+        # чтобы заполненная очередь притормаживала получение новых
+        update_queue.start()
+
         # Запускаем бота
         logger.info("🚀 Бот запускается...")
-        await dp.start_polling(bot)
+        # Сессию бота закрывает shutdown(): после polling еще дорабатывают отправки
+        await dp.start_polling(bot, handle_as_tasks=False, close_bot_session=False)
 
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}")
     finally:
+        await shutdown(scheduler)
         await bot.session.close()
+        await db.close()
         logger.info("🛑 Бот остановлен")
 
 
@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+# Добавляем путь для импорта database
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import database as db
+from payloads import compile_message, validate_message
+
+logger = logging.getLogger(__name__)
+
+
+def validate_campaign(name: str, payload):
+    """Проверка данных кампании перед публикацией"""
+    if name == db.WELCOME_CAMPAIGN:
+        if not isinstance(payload, list) or not payload:
+            raise ValueError("Приветственная серия должна быть непустым списком сообщений")
+        for stage, message_data in enumerate(payload):
+            try:
+                validate_message(message_data)
+                if not isinstance(message_data.get("delay_minutes"), int):
+                    raise ValueError("delay_minutes должен быть целым числом")
+            except ValueError as e:
+                raise ValueError(f"Сообщение {stage}: {e}") from None
+    else:
+        validate_message(payload)
+
+
+class Campaign:
+    """Загруженная версия кампании со скомпилированными сообщениями
+
+    messages - кортеж CompiledMessage (для шаблона рассылки - из одного
+    элемента): клавиатуры собраны и сообщения проверены один раз при
+    загрузке, а не при каждой отправке. id - строка таблицы campaigns,
+    под этим номером отправки попадают в журнал доставки.
+    """
+
+    def __init__(self, name: str, version: int, payload, campaign_id: int = 0):
+        self.name = name
+        self.version = version
+        self.id = campaign_id
+        raw_messages = payload if isinstance(payload, list) else [payload]
+        self.messages = tuple(compile_message(message_data) for message_data in raw_messages)
+
+    @property
+    def template(self):
+        """Первое (для шаблона рассылки - единственное) сообщение"""
+        return self.messages[0]
+
+
+class CampaignCache:
+    """Кэш версий кампаний в памяти процесса с горячей перезагрузкой
+
+    refresh() сверяет последние версии в базе и подгружает новые - его
+    вызывает планировщик, поэтому изменения применяются без перезапуска
+    бота. Старые версии остаются в кэше: пользователи, начавшие серию по
+    версии N, получают ее до конца.
+
+    Версия, которая не проходит проверку, пропускается с ошибкой в логе:
+    используется предыдущая корректная версия.
+    """
+
+    def __init__(self):
+        self._campaigns = {}
+        self._latest = {}
+        # (name, version) версий, которые не удалось скомпилировать
+        self._invalid = set()
+
+    async def refresh(self):
+        """Подгрузка новых версий из базы, возвращает список обновленных кампаний"""
+        updated = []
+        latest_versions = await db.get_latest_campaign_versions()
+        for name, version in latest_versions.items():
+            current = self._latest.get(name, 0)
+            # От последней версии к уже загруженной - до первой корректной
+            for candidate in range(version, current, -1):
+                if (name, candidate) in self._invalid:
+                    continue
+                campaign = await self._load(name, candidate)
+                if campaign is not None:
+                    self._latest[name] = candidate
+                    updated.append(name)
+                    logger.info(f"🔄 Загружена кампания {name}, версия {candidate}")
+                    break
+        return updated
+
+    async def get(self, name: str, version: int = None):
+        """Кампания нужной версии (по умолчанию - последней)
+
+        Возвращает None, если у кампании нет ни одной корректной версии
+        (нет в базе или все версии не проходят проверку).
+        """
+        if version is None:
+            if name not in self._latest:
+                await self.refresh()
+            return self.latest(name)
+
+        campaign = self._campaigns.get((name, version))
+        if campaign is None and (name, version) not in self._invalid:
+            campaign = await self._load(name, version)
+        if campaign is None:
+            logger.warning(f"Версия {version} кампании {name} не найдена, используется последняя")
+            campaign = self.latest(name)
+        return campaign
+
+    def latest(self, name: str):
+        """Последняя загруженная версия кампании (без обращения к базе) или None"""
+        version = self._latest.get(name)
+        return None if version is None else self._campaigns[(name, version)]
+
+    async def _load(self, name: str, version: int):
+        row = await db.get_campaign(name, version)
+        if row is None:
+            return None
+        try:
+            campaign = Campaign(name, row[0], row[1], await db.get_campaign_id(name, row[0]))
+        except ValueError as e:
+            self._invalid.add((name, row[0]))
+            logger.error(f"❌ Версия {row[0]} кампании {name} некорректна и пропущена: {e}")
+            return None
+        self._campaigns[(name, campaign.version)] = campaign
+        return campaign
+
+
+async def publish(name: str, path: str):
+    """Публикация новой версии кампании из JSON-файла"""
+    with open(path, encoding="utf-8") as f:
+        payload = json.load(f)
+
+    try:
+        validate_campaign(name, payload)
+    except ValueError as e:
+        print(f"❌ Кампания не прошла проверку: {e}")
+        return
+
+    await db.create_tables()
+    version = await db.add_campaign_version(name, payload)
+    print(f"✅ Кампания {name}: опубликована версия {version}")
+    print("Бот подхватит ее автоматически в течение минуты")
+
+
+async def export(name: str, path: str, version: int = None):
+    """Выгрузка версии кампании в JSON-файл для редактирования"""
+    await db.create_tables()
+    row = await db.get_campaign(name, version)
+    if row is None:
+        print(f"❌ Кампания {name} не найдена")
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(row[1], f, ensure_ascii=False, indent=4)
+    print(f"✅ Кампания {name}, версия {row[0]} сохранена в {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Управление версиями кампаний")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Выгрузить кампанию в JSON")
+    export_parser.add_argument("name", help=f"{db.WELCOME_CAMPAIGN} или {db.MAILING_CAMPAIGN}")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--version", type=int)
+
+    publish_parser = subparsers.add_parser("publish", help="Опубликовать новую версию из JSON")
+    publish_parser.add_argument("name", help=f"{db.WELCOME_CAMPAIGN} или {db.MAILING_CAMPAIGN}")
+    publish_parser.add_argument("path")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        asyncio.run(export(args.name, args.path, args.version))
+    else:
+        asyncio.run(publish(args.name, args.path))
@@ -0,0 +1,73 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MediaCircuitBreaker:
+    """Автомат отключения неработающих media URL в цепочке отправки
+
+    Для каждого URL считаются ошибки подряд. После failure_threshold
+    ошибок URL "размыкается": allow() возвращает False, и отправка сразу
+    переходит к следующему варианту цепочки (видео → заглушка-фото → текст)
+    без лишних запросов к API. Раз в probe_interval секунд пропускается
+    одна пробная попытка: если она успешна, URL снова считается рабочим.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+
+    def __init__(self, failure_threshold: int = 3, probe_interval: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+        # url -> {"state", "failures", "successes", "opened_at", "skipped"}
+        self._circuits = {}
+
+    def _circuit(self, url: str) -> dict:
+        circuit = self._circuits.get(url)
+        if circuit is None:
+            circuit = {"state": self.CLOSED, "failures": 0, "successes": 0,
+                       "opened_at": 0.0, "skipped": 0}
+            self._circuits[url] = circuit
+        return circuit
+
+    def allow(self, url: str) -> bool:
+        """Можно ли сейчас пробовать отправку с этим URL"""
+        circuit = self._circuit(url)
+        if circuit["state"] == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if now - circuit["opened_at"] >= self.probe_interval:
+            # Пробная попытка; до ее результата следующая проба - через интервал
+            circuit["opened_at"] = now
+            logger.info(f"Пробная отправка с отключенным URL {url}")
+            return True
+
+        circuit["skipped"] += 1
+        return False
+
+    def record_success(self, url: str):
+        circuit = self._circuit(url)
+        circuit["successes"] += 1
+        circuit["failures"] = 0
+        if circuit["state"] == self.OPEN:
+            circuit["state"] = self.CLOSED
+            logger.info(f"✅ URL снова работает: {url}")
+
+    def record_failure(self, url: str):
+        circuit = self._circuit(url)
+        circuit["failures"] += 1
+        if circuit["state"] == self.OPEN:
+            circuit["opened_at"] = time.monotonic()
+        elif circuit["failures"] >= self.failure_threshold:
+            circuit["state"] = self.OPEN
+            circuit["opened_at"] = time.monotonic()
+            logger.warning(f"⚠️ URL отключен после {circuit['failures']} ошибок подряд: {url}")
+
+    def summary(self) -> dict:
+        """Состояние по каждому URL: {url: (состояние, успехи, пропущено вызовов)}"""
+        return {
+            url: (circuit["state"], circuit["successes"], circuit["skipped"])
+            for url, circuit in self._circuits.items()
+        }
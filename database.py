@@ -1,9 +1,26 @@
 import aiosqlite
+import asyncio
+import gzip
+import json
 import logging
+import os
+import time
+from dotenv import load_dotenv
 
 logger = logging.getLogger(__name__)
 
-# Схема приветственных сообщений для новых подписчиков
+# Настройки хранилища читаются при импорте, а модуль импортируется раньше,
+# чем bot.py и утилиты загружают .env, - поэтому загружаем его здесь
+load_dotenv()
+
+# Файл базы SQLite. Если задан DATABASE_URL (postgresql://...), вместо
+# SQLite используется PostgreSQL - см. выбор хранилища в конце модуля
+DATABASE_PATH = os.getenv("DATABASE_PATH", "bot_database.db")
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+# Схема приветственных сообщений для новых подписчиков.
+# Используется как первая версия кампании "welcome" при создании базы;
+# актуальные версии хранятся в таблице campaigns (см. campaigns.py)
 WELCOME_MESSAGES = [
     {
         "delay_minutes": 0,
@@ -182,9 +199,59 @@ WELCOME_MESSAGES = [
     }
 ]
 
+# Шаблон ручной рассылки по умолчанию - первая версия кампании "mailing"
+DEFAULT_MAILING_TEMPLATE = {
+    "delay_minutes": 1,
+    "text": """Вот наша первая подборка бесплатных курсов по ИТ и Искусственному Интеллекту, которые помогут вам начать или прокачать свои навыки:
+🔹<a href="https://ihclick.ru/?p=134225&o=290774&idp=313569&erid=LdtCKCxkP">Курс - Профессии и языки программирования: что выбрать?</a>               
+🔹<a href="https://EagleStar.programsite.ru/freemakeup2?erid=2VtzqucPohF">Бесплатный подробный видеокурс по HTML и CSS – основе любого сайта!</a>
+🔹<a href="https://EagleStar.programsite.ru/freejava?erid=2VtzqumHjPK">Освой Java в бесплатном обучающем Видеокурсе!</a>
+🔹<a href="https://EagleStar.programsite.ru/freejs?erid=2Vtzqxbr2Bf">Основы JavaScript, jQuery и Ajax бесплатно</a>
+🔹<a href="https://ihclick.ru/?p=134225&o=290561&idp=313569&erid=LdtCKCxkP">Введение в SQL и работу с базами данных</a>
+🔹<a href="https://ihclick.ru/?p=239390&o=324988&idp=313569&erid=2VtzqxE3VwU">Мастер-класс «Топ-12 нейросетей для вашей работы и жизни»</a>
+🔹<a href="https://ihclick.ru/?p=194430&o=304508&idp=313569&erid=2Vtzqx5QYhE">Практикум «Легкий старт в нейросетях для новичков»</a>
+🔹<a href="https://ihclick.ru/?p=262041&o=324507&idp=313569&erid=2VtzqvZXttv">Интенсив «Быстрый старт с нейросетями»</a>
+🔹<a href="https://ihclick.ru/?p=325067&o=293409&idp=313569&erid=5jtCeReNwxHpfQTDve31wmc">Бесплатный курс «Основы Go»</a>
+🔹<a href="https://ihclick.ru/?p=286608&o=292538&idp=313569&erid=LdtCKBHZy">Профессия «Python-разработчик с нуля»</a>
+Выбирайте интересующее направление, изучайте вместе с нами и делайте первые шаги к своей новой профессиональной сфере!""",
+    "media_type": "photo",
+    "media_url": "https://cloud.mail.ru/public/gcwZ/NQuSLFKSJ",
+    "button_text": "🚀 Записаться на курс",
+    "button_url": "https://example.com/ml-course"
+}
+
+# Названия кампаний в таблице campaigns
+WELCOME_CAMPAIGN = "welcome"
+MAILING_CAMPAIGN = "mailing"
+
+# Схема журнала доставки (нужна и при создании, и при миграции таблицы)
+DELIVERY_LOG_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS delivery_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        campaign_id INTEGER NOT NULL,
+        stage INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status INTEGER NOT NULL,
+        latency_ms INTEGER NOT NULL,
+        created_at INTEGER NOT NULL
+    )
+'''
+
+
+async def close():
+    """Освобождение ресурсов хранилища (для SQLite соединения открываются на вызов)"""
+
+
 async def create_tables():
     """Создание таблиц базы данных с автоматической миграцией"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        # Новая база сразу создается с incremental auto_vacuum, чтобы очистка
+        # могла возвращать место на диске небольшими порциями. Режим должен
+        # быть задан до создания первой таблицы.
+        cursor = await db.execute("SELECT COUNT(*) FROM sqlite_master")
+        if (await cursor.fetchone())[0] == 0:
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
         # Таблица подписчиков
         await db.execute('''
             CREATE TABLE IF NOT EXISTS subscribers (
@@ -193,7 +260,8 @@ async def create_tables():
                 first_name TEXT,
                 subscribed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 welcome_stage INTEGER DEFAULT 0,
-                is_active BOOLEAN DEFAULT TRUE
+                is_active BOOLEAN DEFAULT TRUE,
+                campaign_version INTEGER DEFAULT 1
             )
         ''')
 
@@ -205,10 +273,16 @@ async def create_tables():
                 message_stage INTEGER,
                 scheduled_for TIMESTAMP,
                 sent BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                claimed_at TIMESTAMP
             )
         ''')
 
+        # Индекс для поиска границ очистки по дате создания
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_scheduled_messages_created_at ON scheduled_messages (created_at)"
+        )
+
         # Таблица комментариев
         await db.execute('''
             CREATE TABLE IF NOT EXISTS comments (
@@ -221,6 +295,147 @@ async def create_tables():
             )
         ''')
 
+        # Таблица отложенных рассылок (запускаются планировщиком бота)
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                rate REAL NOT NULL,
+                window_seconds REAL,
+                campaign_id INTEGER DEFAULT 0,
+                run_at TIMESTAMP NOT NULL,
+                status TEXT DEFAULT 'pending',
+                sent_count INTEGER DEFAULT 0,
+                failed_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        ''')
+
+        # Таблица версий кампаний (приветственная серия, шаблон рассылки).
+        # Версии не изменяются - правка текста публикуется новой версией
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS campaigns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (name, version)
+            )
+        ''')
+
+        # Первые версии кампаний берутся из кода (если их еще нет в базе)
+        await db.executemany(
+            "INSERT OR IGNORE INTO campaigns (name, version, payload) VALUES (?, 1, ?)",
+            [
+                (WELCOME_CAMPAIGN, json.dumps(WELCOME_MESSAGES, ensure_ascii=False)),
+                (MAILING_CAMPAIGN, json.dumps(DEFAULT_MAILING_TEMPLATE, ensure_ascii=False)),
+            ]
+        )
+
+        # Журнал доставки: строка на каждую отправку, только целые числа.
+        # created_at - секунды Unix, latency_ms - длительность отправки.
+        # AUTOINCREMENT: после удаления всех строк id не начинаются заново
+        # и не попадают ниже границы свертки (delivery_rollup_state.last_id)
+        await db.execute(DELIVERY_LOG_SCHEMA)
+
+        # Почасовые итоги журнала доставки по кампании, стадии и статусу
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS delivery_rollup (
+                campaign_id INTEGER NOT NULL,
+                stage INTEGER NOT NULL,
+                hour INTEGER NOT NULL,
+                status INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                latency_ms_sum INTEGER NOT NULL,
+                latency_ms_max INTEGER NOT NULL,
+                PRIMARY KEY (campaign_id, stage, hour, status)
+            ) WITHOUT ROWID
+        ''')
+
+        # Граница свертки: строки журнала с id <= last_id уже учтены в итогах
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS delivery_rollup_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_id INTEGER NOT NULL
+            )
+        ''')
+        await db.execute("INSERT OR IGNORE INTO delivery_rollup_state (id, last_id) VALUES (1, 0)")
+
+        # ✅ МИГРАЦИЯ: журнал доставки без AUTOINCREMENT пересоздается, а счетчик
+        # id поднимается до границы свертки (журнал хранит только последние часы)
+        cursor = await db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'delivery_log'")
+        if "AUTOINCREMENT" not in (await cursor.fetchone())[0].upper():
+            await db.execute("ALTER TABLE delivery_log RENAME TO delivery_log_old")
+            await db.execute(DELIVERY_LOG_SCHEMA)
+            await db.execute("INSERT INTO delivery_log SELECT * FROM delivery_log_old")
+            await db.execute("DROP TABLE delivery_log_old")
+            await db.execute(
+                """INSERT INTO sqlite_sequence (name, seq)
+                   SELECT 'delivery_log', last_id FROM delivery_rollup_state
+                   WHERE id = 1 AND NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'delivery_log')"""
+            )
+            await db.execute(
+                """UPDATE sqlite_sequence SET seq = MAX(seq, (SELECT last_id FROM delivery_rollup_state WHERE id = 1))
+                   WHERE name = 'delivery_log'"""
+            )
+            logger.info("Миграция: журнал доставки пересоздан с AUTOINCREMENT")
+        await db.execute("CREATE INDEX IF NOT EXISTS idx_delivery_log_user_id ON delivery_log (user_id)")
+
+        # Индекс для сегментации рассылок по наличию комментариев
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_comments_user_id ON comments (user_id)"
+        )
+
+        # Полнотекстовый индекс по комментариям (FTS5, external content).
+        # Индекс хранит только токены, сам текст остается в comments.
+        cursor = await db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'comments_fts'"
+        )
+        fts_exists = await cursor.fetchone() is not None
+
+        await db.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts USING fts5(
+                message_text,
+                username,
+                first_name,
+                content='comments',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3'
+            )
+        ''')
+
+        # Триггеры поддерживают индекс в синхронизации с таблицей comments
+        await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS comments_fts_ai AFTER INSERT ON comments BEGIN
+                INSERT INTO comments_fts (rowid, message_text, username, first_name)
+                VALUES (new.id, new.message_text, new.username, new.first_name);
+            END
+        ''')
+        await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS comments_fts_ad AFTER DELETE ON comments BEGIN
+                INSERT INTO comments_fts (comments_fts, rowid, message_text, username, first_name)
+                VALUES ('delete', old.id, old.message_text, old.username, old.first_name);
+            END
+        ''')
+        await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS comments_fts_au AFTER UPDATE ON comments BEGIN
+                INSERT INTO comments_fts (comments_fts, rowid, message_text, username, first_name)
+                VALUES ('delete', old.id, old.message_text, old.username, old.first_name);
+                INSERT INTO comments_fts (rowid, message_text, username, first_name)
+                VALUES (new.id, new.message_text, new.username, new.first_name);
+            END
+        ''')
+
+        if not fts_exists:
+            # ✅ МИГРАЦИЯ: индексируем комментарии, сохраненные до появления FTS
+            await db.execute("INSERT INTO comments_fts (comments_fts) VALUES ('rebuild')")
+            logger.info("Миграция: построен полнотекстовый индекс комментариев")
+
         # ✅ МИГРАЦИЯ: Добавляем столбец is_active если его нет
         try:
             await db.execute("ALTER TABLE subscribers ADD COLUMN is_active BOOLEAN DEFAULT TRUE")
@@ -232,26 +447,101 @@ async def create_tables():
             else:
                 logger.warning(f"Ошибка при миграции is_active: {e}")
 
+        # ✅ МИГРАЦИЯ: версия приветственной серии, по которой идет пользователь
+        try:
+            await db.execute("ALTER TABLE subscribers ADD COLUMN campaign_version INTEGER DEFAULT 1")
+            logger.info("Миграция: добавлен столбец campaign_version")
+        except aiosqlite.OperationalError as e:
+            if "duplicate column name" in str(e):
+                logger.debug("Столбец campaign_version уже существует")
+            else:
+                logger.warning(f"Ошибка при миграции campaign_version: {e}")
+
+        # ✅ МИГРАЦИЯ: окно равномерной отправки для отложенных рассылок
+        try:
+            await db.execute("ALTER TABLE scheduled_broadcasts ADD COLUMN window_seconds REAL")
+            logger.info("Миграция: добавлен столбец window_seconds")
+        except aiosqlite.OperationalError as e:
+            if "duplicate column name" in str(e):
+                logger.debug("Столбец window_seconds уже существует")
+            else:
+                logger.warning(f"Ошибка при миграции window_seconds: {e}")
+
+        # ✅ МИГРАЦИЯ: кампания отложенной рассылки для журнала доставки
+        try:
+            await db.execute("ALTER TABLE scheduled_broadcasts ADD COLUMN campaign_id INTEGER DEFAULT 0")
+            logger.info("Миграция: добавлен столбец campaign_id")
+        except aiosqlite.OperationalError as e:
+            if "duplicate column name" in str(e):
+                logger.debug("Столбец campaign_id уже существует")
+            else:
+                logger.warning(f"Ошибка при миграции campaign_id: {e}")
+
+        # ✅ МИГРАЦИЯ: время захвата сообщения обработчиком (claim_pending_messages)
+        try:
+            await db.execute("ALTER TABLE scheduled_messages ADD COLUMN claimed_at TIMESTAMP")
+            logger.info("Миграция: добавлен столбец claimed_at")
+        except aiosqlite.OperationalError as e:
+            if "duplicate column name" in str(e):
+                logger.debug("Столбец claimed_at уже существует")
+            else:
+                logger.warning(f"Ошибка при миграции claimed_at: {e}")
+
+        # Индекс для выборки неотправленных сообщений, время которых наступило
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_scheduled_messages_due ON scheduled_messages (sent, scheduled_for)"
+        )
+
         await db.commit()
+
+        # Существующей базе режим включается только полным VACUUM, который
+        # блокирует базу на все время перезаписи, - поэтому не при запуске,
+        # а отдельной командой обслуживания
+        cursor = await db.execute("PRAGMA auto_vacuum")
+        if (await cursor.fetchone())[0] != 2:
+            logger.warning(
+                "⚠️ auto_vacuum не INCREMENTAL: очистка не возвращает место на диске. "
+                "Включить (полный VACUUM, база блокируется): python database.py vacuum"
+            )
     logger.info("Таблицы базы данных созданы/проверены")
 
 
-async def add_subscriber(user_id: int, username: str, first_name: str):
+async def enable_incremental_vacuum():
+    """Включение incremental auto_vacuum для существующей базы SQLite
+
+    Выполняет полный VACUUM: база перезаписывается целиком и все это время
+    заблокирована, поэтому запускать при остановленном боте.
+    """
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute("PRAGMA auto_vacuum")
+        if (await cursor.fetchone())[0] == 2:
+            logger.info("auto_vacuum = INCREMENTAL уже включен")
+            return False
+
+        logger.warning(f"⏳ Полный VACUUM базы {DATABASE_PATH}: база заблокирована до завершения")
+        started = time.perf_counter()
+        await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        await db.execute("VACUUM")
+        logger.warning(f"✅ Включен режим auto_vacuum = INCREMENTAL за {time.perf_counter() - started:.1f}с")
+        return True
+
+
+async def add_subscriber(user_id: int, username: str, first_name: str, campaign_version: int = 1):
     """Добавление нового подписчика"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute(
             """INSERT OR REPLACE INTO subscribers 
-               (user_id, username, first_name, welcome_stage, is_active) 
-               VALUES (?, ?, ?, 0, TRUE)""",
-            (user_id, username, first_name)
+               (user_id, username, first_name, welcome_stage, is_active, campaign_version) 
+               VALUES (?, ?, ?, 0, TRUE, ?)""",
+            (user_id, username, first_name, campaign_version)
         )
         await db.commit()
-    logger.info(f"Добавлен подписчик: {user_id}")
+    logger.debug("Добавлен подписчик: %s", user_id)
 
 
 async def add_scheduled_message(user_id: int, message_stage: int, delay_minutes: int):
     """Добавление запланированного сообщения"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute(
             """INSERT INTO scheduled_messages 
                (user_id, message_stage, scheduled_for) 
@@ -263,9 +553,9 @@ async def add_scheduled_message(user_id: int, message_stage: int, delay_minutes:
 
 async def get_pending_messages():
     """Получение сообщений, готовых к отправке"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         cursor = await db.execute('''
-            SELECT sm.id, sm.user_id, sm.message_stage, s.username
+            SELECT sm.id, sm.user_id, sm.message_stage, s.username, s.campaign_version
             FROM scheduled_messages sm
             JOIN subscribers s ON sm.user_id = s.user_id
             WHERE sm.sent = FALSE AND sm.scheduled_for <= datetime('now')
@@ -275,9 +565,65 @@ async def get_pending_messages():
         return rows
 
 
+async def claim_pending_messages(limit: int = 500, lease_minutes: int = 10):
+    """Захват сообщений, готовых к отправке: [(id, user_id, stage, username, версия)]
+
+    Захваченные строки помечаются claimed_at в том же запросе, поэтому
+    несколько обработчиков не отправят одно сообщение дважды. Если
+    обработчик не отметил сообщение отправленным (ошибка или падение),
+    через lease_minutes его снова можно захватить.
+    """
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute(
+            """UPDATE scheduled_messages
+               SET claimed_at = CURRENT_TIMESTAMP
+               WHERE id IN (
+                   SELECT sm.id FROM scheduled_messages sm
+                   JOIN subscribers s ON sm.user_id = s.user_id
+                   WHERE sm.sent = FALSE AND sm.scheduled_for <= datetime('now')
+                     AND (sm.claimed_at IS NULL OR sm.claimed_at <= datetime('now', ?))
+                   ORDER BY sm.scheduled_for ASC
+                   LIMIT ?
+               )
+               RETURNING id""",
+            (f"-{lease_minutes} minutes", limit)
+        )
+        claimed = [row[0] for row in await cursor.fetchall()]
+
+        # RETURNING в SQLite не видит других таблиц - данные подписчика
+        # дочитываем в той же транзакции
+        cursor = await db.execute(
+            """SELECT sm.id, sm.user_id, sm.message_stage, s.username, s.campaign_version
+               FROM scheduled_messages sm
+               JOIN subscribers s ON sm.user_id = s.user_id
+               WHERE sm.id IN (SELECT value FROM json_each(?))
+               ORDER BY sm.id""",
+            (json.dumps(claimed),)
+        )
+        rows = await cursor.fetchall()
+        await db.commit()
+        # id растет в порядке стадий серии
+        return rows
+
+
+async def release_messages(message_ids):
+    """Снятие захвата с неотправленных сообщений (при остановке бота)
+
+    Такие сообщения снова доступны для claim_pending_messages сразу, а не
+    после истечения захвата.
+    """
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        await db.execute(
+            """UPDATE scheduled_messages SET claimed_at = NULL
+               WHERE id IN (SELECT value FROM json_each(?)) AND sent = FALSE""",
+            (json.dumps([int(message_id) for message_id in message_ids]),)
+        )
+        await db.commit()
+
+
 async def mark_message_sent(message_id: int):
     """Отметка сообщения как отправленного"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute(
             "UPDATE scheduled_messages SET sent = TRUE WHERE id = ?",
             (message_id,)
@@ -287,7 +633,7 @@ async def mark_message_sent(message_id: int):
 
 async def update_welcome_stage(user_id: int, new_stage: int):
     """Обновление стадии приветственных сообщений"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute(
             "UPDATE subscribers SET welcome_stage = ? WHERE user_id = ?",
             (new_stage, user_id)
@@ -297,23 +643,327 @@ async def update_welcome_stage(user_id: int, new_stage: int):
 
 async def get_all_subscribers():
     """Получение всех активных подписчиков"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         cursor = await db.execute("SELECT user_id FROM subscribers WHERE is_active = TRUE")
         rows = await cursor.fetchall()
         return [row[0] for row in rows]
 
 
+async def get_latest_campaign_versions():
+    """Последние версии всех кампаний: {название: версия}"""
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute("SELECT name, MAX(version) FROM campaigns GROUP BY name")
+        rows = await cursor.fetchall()
+        return dict(rows)
+
+
+async def get_campaign(name: str, version: int = None):
+    """Получение кампании: (версия, данные) или None
+
+    Без version возвращается последняя версия.
+    """
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        if version is None:
+            cursor = await db.execute(
+                "SELECT version, payload FROM campaigns WHERE name = ? ORDER BY version DESC LIMIT 1",
+                (name,)
+            )
+        else:
+            cursor = await db.execute(
+                "SELECT version, payload FROM campaigns WHERE name = ? AND version = ?",
+                (name, version)
+            )
+        row = await cursor.fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+
+async def add_campaign_version(name: str, payload):
+    """Публикация новой версии кампании, возвращает номер версии"""
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute(
+            """INSERT INTO campaigns (name, version, payload)
+               SELECT ?, COALESCE(MAX(version), 0) + 1, ? FROM campaigns WHERE name = ?
+               RETURNING version""",
+            (name, json.dumps(payload, ensure_ascii=False), name)
+        )
+        row = await cursor.fetchone()
+        await db.commit()
+    logger.info(f"Опубликована версия {row[0]} кампании {name}")
+    return row[0]
+
+
+async def add_scheduled_broadcast(payload: dict, segment: dict, rate: float, run_at: str,
+                                  window_seconds: float = None, campaign_id: int = 0):
+    """Планирование рассылки на время run_at (UTC, 'ГГГГ-ММ-ДД ЧЧ:ММ:СС')
+
+    campaign_id - строка campaigns, под которой отправки попадут в журнал
+    доставки (0 - шаблон не из базы).
+    """
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute(
+            """INSERT INTO scheduled_broadcasts (payload, segment, rate, window_seconds, run_at, campaign_id)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (json.dumps(payload, ensure_ascii=False), json.dumps(segment), rate, window_seconds, run_at,
+             campaign_id or 0)
+        )
+        await db.commit()
+        broadcast_id = cursor.lastrowid
+    logger.info(f"Запланирована рассылка {broadcast_id} на {run_at} UTC")
+    return broadcast_id
+
+
+async def claim_due_broadcasts():
+    """Захват рассылок, время которых наступило: [(id, данные, сегмент, скорость, окно, кампания)]
+
+    Статус меняется на running в том же запросе, поэтому рассылка не будет
+    запущена дважды.
+    """
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute(
+            """UPDATE scheduled_broadcasts
+               SET status = 'running', started_at = CURRENT_TIMESTAMP
+               WHERE status = 'pending' AND run_at <= datetime('now')
+               RETURNING id, payload, segment, rate, window_seconds, campaign_id"""
+        )
+        rows = await cursor.fetchall()
+        await db.commit()
+        return [(row[0], json.loads(row[1]), json.loads(row[2]), row[3], row[4], row[5] or 0) for row in rows]
+
+
+async def finish_broadcast(broadcast_id: int, status: str, sent_count: int = 0, failed_count: int = 0):
+    """Отметка завершения отложенной рассылки"""
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        await db.execute(
+            """UPDATE scheduled_broadcasts
+               SET status = ?, sent_count = ?, failed_count = ?, finished_at = CURRENT_TIMESTAMP
+               WHERE id = ?""",
+            (status, sent_count, failed_count, broadcast_id)
+        )
+        await db.commit()
+
+
+def _subscriber_filters(welcome_stage: int = None, subscribed_from: str = None,
+                        subscribed_to: str = None, has_commented: bool = None,
+                        user_ids=None):
+    """Построение условия WHERE для выборки активных подписчиков"""
+    conditions = ["s.is_active = TRUE"]
+    params = []
+
+    if welcome_stage is not None:
+        conditions.append("s.welcome_stage = ?")
+        params.append(welcome_stage)
+    if subscribed_from is not None:
+        conditions.append("s.subscribed_at >= ?")
+        params.append(subscribed_from)
+    if subscribed_to is not None:
+        conditions.append("s.subscribed_at < ?")
+        params.append(subscribed_to)
+    if has_commented is not None:
+        exists = "EXISTS (SELECT 1 FROM comments c WHERE c.user_id = s.user_id)"
+        conditions.append(exists if has_commented else f"NOT {exists}")
+    if user_ids is not None:
+        # Список передается одним JSON-параметром - без лимита на число переменных
+        conditions.append("s.user_id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps([int(user_id) for user_id in user_ids]))
+
+    return " AND ".join(conditions), params
+
+
+async def count_subscribers(**filters):
+    """Количество активных подписчиков, подходящих под фильтры"""
+    where, params = _subscriber_filters(**filters)
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute(f"SELECT COUNT(*) FROM subscribers s WHERE {where}", params)
+        row = await cursor.fetchone()
+        return row[0]
+
+
+async def iter_subscribers(chunk_size: int = 1000, **filters):
+    """Потоковый перебор активных подписчиков с фильтрацией на стороне SQLite
+
+    Фильтры: welcome_stage, subscribed_from/subscribed_to (границы
+    subscribed_at), has_commented, user_ids. Подписчики читаются страницами
+    по первичному ключу (user_id > последнего), поэтому память не зависит от
+    размера базы, а между страницами не удерживается блокировка чтения -
+    долгая рассылка не мешает боту писать в базу.
+    """
+    where, params = _subscriber_filters(**filters)
+    last_user_id = None
+
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        while True:
+            if last_user_id is None:
+                query = f"SELECT s.user_id FROM subscribers s WHERE {where} ORDER BY s.user_id LIMIT ?"
+                cursor = await db.execute(query, (*params, chunk_size))
+            else:
+                query = (f"SELECT s.user_id FROM subscribers s WHERE {where} AND s.user_id > ? "
+                         f"ORDER BY s.user_id LIMIT ?")
+                cursor = await db.execute(query, (*params, last_user_id, chunk_size))
+
+            rows = await cursor.fetchmany(chunk_size)
+            await cursor.close()
+            if not rows:
+                return
+
+            for row in rows:
+                yield row[0]
+
+            last_user_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                return
+
+
 async def get_all_users():
     """Получение всех пользователей (включая неактивных)"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         cursor = await db.execute("SELECT user_id, username, first_name, subscribed_at, is_active FROM subscribers")
         rows = await cursor.fetchall()
         return rows
 
 
+async def count_users():
+    """Количество всех пользователей (включая неактивных)"""
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM subscribers")
+        row = await cursor.fetchone()
+        return row[0]
+
+
+async def count_comments():
+    """Количество комментариев"""
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM comments")
+        row = await cursor.fetchone()
+        return row[0]
+
+
+SUBSCRIBER_EXPORT_COLUMNS = (
+    "user_id", "username", "first_name", "subscribed_at", "welcome_stage", "is_active", "campaign_version"
+)
+COMMENT_EXPORT_COLUMNS = ("id", "user_id", "username", "first_name", "message_text", "created_at")
+
+
+async def _iter_table_chunks(table: str, key: str, columns, chunk_size: int):
+    """Постраничное чтение таблицы по первичному ключу (key > последнего)"""
+    select = f"SELECT {', '.join(columns)} FROM {table}"
+    key_index = columns.index(key)
+    last_key = None
+
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        while True:
+            if last_key is None:
+                cursor = await db.execute(f"{select} ORDER BY {key} LIMIT ?", (chunk_size,))
+            else:
+                cursor = await db.execute(f"{select} WHERE {key} > ? ORDER BY {key} LIMIT ?",
+                                          (last_key, chunk_size))
+            rows = await cursor.fetchall()
+            await cursor.close()
+            if not rows:
+                return
+            yield rows
+            last_key = rows[-1][key_index]
+            if len(rows) < chunk_size:
+                return
+
+
+def iter_subscriber_chunks(chunk_size: int = 10000):
+    """Выгрузка всех подписчиков порциями (SUBSCRIBER_EXPORT_COLUMNS)"""
+    return _iter_table_chunks("subscribers", "user_id", SUBSCRIBER_EXPORT_COLUMNS, chunk_size)
+
+
+def iter_comment_chunks(chunk_size: int = 10000):
+    """Выгрузка всех комментариев порциями (COMMENT_EXPORT_COLUMNS)"""
+    return _iter_table_chunks("comments", "id", COMMENT_EXPORT_COLUMNS, chunk_size)
+
+
+async def import_subscriber_batch(rows, campaign_version: int = 1, welcome_schedule=None,
+                                  stagger_minutes: int = 0):
+    """Массовое добавление подписчиков одной транзакцией
+
+    rows - кортежи в порядке SUBSCRIBER_EXPORT_COLUMNS: (user_id, username,
+    first_name, subscribed_at, welcome_stage, is_active, campaign_version);
+    None в последних четырех - значение по умолчанию (сейчас, стадия 0,
+    активен, campaign_version). Существующим подписчикам обновляются только
+    username/first_name, их стадия и расписание не меняются.
+
+    Для новых активных подписчиков, если передан welcome_schedule
+    [(стадия, задержка в минутах), ...], сразу планируется приветственная
+    серия: все стадии, если welcome_stage не указан, иначе только стадии
+    после welcome_stage (задержки отсчитываются от нее). stagger_minutes
+    случайно сдвигает старт серии, чтобы импорт не создал один огромный
+    пик отправки.
+
+    Возвращает количество новых подписчиков.
+    """
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        await db.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS import_batch (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                subscribed_at TIMESTAMP,
+                welcome_stage INTEGER,
+                is_active BOOLEAN,
+                campaign_version INTEGER,
+                offset_minutes INTEGER
+            )
+        ''')
+        await db.execute("DELETE FROM import_batch")
+        await db.executemany(
+            """INSERT OR REPLACE INTO import_batch
+               (user_id, username, first_name, subscribed_at, welcome_stage, is_active, campaign_version,
+                offset_minutes)
+               VALUES (?, ?, ?, ?, ?, COALESCE(?, TRUE), COALESCE(?, ?),
+                       CASE WHEN ? > 0 THEN abs(random()) % ? ELSE 0 END)""",
+            ((user_id, username, first_name, subscribed_at, welcome_stage, is_active, version,
+              campaign_version, stagger_minutes, stagger_minutes)
+             for user_id, username, first_name, subscribed_at, welcome_stage, is_active, version in rows)
+        )
+
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM import_batch b WHERE NOT EXISTS "
+            "(SELECT 1 FROM subscribers s WHERE s.user_id = b.user_id)"
+        )
+        new_count = (await cursor.fetchone())[0]
+
+        if welcome_schedule:
+            # Задержка стадии по ее номеру - для отсчета от уже пройденной стадии
+            delays = dict(welcome_schedule)
+            await db.execute(
+                """INSERT INTO scheduled_messages (user_id, message_stage, scheduled_for)
+                   SELECT b.user_id, json_extract(st.value, '$[0]'),
+                          datetime('now', '+' || (
+                              max(json_extract(st.value, '$[1]')
+                                  - COALESCE(json_extract(?, '$[' || b.welcome_stage || ']'), 0), 0)
+                              + b.offset_minutes
+                          ) || ' minutes')
+                   FROM import_batch b, json_each(?) st
+                   WHERE b.is_active AND json_extract(st.value, '$[0]') > COALESCE(b.welcome_stage, -1)
+                     AND NOT EXISTS (SELECT 1 FROM subscribers s WHERE s.user_id = b.user_id)""",
+                (json.dumps([delays.get(stage, 0) for stage in range(max(delays) + 1)]),
+                 json.dumps(list(welcome_schedule)))
+            )
+
+        await db.execute(
+            """INSERT INTO subscribers
+               (user_id, username, first_name, subscribed_at, welcome_stage, is_active, campaign_version)
+               SELECT user_id, username, first_name, COALESCE(subscribed_at, CURRENT_TIMESTAMP),
+                      COALESCE(welcome_stage, 0), is_active, campaign_version
+               FROM import_batch WHERE TRUE
+               ON CONFLICT (user_id) DO UPDATE SET
+                   username = excluded.username,
+                   first_name = excluded.first_name"""
+        )
+        await db.execute("DELETE FROM import_batch")
+        await db.commit()
+    return new_count
+
+
 async def is_user_subscribed(user_id: int):
     """Проверка, подписан ли пользователь"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         try:
             cursor = await db.execute("SELECT user_id FROM subscribers WHERE user_id = ? AND is_active = TRUE",
                                       (user_id,))
@@ -332,7 +982,7 @@ async def is_user_subscribed(user_id: int):
 
 async def add_comment(user_id: int, username: str, first_name: str, message_text: str):
     """Добавление комментария от пользователя"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         await db.execute(
             """INSERT INTO comments 
                (user_id, username, first_name, message_text) 
@@ -340,23 +990,327 @@ async def add_comment(user_id: int, username: str, first_name: str, message_text
             (user_id, username, first_name, message_text)
         )
         await db.commit()
-    logger.info(f"Добавлен комментарий от пользователя: {user_id}")
+    logger.debug("Добавлен комментарий от пользователя: %s", user_id)
 
 
 async def get_all_comments():
     """Получение всех комментариев"""
-    async with aiosqlite.connect('bot_database.db') as db:
+    async with aiosqlite.connect(DATABASE_PATH) as db:
         cursor = await db.execute(
-            "SELECT id, user_id, username, first_name, message_text, created_at FROM comments ORDER BY created_at DESC")
+            "SELECT id, user_id, username, first_name, message_text, created_at FROM comments "
+            "ORDER BY created_at DESC, id DESC")
         rows = await cursor.fetchall()
         return rows
 
 
-async def cleanup_old_messages():
-    """Очистка старых отправленных сообщений"""
-    async with aiosqlite.connect('bot_database.db') as db:
-        await db.execute(
-            "DELETE FROM scheduled_messages WHERE sent = TRUE AND created_at < datetime('now', '-7 days')"
+async def cleanup_old_messages(chunk_size: int = 500, pause: float = 0.05,
+                               archive_path: str = None, vacuum_pages: int = 200,
+                               retention_days: int = 7):
+    """Очистка старых отправленных сообщений небольшими порциями
+
+    Строки удаляются диапазонами id по chunk_size штук, каждая порция - в
+    отдельной короткой транзакции, между порциями управление возвращается
+    циклу событий. Так блокировка записи не задерживает обработчики и
+    рассылку. Если указан archive_path, удаленные строки дописываются в
+    gzip-файл в формате JSON Lines. Освободившиеся страницы возвращаются
+    через PRAGMA incremental_vacuum.
+
+    Возвращает словарь с метриками прогона.
+    """
+    started = time.perf_counter()
+    stats = {
+        "rows_deleted": 0,
+        "chunks": 0,
+        "lock_time": 0.0,
+        "max_lock_time": 0.0,
+        "pages_freed": 0,
+        "duration": 0.0,
+    }
+
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        # Граница фиксируется один раз, чтобы все порции удаляли один и тот же срез
+        cursor = await db.execute("SELECT datetime('now', ?)", (f"-{retention_days} days",))
+        cutoff = (await cursor.fetchone())[0]
+
+        # Только отправленные: неотправленные строки (например, пользователь
+        # заблокировал бота) не удаляются и не должны растягивать диапазон
+        cursor = await db.execute(
+            "SELECT MIN(id), MAX(id) FROM scheduled_messages WHERE sent = TRUE AND created_at < ?",
+            (cutoff,)
+        )
+        min_id, max_id = await cursor.fetchone()
+
+        if min_id is not None:
+            for low in range(min_id, max_id + 1, chunk_size):
+                lock_started = time.perf_counter()
+                cursor = await db.execute(
+                    """DELETE FROM scheduled_messages
+                       WHERE id BETWEEN ? AND ? AND sent = TRUE AND created_at < ?
+                       RETURNING id, user_id, message_stage, scheduled_for, sent, created_at""",
+                    (low, low + chunk_size - 1, cutoff)
+                )
+                rows = await cursor.fetchall()
+
+                # Сначала архив, потом фиксация удаления: если архив не записан
+                # (нет места, неверный путь), строки остаются в базе
+                if rows and archive_path:
+                    try:
+                        await asyncio.to_thread(_archive_rows, archive_path, rows)
+                    except Exception:
+                        await db.rollback()
+                        raise
+                await db.commit()
+                lock_time = time.perf_counter() - lock_started
+
+                stats["chunks"] += 1
+                stats["rows_deleted"] += len(rows)
+                stats["lock_time"] += lock_time
+                stats["max_lock_time"] = max(stats["max_lock_time"], lock_time)
+
+                await asyncio.sleep(pause)
+
+        # Возвращаем свободные страницы файлу тоже порциями
+        while True:
+            cursor = await db.execute("PRAGMA freelist_count")
+            free_pages = (await cursor.fetchone())[0]
+            if free_pages == 0:
+                break
+
+            lock_started = time.perf_counter()
+            await db.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})")
+            await db.commit()
+            lock_time = time.perf_counter() - lock_started
+
+            cursor = await db.execute("PRAGMA freelist_count")
+            freed = free_pages - (await cursor.fetchone())[0]
+            if freed <= 0:
+                # auto_vacuum не включен - освобождать нечего
+                break
+
+            stats["pages_freed"] += freed
+            stats["lock_time"] += lock_time
+            stats["max_lock_time"] = max(stats["max_lock_time"], lock_time)
+            await asyncio.sleep(pause)
+
+    stats["duration"] = time.perf_counter() - started
+    logger.info(
+        f"Очищены старые отправленные сообщения: удалено {stats['rows_deleted']} "
+        f"за {stats['chunks']} порций, освобождено страниц {stats['pages_freed']}, "
+        f"блокировка {stats['lock_time']:.3f}с (макс. {stats['max_lock_time']:.3f}с), "
+        f"всего {stats['duration']:.2f}с"
+    )
+    return stats
+
+
+def _archive_rows(archive_path: str, rows):
+    """Дописывание удаленных строк в сжатый архив (JSON Lines)"""
+    # Каждый вызов добавляет новый gzip-член - файл остается валидным gzip
+    with gzip.open(archive_path, 'at', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps({
+                "id": row[0],
+                "user_id": row[1],
+                "message_stage": row[2],
+                "scheduled_for": row[3],
+                "sent": bool(row[4]),
+                "created_at": row[5],
+            }, ensure_ascii=False) + "\n")
+
+
+def build_fts_query(text: str) -> str:
+    """Преобразование пользовательского ввода в безопасный запрос FTS5
+
+    Каждое слово берется в кавычки (чтобы операторы FTS5 не ломали запрос)
+    и ищется по префиксу: «курс» найдет «курсы», «курсов» и т.д.
+    """
+    terms = []
+    for word in text.split():
+        word = word.replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*')
+    return " ".join(terms)
+
+
+async def search_comments(query: str, limit: int = 5, offset: int = 0):
+    """Полнотекстовый поиск по комментариям с ранжированием (bm25)
+
+    Возвращает (rows, has_more). В message_text найденные слова обрамлены
+    символами \x02 и \x03 - их заменяет на разметку вызывающий код.
+    """
+    fts_query = build_fts_query(query)
+    if not fts_query:
+        return [], False
+
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        # Берем на одну строку больше, чтобы без COUNT(*) узнать о следующей странице
+        cursor = await db.execute(
+            """SELECT c.id, c.user_id, c.username, c.first_name,
+                      snippet(comments_fts, 0, char(2), char(3), '…', 24),
+                      c.created_at
+               FROM comments_fts
+               JOIN comments c ON c.id = comments_fts.rowid
+               WHERE comments_fts MATCH ?
+               ORDER BY comments_fts.rank
+               LIMIT ? OFFSET ?""",
+            (fts_query, limit + 1, offset)
+        )
+        rows = await cursor.fetchall()
+        return rows[:limit], len(rows) > limit
+
+
+async def get_campaign_id(name: str, version: int = None):
+    """id строки кампании в таблице campaigns (для журнала доставки) или None"""
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        if version is None:
+            cursor = await db.execute(
+                "SELECT id FROM campaigns WHERE name = ? ORDER BY version DESC LIMIT 1", (name,)
+            )
+        else:
+            cursor = await db.execute(
+                "SELECT id FROM campaigns WHERE name = ? AND version = ?", (name, version)
+            )
+        row = await cursor.fetchone()
+        return row[0] if row else None
+
+
+async def add_deliveries(records):
+    """Пакетная запись журнала доставки
+
+    records - кортежи (campaign_id, stage, user_id, status, latency_ms, created_at).
+    """
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        await db.executemany(
+            """INSERT INTO delivery_log (campaign_id, stage, user_id, status, latency_ms, created_at)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            records
         )
         await db.commit()
-    logger.info("Очищены старые отправленные сообщения")
\ No newline at end of file
+
+
+async def rollup_deliveries(settle_seconds: int = 300, raw_retention_hours: int = 48,
+                            chunk_size: int = 5000, pause: float = 0.05):
+    """Свертка журнала доставки в почасовые итоги и удаление старых строк
+
+    В итоги добавляются строки старше settle_seconds, еще не учтенные
+    (id > границы свертки) - граница и итоги обновляются одной
+    транзакцией, поэтому строка не учитывается дважды. Строки, уже
+    вошедшие в итоги и старше raw_retention_hours, удаляются порциями по
+    chunk_size. Возвращает {"rolled_up": ..., "pruned": ...}.
+    """
+    now = int(time.time())
+    stats = {"rolled_up": 0, "pruned": 0}
+
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute("SELECT last_id FROM delivery_rollup_state WHERE id = 1")
+        last_id = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "SELECT MAX(id) FROM delivery_log WHERE id > ? AND created_at < ?",
+            (last_id, now - settle_seconds)
+        )
+        upper_id = (await cursor.fetchone())[0]
+
+        if upper_id is not None:
+            cursor = await db.execute(
+                """INSERT INTO delivery_rollup
+                   (campaign_id, stage, hour, status, count, latency_ms_sum, latency_ms_max)
+                   SELECT campaign_id, stage, created_at - created_at % 3600, status,
+                          COUNT(*), SUM(latency_ms), MAX(latency_ms)
+                   FROM delivery_log
+                   WHERE id > ? AND id <= ?
+                   GROUP BY campaign_id, stage, created_at - created_at % 3600, status
+                   ON CONFLICT (campaign_id, stage, hour, status) DO UPDATE SET
+                       count = count + excluded.count,
+                       latency_ms_sum = latency_ms_sum + excluded.latency_ms_sum,
+                       latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)""",
+                (last_id, upper_id)
+            )
+            cursor = await db.execute(
+                "SELECT COUNT(*) FROM delivery_log WHERE id > ? AND id <= ?", (last_id, upper_id)
+            )
+            stats["rolled_up"] = (await cursor.fetchone())[0]
+            await db.execute("UPDATE delivery_rollup_state SET last_id = ? WHERE id = 1", (upper_id,))
+            await db.commit()
+            last_id = upper_id
+
+        # Удаляем только учтенные строки - короткими транзакциями, как при очистке сообщений
+        while True:
+            cursor = await db.execute(
+                """DELETE FROM delivery_log WHERE id IN (
+                       SELECT id FROM delivery_log WHERE id <= ? AND created_at < ? LIMIT ?
+                   )""",
+                (last_id, now - raw_retention_hours * 3600, chunk_size)
+            )
+            await db.commit()
+            stats["pruned"] += cursor.rowcount
+            if cursor.rowcount < chunk_size:
+                break
+            await asyncio.sleep(pause)
+
+    logger.info(
+        f"Журнал доставки: в итоги добавлено {stats['rolled_up']} строк, удалено {stats['pruned']}"
+    )
+    return stats
+
+
+async def get_delivery_report(since_hours: int = 24):
+    """Доставка и задержка по кампаниям и стадиям за последние since_hours часов
+
+    Читаются почасовые итоги и еще не свернутый хвост журнала (строки
+    после границы свертки), поэтому отчет не зависит от размера журнала.
+    Возвращает [(кампания, версия, стадия, доставлено, ошибок,
+    средняя задержка мс, максимальная задержка мс)]; для рассылок со
+    своим шаблоном кампания и версия - None.
+    """
+    since = int(time.time()) - since_hours * 3600
+    async with aiosqlite.connect(DATABASE_PATH) as db:
+        cursor = await db.execute(
+            """WITH totals AS (
+                   SELECT campaign_id, stage, status, count, latency_ms_sum, latency_ms_max
+                   FROM delivery_rollup WHERE hour >= ? - ? % 3600
+                   UNION ALL
+                   SELECT campaign_id, stage, status, COUNT(*), SUM(latency_ms), MAX(latency_ms)
+                   FROM delivery_log
+                   WHERE id > (SELECT last_id FROM delivery_rollup_state WHERE id = 1) AND created_at >= ?
+                   GROUP BY campaign_id, stage, status
+               )
+               -- status 1 - доставлено (delivery.STATUS_DELIVERED)
+               SELECT c.name, c.version, t.stage,
+                      SUM(CASE WHEN t.status = 1 THEN t.count ELSE 0 END),
+                      SUM(CASE WHEN t.status = 1 THEN 0 ELSE t.count END),
+                      SUM(t.latency_ms_sum) * 1.0 / SUM(t.count),
+                      MAX(t.latency_ms_max)
+               FROM totals t
+               LEFT JOIN campaigns c ON c.id = t.campaign_id
+               GROUP BY t.campaign_id, t.stage
+               ORDER BY c.name, c.version, t.stage""",
+            (since, since, since)
+        )
+        return await cursor.fetchall()
+
+
+# Выбор хранилища: при DATABASE_URL=postgresql://... функции модуля,
+# входящие в интерфейс storage.Storage, заменяются методами PostgreSQL.
+# Вызывающий код по-прежнему работает с database как с модулем.
+if DATABASE_URL.startswith(("postgres://", "postgresql://")):
+    from storage import STORAGE_API
+    from storage_postgres import PostgresStorage
+
+    _backend = PostgresStorage(DATABASE_URL, max_size=int(os.getenv("DATABASE_POOL_SIZE", "10")))
+    for _name in STORAGE_API:
+        globals()[_name] = getattr(_backend, _name)
+    logger.info("Хранилище: PostgreSQL")
+
+
+if __name__ == "__main__":
+    import argparse
+    from log_setup import setup_logging
+
+    setup_logging(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Обслуживание базы SQLite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("vacuum", help="Включить incremental auto_vacuum (полный VACUUM, бот должен быть остановлен)")
+
+    args = parser.parse_args()
+    if DATABASE_URL:
+        parser.error("команда только для SQLite, а задан DATABASE_URL")
+    asyncio.run(enable_incremental_vacuum())
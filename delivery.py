@@ -0,0 +1,76 @@
+import logging
+import time
+
+import database as db
+from log_setup import fields
+
+logger = logging.getLogger(__name__)
+
+# Коды статусов в журнале доставки (delivery_log.status)
+STATUS_DELIVERED = 1
+STATUS_FAILED = 2   # отправка не удалась (все варианты цепочки медиа → текст)
+STATUS_ERROR = 3    # исключение вне отправки (например, ошибка базы)
+
+STATUS_NAMES = {STATUS_DELIVERED: "доставлено", STATUS_FAILED: "ошибка", STATUS_ERROR: "сбой"}
+
+
+class DeliveryLog:
+    """Буфер журнала доставки с пакетной записью в базу
+
+    record() только добавляет кортеж в память; в базу записи уходят одним
+    executemany, когда набирается flush_size штук или при вызове flush()
+    (его периодически вызывает планировщик бота и run_broadcast в конце).
+    Строка журнала - только целые числа: кампания, стадия, получатель,
+    код статуса, задержка в мс и время в секундах Unix.
+    """
+
+    def __init__(self, flush_size: int = 500, max_buffer: int = 50000):
+        self.flush_size = flush_size
+        # Если база долго недоступна, старые записи отбрасываются сверх этого предела
+        self.max_buffer = max_buffer
+        self._buffer = []
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def record(self, campaign_id: int, stage: int, user_id: int, status: int, latency: float):
+        """Учет одной отправки; latency - длительность отправки в секундах"""
+        self._buffer.append((campaign_id or 0, stage, user_id, status, round(latency * 1000), int(time.time())))
+        if len(self._buffer) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        """Запись накопленных строк одной транзакцией"""
+        if not self._buffer:
+            return 0
+        records, self._buffer = self._buffer, []
+        try:
+            await db.add_deliveries(records)
+        except Exception as e:
+            # Записи вернутся в буфер и уйдут со следующей порцией
+            self._buffer[:0] = records
+            overflow = len(self._buffer) - self.max_buffer
+            if overflow > 0:
+                del self._buffer[:overflow]
+                self.dropped += overflow
+            logger.error("❌ Не удалось записать журнал доставки",
+                         extra=fields(event="delivery_log_failed", records=len(records), error=e))
+            return 0
+        self.written += len(records)
+        return len(records)
+
+
+def format_delivery_report(rows) -> str:
+    """Текстовый отчет по строкам database.get_delivery_report"""
+    lines = []
+    for name, version, stage, delivered, failed, avg_latency_ms, max_latency_ms in rows:
+        title = f"{name} v{version}" if name else "рассылка (свой шаблон)"
+        total = delivered + failed
+        lines.append(
+            f"{title}, стадия {stage}: {delivered}/{total} ({delivered * 100 / total:.1f}%), "
+            f"задержка ср. {avg_latency_ms:.0f} мс, макс. {max_latency_ms} мс"
+        )
+    return "\n".join(lines)
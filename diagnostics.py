@@ -0,0 +1,188 @@
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from log_setup import fields
+
+logger = logging.getLogger(__name__)
+
+# Статистика вызовов функций базы: имя -> [вызовов, суммарное время, максимум]
+query_stats = {}
+
+_loop_thread_id = None
+_profile_lock = threading.Lock()
+
+
+def enable(loop: asyncio.AbstractEventLoop, slow_callback: float = 0.1,
+           slow_query: float = 0.05, modules=(), profile_signal: bool = True):
+    """Включение режима диагностики
+
+    - asyncio debug: предупреждения о колбэках дольше slow_callback секунд;
+    - таймеры на всех async-функциях переданных модулей (database) с
+      журналом медленных запросов дольше slow_query секунд;
+    - дамп семплирующего профиля цикла событий по SIGUSR1.
+
+    Без вызова enable() код не оборачивается и накладных расходов нет.
+    Сам debug-режим asyncio заметно замедляет цикл - включайте его только
+    на время поиска проблемы.
+    """
+    global _loop_thread_id
+    _loop_thread_id = threading.get_ident()
+
+    loop.set_debug(True)
+    loop.slow_callback_duration = slow_callback
+    logging.getLogger("asyncio").setLevel(logging.WARNING)
+
+    for module in modules:
+        instrument_module(module, slow_query)
+
+    if profile_signal and hasattr(signal, "SIGUSR1"):
+        loop.add_signal_handler(signal.SIGUSR1, lambda: asyncio.ensure_future(_profile_on_signal()))
+
+    logger.info(
+        "🩺 Диагностика включена",
+        extra=fields(slow_callback=slow_callback, slow_query=slow_query)
+    )
+
+
+def is_enabled() -> bool:
+    return _loop_thread_id is not None
+
+
+def _record(name: str, elapsed: float, threshold: float):
+    stats = query_stats.setdefault(name, [0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += elapsed
+    stats[2] = max(stats[2], elapsed)
+    if elapsed >= threshold:
+        logger.warning(
+            "🐢 Медленный запрос",
+            extra=fields(event="slow_query", function=name, ms=round(elapsed * 1000, 1))
+        )
+
+
+def _timed(func, name: str, threshold: float):
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            # Для генераторов учитывается только время внутри генератора
+            elapsed = 0.0
+            agen = func(*args, **kwargs)
+            try:
+                while True:
+                    started = time.perf_counter()
+                    try:
+                        item = await agen.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        elapsed += time.perf_counter() - started
+                    yield item
+            finally:
+                await agen.aclose()
+                _record(name, elapsed, threshold)
+        return wrapper
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _record(name, time.perf_counter() - started, threshold)
+    return wrapper
+
+
+def instrument_module(module, threshold: float):
+    """Оборачивание всех публичных async-функций модуля таймером
+
+    Кроме функций, определенных в самом модуле, оборачиваются имена из
+    STORAGE_API - их database подменяет методами другого хранилища.
+    """
+    exported = set(getattr(module, "STORAGE_API", ()))
+    for attr, func in list(vars(module).items()):
+        if attr.startswith("_"):
+            continue
+        if attr not in exported and getattr(func, "__module__", None) != module.__name__:
+            continue
+        if inspect.iscoroutinefunction(func) or inspect.isasyncgenfunction(func):
+            setattr(module, attr, _timed(func, f"{module.__name__}.{attr}", threshold))
+
+
+def format_query_stats(limit: int = 10) -> str:
+    """Топ функций базы по суммарному времени"""
+    rows = sorted(query_stats.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    lines = []
+    for name, (count, total, maximum) in rows:
+        lines.append(
+            f"{name}: {count} вызовов, всего {total * 1000:.0f} мс, "
+            f"среднее {total / count * 1000:.1f} мс, макс {maximum * 1000:.1f} мс"
+        )
+    return "\n".join(lines)
+
+
+def _sample_stacks(thread_id: int, seconds: float, interval: float) -> Counter:
+    """Семплирование стека потока цикла событий из отдельного потока"""
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        if stack:
+            stacks[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+async def dump_profile(seconds: float = 5.0, interval: float = 0.005, directory: str = "."):
+    """Снятие семплирующего профиля цикла событий
+
+    Стеки пишутся в файл в формате collapsed stacks (подходит для
+    flamegraph.pl / speedscope). Возвращает (путь к файлу, сводку по
+    функциям, которые чаще всего были на вершине стека).
+    """
+    if _loop_thread_id is None:
+        raise RuntimeError("Диагностика не включена")
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("Профиль уже снимается")
+
+    try:
+        stacks = await asyncio.to_thread(_sample_stacks, _loop_thread_id, seconds, interval)
+    finally:
+        _profile_lock.release()
+
+    path = os.path.join(directory, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+
+    # Функции, чаще всего оказывавшиеся на вершине стека (select - простой цикла)
+    top = Counter()
+    for stack, count in stacks.items():
+        top[stack.rsplit(";", 1)[-1]] += count
+    total = sum(top.values()) or 1
+    summary = "\n".join(
+        f"{count * 100 / total:5.1f}% {frame}" for frame, count in top.most_common(10)
+    )
+
+    logger.info("🩺 Профиль цикла событий сохранен", extra=fields(path=path, samples=total))
+    return path, summary
+
+
+async def _profile_on_signal():
+    try:
+        path, summary = await dump_profile()
+        logger.info(f"🩺 Вершины стека:\n{summary}")
+    except RuntimeError as e:
+        logger.warning(f"Профиль не снят: {e}")
@@ -0,0 +1,144 @@
+import atexit
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Частые события об успехе пишутся в лог выборочно: 1 из N
+DEFAULT_SAMPLE_RATES = {
+    "welcome_sent": 20,
+    "comment_saved": 10,
+    "subscriber_added": 10,
+    "mailing_sent": 100,
+}
+
+_listener = None
+
+
+def fields(**kwargs) -> dict:
+    """Структурированные поля записи лога: logger.info("...", extra=fields(event=..., user_id=...))"""
+    return {"fields": kwargs}
+
+
+class StructuredFormatter(logging.Formatter):
+    """Форматтер, дописывающий структурированные поля в виде key=value"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        record_fields = getattr(record, "fields", None)
+        if record_fields:
+            text += " | " + " ".join(f"{key}={value}" for key, value in record_fields.items())
+        return text
+
+
+class SamplingFilter(logging.Filter):
+    """Выборка частых событий: из каждых N записей с event пропускается одна
+
+    Отбрасываемые записи не попадают в очередь вообще, поэтому их цена -
+    одна проверка словаря. Предупреждения и ошибки не отбрасываются.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = dict(rates)
+        self.counts = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        event = (getattr(record, "fields", None) or {}).get("event")
+        rate = self.rates.get(event)
+        if not rate or rate <= 1:
+            return True
+
+        count = self.counts.get(event, 0) + 1
+        self.counts[event] = count
+        if count % rate != 1:
+            return False
+        record.fields = {**record.fields, "sampled": f"1/{rate}", "total": count}
+        return True
+
+
+def setup_logging(level=logging.INFO, sample_rates: dict = None):
+    """Настройка неблокирующего логирования
+
+    Обработчики приложения только кладут записи в очередь (QueueHandler),
+    а вывод в консоль выполняет отдельный поток QueueListener - медленный
+    stdout не задерживает цикл событий. Повторный вызов ничего не делает.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    console = logging.StreamHandler()
+    console.setFormatter(StructuredFormatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(DEFAULT_SAMPLE_RATES if sample_rates is None else sample_rates))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Остановка потока логирования с выводом оставшихся записей"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class ProgressReporter:
+    """Агрегированные строки прогресса вместо строки на каждого получателя
+
+    update() вызывается на каждого получателя, но в лог пишется не чаще
+    одного раза в interval секунд.
+    """
+
+    def __init__(self, logger: logging.Logger, total: int = None, interval: float = 5.0,
+                 label: str = "Рассылка"):
+        self.logger = logger
+        self.total = total
+        self.interval = interval
+        self.label = label
+        self.success = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+
+    @property
+    def processed(self) -> int:
+        return self.success + self.failed
+
+    def update(self, success: bool):
+        if success:
+            self.success += 1
+        else:
+            self.failed += 1
+
+        now = time.monotonic()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._report(now, "progress")
+
+    def finish(self):
+        self._report(time.monotonic(), "finished")
+
+    def _report(self, now: float, event: str):
+        elapsed = max(now - self.started, 1e-9)
+        total = f"/{self.total}" if self.total else ""
+        self.logger.info(
+            "📊 %s: %d%s обработано, успешно %d, ошибок %d, %.1f/с",
+            self.label, self.processed, total, self.success, self.failed, self.processed / elapsed,
+            extra=fields(event=event, processed=self.processed, success=self.success,
+                         failed=self.failed, elapsed=f"{elapsed:.1f}s")
+        )
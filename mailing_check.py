@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import sys
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import SendMessage
+
+# Добавляем путь для импорта manual_mailing
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import manual_mailing as mailing
+from circuit_breaker import MediaCircuitBreaker
+from payloads import compile_message
+
+CHECKS = []
+
+
+def check(func):
+    """Регистрация проверки рассылки"""
+    CHECKS.append(func)
+    return func
+
+
+def expect(condition, message: str):
+    if not condition:
+        raise AssertionError(message)
+
+
+class FailingBot:
+    """Бот, у которого не проходит ни один вызов; считает вызовы API"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def _fail(self, method: str, **kwargs):
+        self.calls.append(method)
+        # Ошибка медиа, чтобы цепочка переходила к следующему варианту
+        raise TelegramBadRequest(SendMessage(chat_id=kwargs["chat_id"], text=""),
+                                 "Bad Request: failed to get HTTP URL content")
+
+    async def send_video(self, **kwargs):
+        await self._fail("send_video", **kwargs)
+
+    async def send_photo(self, **kwargs):
+        await self._fail("send_photo", **kwargs)
+
+    async def send_message(self, **kwargs):
+        await self._fail("send_message", **kwargs)
+
+
+MESSAGES = {
+    "video": {"text": "видео", "media_type": "video", "media_url": "https://example.com/v.mp4"},
+    "photo": {"text": "фото", "media_type": "photo", "media_url": "https://example.com/p.jpg",
+              "button_text": "Курс", "button_url": "https://example.com"},
+    None: {"text": "текст"},
+}
+
+
+@check
+async def check_worst_case_calls():
+    for media_type, message_data in MESSAGES.items():
+        bot = FailingBot()
+        sent = await mailing.send_media_message(bot, 1, compile_message(message_data))
+        expect(not sent, f"{media_type}: отправка засчитана при ошибках всех вызовов")
+        expect(len(bot.calls) == mailing.MAX_CALLS_PER_RECIPIENT[media_type],
+               f"{media_type}: вызовов {len(bot.calls)} ({', '.join(bot.calls)}), "
+               f"оценка {mailing.MAX_CALLS_PER_RECIPIENT[media_type]}")
+
+
+@check
+async def check_open_breaker_saves_calls():
+    breaker = MediaCircuitBreaker(failure_threshold=1)
+    await mailing.send_media_message(FailingBot(), 1, compile_message(MESSAGES["video"]), breaker)
+
+    bot = FailingBot()
+    await mailing.send_media_message(bot, 2, compile_message(MESSAGES["video"]), breaker)
+    expect(bot.calls == ["send_message", "send_message"], f"отключенные URL запрошены снова: {bot.calls}")
+
+
+async def main() -> int:
+    failures = 0
+    for func in CHECKS:
+        try:
+            await func()
+            print(f"✅ {func.__name__}")
+        except Exception as e:
+            failures += 1
+            print(f"❌ {func.__name__}: {e!r}")
+    return failures
+
+
+if __name__ == "__main__":
+    # Ошибки отправки здесь ожидаемы - их логи только мешают читать результат
+    logging.disable(logging.CRITICAL)
+    failures = asyncio.run(main())
+    print("=" * 50)
+    print(f"❌ Проверок с ошибками: {failures}" if failures else f"✅ Все проверки пройдены ({len(CHECKS)})")
+    sys.exit(1 if failures else 0)
@@ -1,112 +1,341 @@
+import argparse
 import asyncio
+import json
+import logging
 import os
 import sys
+import time
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from aiogram import Bot
 from aiogram.enums import ParseMode
-from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.exceptions import TelegramBadRequest
 
 # Добавляем путь для импорта database
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import database as db
+from campaigns import Campaign, validate_campaign
+from circuit_breaker import MediaCircuitBreaker
+from delivery import STATUS_DELIVERED, STATUS_ERROR, STATUS_FAILED, DeliveryLog
+from log_setup import ProgressReporter, fields, setup_logging
+from pacing import Pacer, parse_duration
+from payloads import CompiledMessage, compile_message
 
 # Загрузка переменных окружения
 load_dotenv()
 
-
-async def send_media_message(bot: Bot, chat_id: int, message_data: dict):
-    """Универсальная функция отправки сообщения с медиа или без"""
+logger = logging.getLogger(__name__)
+
+# Фото-заглушка, которая отправляется вместо недоступного видео
+PLACEHOLDER_PHOTO_URL = "https://picsum.photos/800/600"
+
+# Скорость рассылки по умолчанию (сообщений в секунду)
+MAILING_RATE = float(os.getenv("MAILING_RATE", "10"))
+
+# Сколько вызовов API в худшем случае уходит на одного получателя:
+# цепочка (видео → фото-заглушка → текст, фото → текст) и еще одна
+# попытка текста без клавиатуры, если не прошел и текст
+MAX_CALLS_PER_RECIPIENT = {"video": 4, "photo": 3, None: 2}
+
+# Фрагменты текста TelegramBadRequest, которые относятся к самому медиа.
+# Остальные ошибки (chat not found и т.п.) зависят от получателя и не
+# должны размыкать автомат для рабочего URL
+MEDIA_ERROR_MARKERS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "failed to get http url content",
+    "wrong type of the web page content",
+    "webpage_curl_failed",
+    "webpage_media_empty",
+    "image_process_failed",
+    "photo_invalid_dimensions",
+    "video_file_invalid",
+    "file is too big",
+)
+
+
+def is_media_error(error: TelegramBadRequest) -> bool:
+    """Относится ли ошибка Telegram к медиа, а не к получателю"""
+    text = str(error).lower()
+    return any(marker in text for marker in MEDIA_ERROR_MARKERS)
+
+
+async def send_with_breaker(breaker, url: str, send, **kwargs) -> bool:
+    """Отправка медиа с учетом автомата отключения URL
+
+    Возвращает False, если URL отключен или Telegram не смог его обработать
+    (TelegramBadRequest об ошибке медиа, см. MEDIA_ERROR_MARKERS) - тогда
+    вызывающий код переходит к следующему варианту. Остальные ошибки (чат
+    не найден, бот заблокирован и т.п.) к URL не относятся и пробрасываются
+    дальше, не задевая автомат.
+    """
+    if breaker is not None and not breaker.allow(url):
+        return False
     try:
-        # Создаем клавиатуру если есть кнопка
-        keyboard = None
-        if message_data.get('button_text') and message_data.get('button_url'):
-            builder = InlineKeyboardBuilder()
-            builder.button(
-                text=message_data['button_text'],
-                url=message_data['button_url']
-            )
-            keyboard = builder.as_markup()
-
-        # Отправляем сообщение в зависимости от типа медиа
-        media_type = message_data.get('media_type')
-        media_url = message_data.get('media_url')
+        await send(**kwargs)
+    except TelegramBadRequest as e:
+        if not is_media_error(e):
+            raise
+        logger.warning("⚠️ Не удалось отправить медиа", extra=fields(event="media_failed", url=url, error=e))
+        if breaker is not None:
+            breaker.record_failure(url)
+        return False
+    if breaker is not None:
+        breaker.record_success(url)
+    return True
+
+
+async def send_media_message(bot: Bot, chat_id: int, message, breaker: MediaCircuitBreaker = None):
+    """Универсальная функция отправки сообщения с медиа или без
+
+    message - CompiledMessage (собирается один раз на всю рассылку) или
+    словарь сообщения, который будет скомпилирован на месте. breaker
+    запоминает неработающие media URL, чтобы остальные получатели сразу
+    получали рабочий вариант из цепочки видео → фото-заглушка → текст.
+    """
+    if not isinstance(message, CompiledMessage):
+        message = compile_message(message)
 
-        print(f"📤 Отправка пользователю {chat_id}: тип={media_type}, URL={media_url}")
+    try:
+        logger.debug("📤 Отправка", extra=fields(event="mailing_send", user_id=chat_id, media_type=message.media_type))
 
-        # Если указан video, но URL не работает, отправляем как текст с пояснением
-        if media_type == 'video':
-            try:
-                await bot.send_video(
-                    chat_id=chat_id,
-                    video=media_url,
-                    caption=message_data['text'],
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.HTML
-                )
+        if message.media_type == 'video':
+            sent = await send_with_breaker(
+                breaker, message.media_url, bot.send_video,
+                chat_id=chat_id,
+                video=message.media_url,
+                caption=message.text,
+                reply_markup=message.reply_markup,
+                parse_mode=ParseMode.HTML
+            )
+            if sent:
                 return True
-            except Exception as video_error:
-                print(f"⚠️ Не удалось отправить видео, пробую отправить как фото: {video_error}")
-                # Пробуем отправить как фото с другим URL
-                try:
-                    await bot.send_photo(
-                        chat_id=chat_id,
-                        photo="https://picsum.photos/800/600",
-                        caption=f"🎬 {message_data['text']}\n\n(Видео временно недоступно)",
-                        reply_markup=keyboard,
-                        parse_mode=ParseMode.HTML
-                    )
-                    return True
-                except Exception as photo_error:
-                    print(f"❌ Не удалось отправить и фото: {photo_error}")
-                    # Отправляем просто текст
-                    await bot.send_message(
-                        chat_id=chat_id,
-                        text=message_data['text'],
-                        reply_markup=keyboard,
-                        parse_mode=ParseMode.HTML
-                    )
-                    return True
-
-        elif media_type == 'photo' and media_url:
-            await bot.send_photo(
+
+            # Видео недоступно - пробуем фото-заглушку
+            sent = await send_with_breaker(
+                breaker, PLACEHOLDER_PHOTO_URL, bot.send_photo,
                 chat_id=chat_id,
-                photo=media_url,
-                caption=message_data['text'],
-                reply_markup=keyboard,
+                photo=PLACEHOLDER_PHOTO_URL,
+                caption=f"🎬 {message.text}\n\n(Видео временно недоступно)",
+                reply_markup=message.reply_markup,
                 parse_mode=ParseMode.HTML
             )
-        else:
-            # Просто текстовое сообщение
-            await bot.send_message(
+            if sent:
+                return True
+
+        elif message.media_type == 'photo':
+            sent = await send_with_breaker(
+                breaker, message.media_url, bot.send_photo,
                 chat_id=chat_id,
-                text=message_data['text'],
-                reply_markup=keyboard,
+                photo=message.media_url,
+                caption=message.text,
+                reply_markup=message.reply_markup,
                 parse_mode=ParseMode.HTML
             )
+            if sent:
+                return True
 
+        # Текстовое сообщение (или медиа не удалось отправить)
+        await bot.send_message(
+            chat_id=chat_id,
+            text=message.text,
+            reply_markup=message.reply_markup,
+            parse_mode=ParseMode.HTML
+        )
         return True
 
     except Exception as e:
-        print(f"❌ Ошибка отправки пользователю {chat_id}: {e}")
+        logger.warning("❌ Ошибка отправки", extra=fields(event="mailing_error", user_id=chat_id, error=e))
         # Пробуем отправить просто текстовое сообщение без медиа
         try:
             await bot.send_message(
                 chat_id=chat_id,
-                text=message_data['text'],
+                text=message.text,
                 parse_mode=ParseMode.HTML
             )
-            print(f"✅ Отправлен текст без медиа пользователю {chat_id}")
+            logger.info("✅ Отправлен текст без медиа", extra=fields(event="mailing_text_fallback", user_id=chat_id))
             return True
         except Exception as text_error:
-            print(f"❌ Не удалось отправить даже текст пользователю {chat_id}: {text_error}")
+            logger.error("❌ Не удалось отправить даже текст",
+                         extra=fields(event="mailing_failed", user_id=chat_id, error=text_error))
             return False
 
 
-async def manual_mailing(template=None):
-    """Ручная рассылка всем подписчикам с поддержкой медиа"""
+async def load_mailing_template():
+    """Последняя версия шаблона рассылки из базы (скомпилированная)
+
+    Возвращает None (с сообщением), если сохраненная версия некорректна.
+    """
+    row = await db.get_campaign(db.MAILING_CAMPAIGN)
+    if row is None:
+        return Campaign(db.MAILING_CAMPAIGN, 0, db.DEFAULT_MAILING_TEMPLATE).template
+    version, payload = row
+    print(f"📄 Шаблон рассылки: версия {version}")
+    try:
+        return Campaign(db.MAILING_CAMPAIGN, version, payload).template
+    except ValueError as e:
+        print(f"❌ Версия {version} шаблона рассылки некорректна: {e}")
+        return None
+
+
+async def save_mailing_template(template):
+    """Сохранение шаблона рассылки новой версией"""
+    try:
+        validate_campaign(db.MAILING_CAMPAIGN, template)
+    except ValueError as e:
+        print(f"❌ Шаблон не сохранен: {e}")
+        return
+
+    await db.create_tables()
+    version = await db.add_campaign_version(db.MAILING_CAMPAIGN, template)
+    print(f"💾 Шаблон сохранен как версия {version}")
+
+
+async def resolve_template(template=None):
+    """Скомпилированный шаблон: переданный словарь или последняя версия из базы
+
+    Возвращает None (с сообщением), если шаблон некорректен.
+    """
+    if template is None:
+        return await load_mailing_template()
+    try:
+        return compile_message(template)
+    except ValueError as e:
+        print(f"❌ Некорректный шаблон рассылки: {e}")
+        return None
+
+
+async def plan_broadcast(mailing_data, segment: dict, rate: float, window: float = None) -> dict:
+    """Оценка рассылки без отправки (dry-run)"""
+    recipients = await db.count_subscribers(**segment)
+    pacer = Pacer(rate, window, recipients)
+    return {
+        "recipients": recipients,
+        "rate": pacer.rate,
+        "window": window,
+        "duration": recipients / pacer.rate if pacer.rate > 0 else 0.0,
+        "api_calls": recipients,
+        "api_calls_max": recipients * MAX_CALLS_PER_RECIPIENT[mailing_data.media_type],
+    }
+
+
+def print_plan(plan: dict):
+    """Вывод оценки рассылки"""
+    minutes, seconds = divmod(int(plan["duration"]), 60)
+    hours, minutes = divmod(minutes, 60)
+    print("📐 ПЛАН РАССЫЛКИ (dry-run):")
+    print(f"Получателей: {plan['recipients']}")
+    if plan["window"]:
+        print(f"Окно: {plan['window']:.0f} с (рассылка распределяется равномерно)")
+    print(f"Скорость: {plan['rate']:g} сообщ./с")
+    print(f"Оценка длительности: {hours:d}:{minutes:02d}:{seconds:02d}")
+    print(f"Вызовов API: {plan['api_calls']} (в худшем случае {plan['api_calls_max']})")
+
+
+def print_settings(mailing_data, segment: dict):
+    """Вывод настроек рассылки"""
+    print("=" * 50)
+    print("📨 НАСТРОЙКИ РАССЫЛКИ:")
+    print(f"Текст: {mailing_data.text[:100]}...")
+    print(f"Тип медиа: {mailing_data.media_type or 'Текст'}")
+    print(f"URL медиа: {mailing_data.media_url or 'Не указан'}")
+    print(f"Кнопка: {mailing_data.button_text or 'Нет'}")
+    print(f"Ссылка кнопки: {mailing_data.button_url or 'Нет'}")
+    print(f"Получатели: {describe_segment(segment)}")
+    print("=" * 50)
+
+
+async def run_broadcast(bot: Bot, mailing_data, segment: dict = None, rate: float = MAILING_RATE,
+                        total: int = None, window: float = None, load_monitor=None,
+                        campaign_id: int = 0, delivery_log: DeliveryLog = None) -> dict:
+    """Рассылка без интерактивных вопросов - используется консолью и планировщиком бота
+
+    Отправки идут с темпом не выше rate сообщений в секунду (время самой
+    отправки входит в интервал). С window рассылка равномерно растягивается
+    на window секунд, с load_monitor (внутри бота) темп снижается при
+    всплеске входящих сообщений или медленной записи в базу - ответы на
+    рассылку не перегружают бота. Каждая отправка пишется в журнал
+    доставки под campaign_id (0 - шаблон не из базы). Возвращает итоговую
+    статистику.
+    """
+    segment = segment or {}
+    if total is None:
+        total = await db.count_subscribers(**segment)
+
+    # Без общего журнала (консольный запуск) записи сбрасываются в конце рассылки
+    own_delivery_log = delivery_log is None
+    if own_delivery_log:
+        delivery_log = DeliveryLog()
+
+    # Неработающие media URL отключаются на всю оставшуюся рассылку
+    breaker = MediaCircuitBreaker()
+
+    # Вместо строки на каждого получателя - сводка раз в несколько секунд
+    progress = ProgressReporter(logger, total)
+
+    pacer = Pacer(rate, window, total, load_monitor)
+
+    try:
+        async for user_id in db.iter_subscribers(**segment):
+            # Выдерживаем темп, чтобы не превысить лимиты Telegram и не перегрузить бота
+            await pacer.wait()
+
+            success = False
+            status = STATUS_ERROR
+            started = time.monotonic()
+            try:
+                success = await send_media_message(bot, user_id, mailing_data, breaker)
+                if success:
+                    status = STATUS_DELIVERED
+                    logger.info("✅ Отправлено", extra=fields(event="mailing_sent", user_id=user_id))
+                else:
+                    status = STATUS_FAILED
+                    logger.warning("❌ Ошибка у пользователя", extra=fields(event="mailing_failed", user_id=user_id))
+
+            except Exception as e:
+                logger.error("❌ Критическая ошибка", extra=fields(event="mailing_error", user_id=user_id, error=e))
+
+            await delivery_log.record(campaign_id, 0, user_id, status, time.monotonic() - started)
+            progress.update(success)
+    finally:
+        if own_delivery_log:
+            await delivery_log.flush()
+
+    progress.finish()
+    return {
+        "processed": progress.processed,
+        "success": progress.success,
+        "failed": progress.failed,
+        "duration": time.monotonic() - progress.started,
+        "breaker": breaker.summary(),
+    }
+
+
+def print_summary(stats: dict):
+    """Вывод итогов рассылки"""
+    print("=" * 50)
+    print(f"📊 РАССЫЛКА ЗАВЕРШЕНА!")
+    print(f"✅ Успешно отправлено: {stats['success']}/{stats['processed']}")
+    print(f"❌ Не отправлено: {stats['failed']}")
+    for url, (state, successes, skipped) in stats["breaker"].items():
+        if skipped or state != MediaCircuitBreaker.CLOSED:
+            print(f"🔌 {url}: {state}, успешно {successes}, пропущено попыток {skipped}")
+    print("=" * 50)
+
+
+async def manual_mailing(template=None, segment=None, rate: float = MAILING_RATE,
+                         dry_run: bool = False, assume_yes: bool = False, window: float = None):
+    """Ручная рассылка подписчикам с поддержкой медиа
+
+    segment - фильтры получателей для database.iter_subscribers
+    (по умолчанию - все активные подписчики). dry_run - только оценка
+    без отправки, assume_yes - без вопроса о подтверждении.
+    """
+    segment = segment or {}
+
     # Проверяем токен бота
     BOT_TOKEN = os.getenv("BOT_TOKEN")
-    if not BOT_TOKEN:
+    if not BOT_TOKEN and not dry_run:
         print("❌ BOT_TOKEN не найден в .env файле")
         return
 
@@ -114,80 +343,43 @@ async def manual_mailing(template=None):
     await db.create_tables()
     print("✅ База данных инициализирована")
 
+    # Данные для рассылки (по умолчанию или переданный шаблон).
+    # Шаблон компилируется один раз и переиспользуется для всех получателей
+    mailing_data = await resolve_template(template)
+    if mailing_data is None:
+        return
+
+    if dry_run:
+        print_settings(mailing_data, segment)
+        print_plan(await plan_broadcast(mailing_data, segment, rate, window))
+        return
+
     bot = Bot(token=BOT_TOKEN)
 
     try:
-        # Получаем всех подписчиков
-        subscribers = await db.get_all_subscribers()
-        print(f"📋 Найдено подписчиков: {len(subscribers)}")
+        # Считаем получателей; сами ID читаются потоком во время рассылки
+        total = await db.count_subscribers(**segment)
+        print(f"📋 Найдено подписчиков: {total}")
 
-        if not subscribers:
+        if not total:
             print("❌ Нет подписчиков для рассылки")
             return
 
-        # Данные для рассылки (по умолчанию или переданный шаблон)
-        if template is None:
-            mailing_data = {
-                "delay_minutes": 1,
-        "text": """Вот наша первая подборка бесплатных курсов по ИТ и Искусственному Интеллекту, которые помогут вам начать или прокачать свои навыки:
-🔹<a href="https://ihclick.ru/?p=134225&o=290774&idp=313569&erid=LdtCKCxkP">Курс - Профессии и языки программирования: что выбрать?</a>               
-🔹<a href="https://EagleStar.programsite.ru/freemakeup2?erid=2VtzqucPohF">Бесплатный подробный видеокурс по HTML и CSS – основе любого сайта!</a>
-🔹<a href="https://EagleStar.programsite.ru/freejava?erid=2VtzqumHjPK">Освой Java в бесплатном обучающем Видеокурсе!</a>
-🔹<a href="https://EagleStar.programsite.ru/freejs?erid=2Vtzqxbr2Bf">Основы JavaScript, jQuery и Ajax бесплатно</a>
-🔹<a href="https://ihclick.ru/?p=134225&o=290561&idp=313569&erid=LdtCKCxkP">Введение в SQL и работу с базами данных</a>
-🔹<a href="https://ihclick.ru/?p=239390&o=324988&idp=313569&erid=2VtzqxE3VwU">Мастер-класс «Топ-12 нейросетей для вашей работы и жизни»</a>
-🔹<a href="https://ihclick.ru/?p=194430&o=304508&idp=313569&erid=2Vtzqx5QYhE">Практикум «Легкий старт в нейросетях для новичков»</a>
-🔹<a href="https://ihclick.ru/?p=262041&o=324507&idp=313569&erid=2VtzqvZXttv">Интенсив «Быстрый старт с нейросетями»</a>
-🔹<a href="https://ihclick.ru/?p=325067&o=293409&idp=313569&erid=5jtCeReNwxHpfQTDve31wmc">Бесплатный курс «Основы Go»</a>
-🔹<a href="https://ihclick.ru/?p=286608&o=292538&idp=313569&erid=LdtCKBHZy">Профессия «Python-разработчик с нуля»</a>
-Выбирайте интересующее направление, изучайте вместе с нами и делайте первые шаги к своей новой профессиональной сфере!""",
-        "media_type": "photo",
-        "media_url": "https://cloud.mail.ru/public/gcwZ/NQuSLFKSJ",
-
-                "button_text": "🚀 Записаться на курс",
-                "button_url": "https://example.com/ml-course"
-            }
-        else:
-            mailing_data = template
-
-        print("=" * 50)
-        print("📨 НАСТРОЙКИ РАССЫЛКИ:")
-        print(f"Текст: {mailing_data['text'][:100]}...")
-        print(f"Тип медиа: {mailing_data.get('media_type', 'Текст')}")
-        print(f"URL медиа: {mailing_data.get('media_url', 'Не указан')}")
-        print(f"Кнопка: {mailing_data.get('button_text', 'Нет')}")
-        print(f"Ссылка кнопки: {mailing_data.get('button_url', 'Нет')}")
-        print("=" * 50)
+        print_settings(mailing_data, segment)
 
         # Подтверждение
-        confirm = input("✅ Начать рассылку? (y/n): ")
-        if confirm.lower() != 'y':
-            print("❌ Рассылка отменена")
-            return
-
-        print("🔄 Начинаю рассылку...")
-
-        success_count = 0
-        for user_id in subscribers:
-            try:
-                success = await send_media_message(bot, user_id, mailing_data)
-                if success:
-                    success_count += 1
-                    print(f"✅ Отправлено пользователю {user_id}")
-                else:
-                    print(f"❌ Ошибка у пользователя {user_id}")
+        if not assume_yes:
+            confirm = input("✅ Начать рассылку? (y/n): ")
+            if confirm.lower() != 'y':
+                print("❌ Рассылка отменена")
+                return
 
-                # Небольшая задержка чтобы не превысить лимиты Telegram
-                await asyncio.sleep(0.1)
+        # Шаблон из базы учитывается в журнале доставки под своей версией
+        campaign_id = await db.get_campaign_id(db.MAILING_CAMPAIGN) if template is None else 0
 
-            except Exception as e:
-                print(f"❌ Критическая ошибка у пользователя {user_id}: {e}")
-
-        print("=" * 50)
-        print(f"📊 РАССЫЛКА ЗАВЕРШЕНА!")
-        print(f"✅ Успешно отправлено: {success_count}/{len(subscribers)}")
-        print(f"❌ Не отправлено: {len(subscribers) - success_count}")
-        print("=" * 50)
+        print("🔄 Начинаю рассылку...")
+        stats = await run_broadcast(bot, mailing_data, segment, rate, total, window, campaign_id=campaign_id)
+        print_summary(stats)
 
     except Exception as e:
         print(f"❌ Ошибка при рассылке: {e}")
@@ -195,6 +387,27 @@ async def manual_mailing(template=None):
         await bot.session.close()
 
 
+async def schedule_mailing(template=None, segment=None, rate: float = MAILING_RATE, run_at: str = None,
+                           window: float = None):
+    """Постановка рассылки в очередь планировщика бота (run_at - UTC)"""
+    await db.create_tables()
+
+    mailing_data = await resolve_template(template)
+    if mailing_data is None:
+        return
+
+    segment = segment or {}
+    print_settings(mailing_data, segment)
+    print_plan(await plan_broadcast(mailing_data, segment, rate, window))
+
+    campaign_id = 0
+    if template is None:
+        version, template = await db.get_campaign(db.MAILING_CAMPAIGN)
+        campaign_id = await db.get_campaign_id(db.MAILING_CAMPAIGN, version) or 0
+    broadcast_id = await db.add_scheduled_broadcast(template, segment, rate, run_at, window, campaign_id)
+    print(f"🗓  Рассылка {broadcast_id} запланирована на {run_at} UTC, ее запустит бот")
+
+
 def edit_mailing_template():
     """Функция для редактирования шаблона рассылки прямо в консоли"""
     print("✏️  РЕДАКТИРОВАНИЕ ШАБЛОНА РАССЫЛКИ")
@@ -245,7 +458,7 @@ def edit_mailing_template():
         if new_type in ['photo', 'video']:
             template["media_type"] = new_type
             if template["media_type"] == 'photo':
-                template["media_url"] = "https://picsum.photos/800/600"
+                template["media_url"] = PLACEHOLDER_PHOTO_URL
                 print("✅ Установлено стандартное фото")
             else:
                 # Предлагаем надежные видео URL
@@ -271,12 +484,175 @@ def edit_mailing_template():
     return template
 
 
-async def manual_mailing_with_template(template):
+def describe_segment(segment: dict) -> str:
+    """Человекочитаемое описание фильтров получателей"""
+    if not segment:
+        return "все активные подписчики"
+
+    parts = []
+    if segment.get("welcome_stage") is not None:
+        parts.append(f"стадия приветствия = {segment['welcome_stage']}")
+    if segment.get("subscribed_from"):
+        parts.append(f"подписались с {segment['subscribed_from']}")
+    if segment.get("subscribed_to"):
+        parts.append(f"подписались до {segment['subscribed_to']}")
+    if segment.get("has_commented") is not None:
+        parts.append("оставляли комментарии" if segment["has_commented"] else "без комментариев")
+    if segment.get("user_ids") is not None:
+        parts.append(f"список ID ({len(segment['user_ids'])} шт.)")
+    return ", ".join(parts)
+
+
+def choose_segment():
+    """Выбор получателей рассылки в консоли"""
+    print("👥 ВЫБОР ПОЛУЧАТЕЛЕЙ")
+    print("=" * 50)
+    choice = input(
+        "1 - Все активные подписчики\n"
+        "2 - По стадии приветственной серии\n"
+        "3 - По дате подписки\n"
+        "4 - Оставившие комментарии\n"
+        "5 - Не оставлявшие комментариев\n"
+        "6 - Список ID\n"
+        "Ваш выбор: "
+    ).strip()
+
+    if choice == "2":
+        stage = input("Номер стадии: ").strip()
+        if stage.isdigit():
+            return {"welcome_stage": int(stage)}
+    elif choice == "3":
+        print("Формат даты: ГГГГ-ММ-ДД (пусто - без ограничения)")
+        segment = {}
+        date_from = input("С даты: ").strip()
+        date_to = input("До даты (не включая): ").strip()
+        if date_from:
+            segment["subscribed_from"] = date_from
+        if date_to:
+            segment["subscribed_to"] = date_to
+        return segment
+    elif choice == "4":
+        return {"has_commented": True}
+    elif choice == "5":
+        return {"has_commented": False}
+    elif choice == "6":
+        raw_ids = input("ID через запятую или пробел: ").replace(",", " ").split()
+        user_ids = [int(user_id) for user_id in raw_ids if user_id.lstrip("-").isdigit()]
+        if user_ids:
+            return {"user_ids": user_ids}
+
+    if choice not in ("", "1"):
+        print("⚠️ Фильтр не задан, рассылка пойдет всем подписчикам")
+    return {}
+
+
+async def manual_mailing_with_template(template, segment=None):
     """Алиас для совместимости с существующим кодом"""
-    await manual_mailing(template)
+    await manual_mailing(template, segment)
+
+
+def parse_run_at(value: str) -> str:
+    """Время запуска (местное, ISO) в строку UTC для базы
+
+    ValueError с понятным текстом, если время не разобрано или уже прошло.
+    """
+    try:
+        moment = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"Некорректное время запуска: {value!r} (формат ГГГГ-ММ-ДД ЧЧ:ММ)") from None
+    # Время задается местное, в базе хранится UTC (как datetime('now') в SQLite)
+    moment = moment.astimezone(timezone.utc)
+    if moment <= datetime.now(timezone.utc):
+        raise ValueError(f"Время запуска {value} уже прошло")
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def parse_args(argv):
+    """Аргументы неинтерактивного режима"""
+    parser = argparse.ArgumentParser(
+        description="Рассылка подписчикам. Без аргументов запускается интерактивный режим."
+    )
+    parser.add_argument("--job", help="JSON-файл задания: template, segment, rate, at")
+    parser.add_argument("--template", help="JSON-файл шаблона (по умолчанию - последняя версия из базы)")
+    parser.add_argument("--template-version", type=int, help="Версия шаблона из базы")
+    parser.add_argument("--stage", type=int, help="Только подписчики на стадии приветственной серии")
+    parser.add_argument("--from", dest="subscribed_from", help="Подписались с даты (ГГГГ-ММ-ДД)")
+    parser.add_argument("--to", dest="subscribed_to", help="Подписались до даты (не включая)")
+    commented = parser.add_mutually_exclusive_group()
+    commented.add_argument("--commented", dest="has_commented", action="store_const", const=True)
+    commented.add_argument("--not-commented", dest="has_commented", action="store_const", const=False)
+    parser.add_argument("--ids", help="ID получателей через запятую")
+    parser.add_argument("--ids-file", help="Файл с ID получателей (по одному в строке)")
+    parser.add_argument("--rate", type=float, help=f"Сообщений в секунду (по умолчанию {MAILING_RATE:g})")
+    parser.add_argument("--window", help="Растянуть рассылку равномерно на время: 90m, 2h, 3600")
+    parser.add_argument("--at", help="Запланировать на время (ГГГГ-ММ-ДД ЧЧ:ММ, местное время)")
+    parser.add_argument("--dry-run", action="store_true", help="Только оценка, без отправки")
+    parser.add_argument("--yes", action="store_true", help="Не спрашивать подтверждение")
+    return parser.parse_args(argv)
+
+
+async def run_cli(args):
+    """Неинтерактивный режим: задание из файла и/или аргументов"""
+    job = {}
+    if args.job:
+        with open(args.job, encoding="utf-8") as f:
+            job = json.load(f)
+
+    template = job.get("template")
+    if args.template:
+        with open(args.template, encoding="utf-8") as f:
+            template = json.load(f)
+    template_version = args.template_version or job.get("template_version")
+    if template_version is not None:
+        await db.create_tables()
+        row = await db.get_campaign(db.MAILING_CAMPAIGN, template_version)
+        if row is None:
+            print(f"❌ Версия шаблона {template_version} не найдена")
+            return
+        template = row[1]
+
+    segment = dict(job.get("segment", {}))
+    for key in ("subscribed_from", "subscribed_to", "has_commented"):
+        if getattr(args, key) is not None:
+            segment[key] = getattr(args, key)
+    if args.stage is not None:
+        segment["welcome_stage"] = args.stage
+    user_ids = []
+    if args.ids:
+        user_ids += [int(user_id) for user_id in args.ids.split(",") if user_id.strip()]
+    if args.ids_file:
+        with open(args.ids_file, encoding="utf-8") as f:
+            user_ids += [int(line) for line in f if line.strip()]
+    if user_ids:
+        segment["user_ids"] = user_ids
+
+    rate = args.rate or job.get("rate") or MAILING_RATE
+    try:
+        window = parse_duration(args.window or job.get("window"))
+    except ValueError:
+        print(f"❌ Некорректное окно рассылки: {args.window or job.get('window')!r} (например 90m, 2h, 3600)")
+        return
+    run_at = args.at or job.get("at")
+    if run_at:
+        try:
+            run_at = parse_run_at(run_at)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
+
+    if run_at and not args.dry_run:
+        await schedule_mailing(template, segment, rate, run_at, window)
+    else:
+        await manual_mailing(template, segment, rate, dry_run=args.dry_run, assume_yes=args.yes, window=window)
 
 
 if __name__ == "__main__":
+    setup_logging(level=logging.INFO)
+
+    if len(sys.argv) > 1:
+        asyncio.run(run_cli(parse_args(sys.argv[1:])))
+        sys.exit()
+
     print("=" * 50)
     print("📨 РУЧНАЯ РАССЫЛКА СООБЩЕНИЙ")
     print("=" * 50)
@@ -287,7 +663,12 @@ if __name__ == "__main__":
     if choice == "2":
         # Редактируем шаблон
         template = edit_mailing_template()
-        asyncio.run(manual_mailing_with_template(template))
+        save = input("Сохранить шаблон как новую версию? (y/n): ")
+        if save.lower() == 'y':
+            asyncio.run(save_mailing_template(template))
+        segment = choose_segment()
+        asyncio.run(manual_mailing_with_template(template, segment))
     else:
         # Используем готовый шаблон
-        asyncio.run(manual_mailing())
\ No newline at end of file
+        segment = choose_segment()
+        asyncio.run(manual_mailing(segment=segment))
\ No newline at end of file
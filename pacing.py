@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def parse_duration(value) -> float:
+    """Длительность в секундах из строки вида "90", "45s", "30m", "2h" """
+    if value is None or isinstance(value, (int, float)):
+        return value
+    value = str(value).strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value and value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+class LoadMonitor:
+    """Измерение нагрузки на бота: частота входящих апдейтов и задержка записи в базу
+
+    Обе величины - экспоненциальные скользящие средние с постоянной времени
+    tau секунд, поэтому всплеск учитывается быстро, а после него оценка
+    плавно возвращается к норме. factor() переводит нагрузку в множитель
+    скорости рассылки от min_factor до 1.
+    """
+
+    def __init__(self, inbound_target: float = 20.0, latency_target: float = 0.05,
+                 tau: float = 10.0, min_factor: float = 0.1):
+        self.inbound_target = inbound_target
+        self.latency_target = latency_target
+        self.tau = tau
+        self.min_factor = min_factor
+
+        self._inbound = 0.0
+        self._inbound_at = time.monotonic()
+        self._latency = 0.0
+        self._latency_at = None
+
+    def record_update(self):
+        """Учет одного входящего апдейта"""
+        now = time.monotonic()
+        self._inbound = self._inbound * math.exp(-(now - self._inbound_at) / self.tau) + 1
+        self._inbound_at = now
+
+    def record_write(self, latency: float):
+        """Учет длительности одной записи в базу"""
+        now = time.monotonic()
+        if self._latency_at is None:
+            self._latency = latency
+        else:
+            weight = 1 - math.exp(-(now - self._latency_at) / self.tau)
+            # Минимальный вес, чтобы частые записи тоже сдвигали среднее
+            weight = max(weight, 0.2)
+            self._latency += weight * (latency - self._latency)
+        self._latency_at = now
+
+    @property
+    def inbound_rate(self) -> float:
+        """Входящих апдейтов в секунду"""
+        elapsed = time.monotonic() - self._inbound_at
+        return self._inbound * math.exp(-elapsed / self.tau) / self.tau
+
+    @property
+    def write_latency(self) -> float:
+        """Средняя задержка записи (0, если записей давно не было)"""
+        if self._latency_at is None or time.monotonic() - self._latency_at > 3 * self.tau:
+            return 0.0
+        return self._latency
+
+    def factor(self) -> float:
+        """Множитель скорости рассылки с учетом нагрузки"""
+        factor = 1.0
+        inbound_rate = self.inbound_rate
+        if inbound_rate > self.inbound_target:
+            factor = min(factor, self.inbound_target / inbound_rate)
+        write_latency = self.write_latency
+        if write_latency > self.latency_target:
+            factor = min(factor, self.latency_target / write_latency)
+        return max(factor, self.min_factor)
+
+
+class Pacer:
+    """Темп отправки сообщений рассылки
+
+    - rate: верхний предел (лимиты Telegram);
+    - window + total: рассылка равномерно распределяется на window секунд;
+    - load_monitor: скорость дополнительно снижается при нагрузке на бота.
+    """
+
+    def __init__(self, rate: float, window: float = None, total: int = None,
+                 load_monitor: LoadMonitor = None):
+        self.rate = rate
+        if window and total:
+            spread_rate = total / window
+            if spread_rate > rate:
+                logger.warning(
+                    f"Рассылка не уложится в окно {window:.0f}с при лимите {rate:g} сообщ./с, "
+                    f"понадобится {total / rate:.0f}с"
+                )
+            self.rate = min(rate, spread_rate)
+        self.load_monitor = load_monitor
+        self._next_send = time.monotonic()
+
+    def current_rate(self) -> float:
+        if self.load_monitor is None:
+            return self.rate
+        return self.rate * self.load_monitor.factor()
+
+    async def wait(self):
+        """Ожидание очередного слота отправки"""
+        rate = self.current_rate()
+        delay = self._next_send - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        interval = 1 / rate if rate > 0 else 0.0
+        self._next_send = max(self._next_send + interval, time.monotonic())
@@ -0,0 +1,69 @@
+from typing import NamedTuple, Optional
+
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
+
+MEDIA_TYPES = (None, "photo", "video")
+
+
+class CompiledMessage(NamedTuple):
+    """Готовый к отправке неизменяемый запрос
+
+    Собирается один раз из словаря сообщения (WELCOME_MESSAGES, шаблон
+    рассылки) и переиспользуется для всех получателей: клавиатура уже
+    построена, тип отправки уже выбран.
+    """
+    media_type: Optional[str]  # "photo", "video" или None (текст)
+    media_url: Optional[str]
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup]
+    button_text: Optional[str] = None
+    button_url: Optional[str] = None
+    delay_minutes: int = 0
+
+
+def validate_message(message_data: dict):
+    """Проверка одного сообщения"""
+    if not isinstance(message_data, dict):
+        raise ValueError("Сообщение должно быть объектом")
+    if not message_data.get("text"):
+        raise ValueError("У сообщения нет текста")
+    if message_data.get("media_type") not in MEDIA_TYPES:
+        raise ValueError(f"Неизвестный тип медиа: {message_data.get('media_type')}")
+    if message_data.get("media_type") and not message_data.get("media_url"):
+        raise ValueError("Для медиа не указан media_url")
+    if bool(message_data.get("button_text")) != bool(message_data.get("button_url")):
+        raise ValueError("Для кнопки нужны и button_text, и button_url")
+
+
+def compile_message(message_data: dict) -> CompiledMessage:
+    """Проверка словаря сообщения и сборка CompiledMessage"""
+    validate_message(message_data)
+
+    reply_markup = None
+    button_text = message_data.get("button_text")
+    button_url = message_data.get("button_url")
+    if button_text and button_url:
+        builder = InlineKeyboardBuilder()
+        builder.button(text=button_text, url=button_url)
+        reply_markup = builder.as_markup()
+
+    return CompiledMessage(
+        media_type=message_data.get("media_type"),
+        media_url=message_data.get("media_url"),
+        text=message_data["text"],
+        reply_markup=reply_markup,
+        button_text=button_text,
+        button_url=button_url,
+        delay_minutes=message_data.get("delay_minutes", 0),
+    )
+
+
+def reply_keyboard(*texts: str, columns: int = None):
+    """Сборка статической reply-клавиатуры (вызывается один раз при импорте)"""
+    builder = ReplyKeyboardBuilder()
+    for text in texts:
+        builder.button(text=text)
+    if columns:
+        builder.adjust(columns)
+    return builder.as_markup(resize_keyboard=True)
@@ -0,0 +1,176 @@
+import abc
+import inspect
+
+
+class Storage(abc.ABC):
+    """Интерфейс хранилища бота
+
+    Основная реализация (SQLite) - функции модуля database с теми же
+    именами и сигнатурами; PostgreSQL - класс storage_postgres.PostgresStorage.
+    Хранилище выбирается переменной окружения DATABASE_URL (см. database.py).
+
+    Формат значений одинаков для всех реализаций: строки выборок - кортежи,
+    даты - строки 'ГГГГ-ММ-ДД ЧЧ:ММ:СС' (UTC).
+    """
+
+    @abc.abstractmethod
+    async def create_tables(self):
+        """Создание схемы и начальных данных (идемпотентно)"""
+
+    @abc.abstractmethod
+    async def close(self):
+        """Освобождение ресурсов (пул соединений)"""
+
+    # Подписчики
+
+    @abc.abstractmethod
+    async def add_subscriber(self, user_id: int, username: str, first_name: str, campaign_version: int = 1):
+        """Добавление подписчика (повторная подписка сбрасывает стадию)"""
+
+    @abc.abstractmethod
+    async def update_welcome_stage(self, user_id: int, new_stage: int):
+        """Обновление стадии приветственной серии"""
+
+    @abc.abstractmethod
+    async def is_user_subscribed(self, user_id: int):
+        """Активен ли подписчик"""
+
+    @abc.abstractmethod
+    async def get_all_subscribers(self):
+        """user_id всех активных подписчиков"""
+
+    @abc.abstractmethod
+    async def get_all_users(self):
+        """[(user_id, username, first_name, subscribed_at, is_active)]"""
+
+    @abc.abstractmethod
+    async def count_subscribers(self, **filters):
+        """Количество активных подписчиков по фильтрам сегмента"""
+
+    @abc.abstractmethod
+    def iter_subscribers(self, chunk_size: int = 1000, **filters):
+        """Асинхронный перебор user_id активных подписчиков по фильтрам сегмента"""
+
+    @abc.abstractmethod
+    async def count_users(self):
+        """Количество всех пользователей"""
+
+    @abc.abstractmethod
+    def iter_subscriber_chunks(self, chunk_size: int = 10000):
+        """Выгрузка подписчиков порциями (database.SUBSCRIBER_EXPORT_COLUMNS)"""
+
+    @abc.abstractmethod
+    async def import_subscriber_batch(self, rows, campaign_version: int = 1, welcome_schedule=None,
+                                      stagger_minutes: int = 0):
+        """Массовое добавление подписчиков, возвращает количество новых"""
+
+    # Запланированные сообщения
+
+    @abc.abstractmethod
+    async def add_scheduled_message(self, user_id: int, message_stage: int, delay_minutes: int):
+        """Планирование сообщения серии через delay_minutes"""
+
+    @abc.abstractmethod
+    async def get_pending_messages(self):
+        """[(id, user_id, stage, username, версия)] - сообщения, время которых наступило"""
+
+    @abc.abstractmethod
+    async def claim_pending_messages(self, limit: int = 500, lease_minutes: int = 10):
+        """Захват готовых сообщений одним обработчиком, формат как у get_pending_messages"""
+
+    @abc.abstractmethod
+    async def release_messages(self, message_ids):
+        """Снятие захвата с неотправленных сообщений"""
+
+    @abc.abstractmethod
+    async def mark_message_sent(self, message_id: int):
+        """Отметка сообщения отправленным"""
+
+    @abc.abstractmethod
+    async def cleanup_old_messages(self, chunk_size: int = 500, pause: float = 0.05,
+                                   archive_path: str = None, vacuum_pages: int = 200,
+                                   retention_days: int = 7):
+        """Порционная очистка старых отправленных сообщений, возвращает метрики"""
+
+    # Комментарии
+
+    @abc.abstractmethod
+    async def add_comment(self, user_id: int, username: str, first_name: str, message_text: str):
+        """Сохранение комментария"""
+
+    @abc.abstractmethod
+    async def get_all_comments(self):
+        """[(id, user_id, username, first_name, message_text, created_at)], новые первыми"""
+
+    @abc.abstractmethod
+    async def count_comments(self):
+        """Количество комментариев"""
+
+    @abc.abstractmethod
+    async def search_comments(self, query: str, limit: int = 5, offset: int = 0):
+        """Полнотекстовый поиск: (rows, has_more), совпадения обрамлены \\x02 и \\x03"""
+
+    @abc.abstractmethod
+    def iter_comment_chunks(self, chunk_size: int = 10000):
+        """Выгрузка комментариев порциями (database.COMMENT_EXPORT_COLUMNS)"""
+
+    # Кампании
+
+    @abc.abstractmethod
+    async def get_latest_campaign_versions(self):
+        """{название: последняя версия}"""
+
+    @abc.abstractmethod
+    async def get_campaign(self, name: str, version: int = None):
+        """(версия, данные) или None"""
+
+    @abc.abstractmethod
+    async def add_campaign_version(self, name: str, payload):
+        """Публикация новой версии кампании, возвращает номер версии"""
+
+    @abc.abstractmethod
+    async def get_campaign_id(self, name: str, version: int = None):
+        """id строки кампании (для журнала доставки) или None"""
+
+    # Журнал доставки
+
+    @abc.abstractmethod
+    async def add_deliveries(self, records):
+        """Пакетная запись [(campaign_id, stage, user_id, status, latency_ms, created_at)]"""
+
+    @abc.abstractmethod
+    async def rollup_deliveries(self, settle_seconds: int = 300, raw_retention_hours: int = 48,
+                                chunk_size: int = 5000, pause: float = 0.05):
+        """Свертка журнала в почасовые итоги и удаление учтенных строк, возвращает метрики"""
+
+    @abc.abstractmethod
+    async def get_delivery_report(self, since_hours: int = 24):
+        """[(кампания, версия, стадия, доставлено, ошибок, ср. задержка мс, макс. задержка мс)]"""
+
+    # Отложенные рассылки
+
+    @abc.abstractmethod
+    async def add_scheduled_broadcast(self, payload: dict, segment: dict, rate: float, run_at: str,
+                                      window_seconds: float = None, campaign_id: int = 0):
+        """Планирование рассылки, возвращает id"""
+
+    @abc.abstractmethod
+    async def claim_due_broadcasts(self):
+        """Захват наступивших рассылок: [(id, данные, сегмент, скорость, окно, кампания)]"""
+
+    @abc.abstractmethod
+    async def finish_broadcast(self, broadcast_id: int, status: str, sent_count: int = 0, failed_count: int = 0):
+        """Отметка завершения рассылки"""
+
+
+# Имена функций, которые должна предоставлять любая реализация хранилища
+STORAGE_API = tuple(sorted(Storage.__abstractmethods__))
+
+
+def missing_functions(backend) -> list:
+    """Функции интерфейса, которых нет у модуля или объекта хранилища"""
+    return [
+        name for name in STORAGE_API
+        if not callable(getattr(backend, name, None))
+        or inspect.iscoroutinefunction(getattr(Storage, name)) != inspect.iscoroutinefunction(getattr(backend, name))
+    ]
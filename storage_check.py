@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# Добавляем путь для импорта database
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import database as db
+from storage import missing_functions
+
+CHECKS = []
+
+
+def check(func):
+    """Регистрация проверки хранилища"""
+    CHECKS.append(func)
+    return func
+
+
+def expect(condition, message: str):
+    if not condition:
+        raise AssertionError(message)
+
+
+def _utc(minutes: int = 0) -> str:
+    moment = datetime.now(timezone.utc) + timedelta(minutes=minutes)
+    return moment.strftime("%Y-%m-%d %H:%M:%S")
+
+
+@check
+async def check_interface(storage):
+    missing = missing_functions(storage)
+    expect(not missing, f"нет функций интерфейса: {', '.join(missing)}")
+
+
+@check
+async def check_subscribers(storage):
+    await storage.add_subscriber(101, "alice", "Алиса")
+    await storage.add_subscriber(102, "bob", "Боб", campaign_version=2)
+    expect(await storage.is_user_subscribed(101), "подписчик 101 не найден")
+    expect(not await storage.is_user_subscribed(999), "найден несуществующий подписчик")
+    expect(sorted(await storage.get_all_subscribers()) == [101, 102], "неверный список подписчиков")
+    expect(await storage.count_users() == 2, "неверное число пользователей")
+
+    await storage.update_welcome_stage(101, 3)
+    expect(await storage.count_subscribers(welcome_stage=3) == 1, "фильтр по стадии не работает")
+
+    # Повторная подписка сбрасывает стадию
+    await storage.add_subscriber(101, "alice", "Алиса")
+    expect(await storage.count_subscribers(welcome_stage=3) == 0, "повторная подписка не сбросила стадию")
+
+    users = {row[0]: row for row in await storage.get_all_users()}
+    expect(users[101][1] == "alice" and len(str(users[101][3])) == 19, "неверный формат get_all_users")
+
+
+@check
+async def check_segments(storage):
+    for user_id in range(200, 210):
+        await storage.add_subscriber(user_id, f"user{user_id}", "Имя")
+    await storage.add_comment(205, "user205", "Имя", "комментарий")
+
+    expect(await storage.count_subscribers(has_commented=True) == 1, "фильтр has_commented=True")
+    expect(await storage.count_subscribers(user_ids=[200, 201, 999]) == 2, "фильтр user_ids")
+    expect(await storage.count_subscribers(subscribed_from=_utc(-60), subscribed_to=_utc(60)) >= 10,
+           "фильтр по дате подписки")
+
+    user_ids = [user_id async for user_id in storage.iter_subscribers(chunk_size=3, user_ids=range(200, 210))]
+    expect(user_ids == list(range(200, 210)), "постраничный перебор подписчиков")
+
+
+@check
+async def check_scheduled_messages(storage):
+    await storage.add_subscriber(301, "carol", "Кэрол")
+    await storage.add_scheduled_message(301, 0, 0)
+    await storage.add_scheduled_message(301, 1, 60)
+
+    pending = await storage.get_pending_messages()
+    expect([row[1:3] for row in pending] == [(301, 0)], f"неверные готовые сообщения: {pending}")
+
+    claimed = await storage.claim_pending_messages()
+    expect([row[1:] for row in claimed] == [(301, 0, "carol", 1)], f"неверный захват: {claimed}")
+    expect(await storage.claim_pending_messages() == [], "сообщение захвачено повторно")
+
+    await storage.release_messages([claimed[0][0]])
+    expect(await storage.claim_pending_messages() == claimed, "освобожденное сообщение не захватывается")
+
+    await storage.mark_message_sent(claimed[0][0])
+    expect(await storage.get_pending_messages() == [], "отправленное сообщение осталось в очереди")
+
+    stats = await storage.cleanup_old_messages(pause=0)
+    expect(stats["rows_deleted"] == 0, "очистка удалила свежие сообщения")
+
+
+@check
+async def check_concurrent_claims(storage):
+    for user_id in range(400, 450):
+        await storage.add_subscriber(user_id, f"user{user_id}", "Имя")
+        await storage.add_scheduled_message(user_id, 0, 0)
+
+    batches = await asyncio.gather(*(storage.claim_pending_messages(limit=10) for _ in range(8)))
+    claimed = [row[0] for batch in batches for row in batch]
+    expect(len(claimed) == len(set(claimed)), "одно сообщение захвачено несколькими обработчиками")
+    expect(len(claimed) == 50, f"захвачено {len(claimed)} сообщений из 50")
+
+
+@check
+async def check_comments(storage):
+    await storage.add_comment(501, "dave", "Дэйв", "Отличный курс по Python")
+    await storage.add_comment(501, "dave", "Дэйв", "Где найти курсы по Java?")
+    await storage.add_comment(502, "eve", "Ева", "Спасибо за рассылку")
+
+    expect(await storage.count_comments() >= 3, "неверное число комментариев")
+    expect((await storage.get_all_comments())[0][4] == "Спасибо за рассылку", "комментарии не по убыванию даты")
+
+    rows, has_more = await storage.search_comments("курс", limit=1)
+    expect(len(rows) == 1 and has_more, "поиск по префиксу и признак следующей страницы")
+    expect("\x02" in rows[0][4] and "\x03" in rows[0][4], "нет подсветки совпадения")
+    expect(await storage.search_comments('"*) OR (') == ([], False), "спецсимволы сломали поиск")
+
+
+@check
+async def check_campaigns(storage):
+    versions = await storage.get_latest_campaign_versions()
+    expect(versions.get(db.WELCOME_CAMPAIGN) == 1, "нет начальной версии приветственной серии")
+
+    version = await storage.add_campaign_version(db.MAILING_CAMPAIGN, {"text": "v2"})
+    expect(version == 2, f"неверный номер новой версии: {version}")
+    expect(await storage.get_campaign(db.MAILING_CAMPAIGN) == (2, {"text": "v2"}), "последняя версия")
+    expect((await storage.get_campaign(db.MAILING_CAMPAIGN, 1))[0] == 1, "версия по номеру")
+    expect(await storage.get_campaign("missing") is None, "несуществующая кампания")
+
+
+@check
+async def check_broadcasts(storage):
+    later = await storage.add_scheduled_broadcast({"text": "позже"}, {}, 10, _utc(60))
+    due = await storage.add_scheduled_broadcast({"text": "сейчас"}, {"welcome_stage": 1}, 5, _utc(-1), 600, 7)
+
+    claimed = await storage.claim_due_broadcasts()
+    expect(claimed == [(due, {"text": "сейчас"}, {"welcome_stage": 1}, 5, 600, 7)], f"неверный захват: {claimed}")
+    expect(await storage.claim_due_broadcasts() == [], "рассылка захвачена повторно")
+    await storage.finish_broadcast(due, "done", 3, 1)
+    expect(later != due, "одинаковые id рассылок")
+
+
+@check
+async def check_delivery_log(storage):
+    campaign_id = await storage.get_campaign_id(db.WELCOME_CAMPAIGN, 1)
+    expect(campaign_id is not None, "нет id приветственной кампании")
+
+    now = int(time.time())
+    old = now - 3 * 24 * 3600
+    await storage.add_deliveries(
+        [(campaign_id, 0, 700 + i, 1, 100, old) for i in range(8)] + [(campaign_id, 0, 710, 2, 400, old)]
+    )
+
+    stats = await storage.rollup_deliveries()
+    expect(stats == {"rolled_up": 9, "pruned": 9}, f"неверная свертка: {stats}")
+    expect(await storage.rollup_deliveries() == {"rolled_up": 0, "pruned": 0}, "повторная свертка")
+
+    # Журнал пуст после удаления: новые строки не должны получить уже учтенные id
+    await storage.add_deliveries(
+        [(campaign_id, 0, 720 + i, 1, 300, old) for i in range(3)] + [(0, 0, 711, 1, 50, now)]
+    )
+
+    report = {row[:3]: row[3:] for row in await storage.get_delivery_report(since_hours=24 * 7)}
+    expect(report.get((None, None, 0), ())[:2] == (1, 0), f"свежие строки не попали в отчет: {report}")
+
+    stats = await storage.rollup_deliveries()
+    expect(stats == {"rolled_up": 3, "pruned": 3}, f"строки после очистки журнала не свернуты: {stats}")
+
+    report = {row[:3]: row[3:] for row in await storage.get_delivery_report(since_hours=24 * 7)}
+    delivered, failed, avg_latency, max_latency = report[(db.WELCOME_CAMPAIGN, 1, 0)]
+    expect((delivered, failed, max_latency) == (11, 1, 400), f"неверные итоги: {report}")
+    expect(abs(avg_latency - 2100 / 12) < 0.01, f"неверная средняя задержка: {avg_latency}")
+
+
+@check
+async def check_import_export(storage):
+    rows = [(600 + i, f"user{i}", "Имя", None, None, None, None) for i in range(20)]
+    rows += [(101, "alice2", "Алиса", None, None, None, None)]
+    # Состояние из выгрузки: отписавшийся и прошедший часть серии
+    rows += [(630, "gone", "Имя", "2024-01-01 00:00:00", 1, False, 2),
+             (631, "half", "Имя", "2024-01-01 00:00:00", 1, True, 2)]
+    schedule = [(0, 0), (1, 60), (2, 0)]
+    new = await storage.import_subscriber_batch(rows, welcome_schedule=schedule)
+    expect(new == 22, f"новых подписчиков {new} вместо 22")
+
+    pending = {row[1] for row in await storage.get_pending_messages()}
+    expect(set(range(600, 620)) <= pending and 101 not in pending, "серия запланирована не тем подписчикам")
+    expect(630 not in pending and 631 in pending, "неверная серия для импортированного состояния")
+    stages = sorted(row[2] for row in await storage.get_pending_messages() if row[1] == 631)
+    expect(stages == [2], f"запланированы пройденные стадии: {stages}")
+
+    exported = [row async for chunk in storage.iter_subscriber_chunks(chunk_size=7) for row in chunk]
+    by_id = {row[0]: row for row in exported}
+    expect(len(exported) == await storage.count_users(), "выгружены не все подписчики")
+    expect(by_id[101][1] == "alice2", "импорт не обновил имя существующего подписчика")
+    expect(by_id[630][4:] in ((1, 0, 2), (1, False, 2)), f"не сохранено состояние подписчика: {by_id[630]}")
+    expect(not await storage.is_user_subscribed(630), "отписавшийся подписчик снова активен")
+
+    comments = [row async for chunk in storage.iter_comment_chunks(chunk_size=2) for row in chunk]
+    expect(len(comments) == await storage.count_comments(), "выгружены не все комментарии")
+
+
+async def run_checks(storage) -> int:
+    """Прогон всех проверок на пустом хранилище, возвращает число ошибок"""
+    await storage.create_tables()
+    failures = 0
+    for func in CHECKS:
+        try:
+            await func(storage)
+            print(f"✅ {func.__name__}")
+        except Exception as e:
+            failures += 1
+            print(f"❌ {func.__name__}: {e!r}")
+    return failures
+
+
+async def check_sqlite() -> int:
+    database_path = db.DATABASE_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DATABASE_PATH = os.path.join(tmp, "check.db")
+        try:
+            return await run_checks(db)
+        finally:
+            db.DATABASE_PATH = database_path
+
+
+async def check_postgres(dsn: str) -> int:
+    """Проверка PostgreSQL во временной схеме, которая удаляется после прогона"""
+    import asyncpg
+    from storage_postgres import PostgresStorage
+
+    schema = f"storage_check_{uuid.uuid4().hex[:8]}"
+    conn = await asyncpg.connect(dsn)
+    try:
+        await conn.execute(f"CREATE SCHEMA {schema}")
+        storage = PostgresStorage(dsn, server_settings={"search_path": schema})
+        try:
+            return await run_checks(storage)
+        finally:
+            await storage.close()
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await conn.close()
+
+
+async def main(postgres_dsn: str = None) -> int:
+    if postgres_dsn:
+        print(f"🐘 PostgreSQL: {postgres_dsn}")
+        return await check_postgres(postgres_dsn)
+    print("🗄 SQLite (временный файл)")
+    return await check_sqlite()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Общие проверки хранилища: одинаковое поведение SQLite и PostgreSQL"
+    )
+    parser.add_argument("--postgres", metavar="DSN", default=os.getenv("DATABASE_URL") or None,
+                        help="Проверить PostgreSQL (по умолчанию DATABASE_URL); без него - SQLite")
+    args = parser.parse_args()
+
+    failures = asyncio.run(main(args.postgres))
+    print("=" * 50)
+    print(f"❌ Проверок с ошибками: {failures}" if failures else f"✅ Все проверки пройдены ({len(CHECKS)})")
+    sys.exit(1 if failures else 0)
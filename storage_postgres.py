@@ -0,0 +1,737 @@
+import asyncio
+import json
+import logging
+import random
+import time
+
+try:
+    import asyncpg
+except ImportError as e:
+    raise ImportError("Для хранилища PostgreSQL нужен пакет asyncpg: pip install asyncpg") from e
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+# Даты хранятся в TIMESTAMP без зоны (UTC), как и в SQLite
+NOW_UTC = "(now() AT TIME ZONE 'utc')"
+
+
+def _ts(column: str) -> str:
+    """Дата в том же строковом виде, что возвращает SQLite"""
+    return f"to_char({column}, 'YYYY-MM-DD HH24:MI:SS')"
+
+
+def build_tsquery(text: str) -> str:
+    """Преобразование пользовательского ввода в запрос to_tsquery
+
+    Каждое слово экранируется и ищется по префиксу, слова объединяются
+    через И - так же, как database.build_fts_query для FTS5.
+    """
+    terms = []
+    for word in text.split():
+        word = word.replace("\\", "\\\\").replace("'", "''")
+        if word:
+            terms.append(f"'{word}':*")
+    return " & ".join(terms)
+
+
+def _subscriber_filters(welcome_stage: int = None, subscribed_from: str = None,
+                        subscribed_to: str = None, has_commented: bool = None,
+                        user_ids=None):
+    """Условие WHERE для выборки активных подписчиков (параметры $1, $2, ...)"""
+    conditions = ["s.is_active = TRUE"]
+    params = []
+
+    def param(value) -> str:
+        params.append(value)
+        return f"${len(params)}"
+
+    if welcome_stage is not None:
+        conditions.append(f"s.welcome_stage = {param(welcome_stage)}")
+    if subscribed_from is not None:
+        conditions.append(f"s.subscribed_at >= {param(subscribed_from)}::text::timestamp")
+    if subscribed_to is not None:
+        conditions.append(f"s.subscribed_at < {param(subscribed_to)}::text::timestamp")
+    if has_commented is not None:
+        exists = "EXISTS (SELECT 1 FROM comments c WHERE c.user_id = s.user_id)"
+        conditions.append(exists if has_commented else f"NOT {exists}")
+    if user_ids is not None:
+        conditions.append(f"s.user_id = ANY({param([int(user_id) for user_id in user_ids])}::bigint[])")
+
+    return " AND ".join(conditions), params
+
+
+class PostgresStorage(Storage):
+    """Хранилище бота в PostgreSQL (asyncpg)
+
+    Все запросы идут через общий пул соединений, который создается при
+    первом обращении. Захват сообщений и рассылок выполняется через
+    FOR UPDATE SKIP LOCKED, поэтому несколько экземпляров бота могут
+    работать с одной базой, не отправляя одно сообщение дважды.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 10, **pool_options):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        # Дополнительные параметры asyncpg.create_pool (например, server_settings)
+        self.pool_options = pool_options
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def _get_pool(self):
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn, min_size=self.min_size, max_size=self.max_size, **self.pool_options
+                    )
+        return self._pool
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def create_tables(self):
+        import database
+
+        pool = await self._get_pool()
+        async with pool.acquire() as conn, conn.transaction():
+            # Блокировка защищает от одновременной миграции из нескольких процессов
+            await conn.execute("SELECT pg_advisory_xact_lock(hashtext('bot_create_tables'))")
+
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS subscribers (
+                    user_id BIGINT PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    subscribed_at TIMESTAMP DEFAULT {NOW_UTC},
+                    welcome_stage INTEGER DEFAULT 0,
+                    is_active BOOLEAN DEFAULT TRUE,
+                    campaign_version INTEGER DEFAULT 1
+                )
+            ''')
+
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS scheduled_messages (
+                    id BIGSERIAL PRIMARY KEY,
+                    user_id BIGINT,
+                    message_stage INTEGER,
+                    scheduled_for TIMESTAMP,
+                    sent BOOLEAN DEFAULT FALSE,
+                    created_at TIMESTAMP DEFAULT {NOW_UTC},
+                    claimed_at TIMESTAMP
+                )
+            ''')
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_scheduled_messages_created_at ON scheduled_messages (created_at)"
+            )
+            # Частичный индекс: в нем только неотправленные сообщения
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_scheduled_messages_due "
+                "ON scheduled_messages (scheduled_for) WHERE sent = FALSE"
+            )
+
+            # Полнотекстовый поиск - по вычисляемому столбцу tsvector с GIN-индексом
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS comments (
+                    id BIGSERIAL PRIMARY KEY,
+                    user_id BIGINT,
+                    username TEXT,
+                    first_name TEXT,
+                    message_text TEXT,
+                    created_at TIMESTAMP DEFAULT {NOW_UTC},
+                    search_vector TSVECTOR GENERATED ALWAYS AS (
+                        to_tsvector('simple', coalesce(message_text, '') || ' ' ||
+                                              coalesce(username, '') || ' ' ||
+                                              coalesce(first_name, ''))
+                    ) STORED
+                )
+            ''')
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_comments_user_id ON comments (user_id)")
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_comments_search ON comments USING GIN (search_vector)"
+            )
+
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS scheduled_broadcasts (
+                    id BIGSERIAL PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    segment TEXT NOT NULL,
+                    rate DOUBLE PRECISION NOT NULL,
+                    window_seconds DOUBLE PRECISION,
+                    campaign_id BIGINT DEFAULT 0,
+                    run_at TIMESTAMP NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    sent_count INTEGER DEFAULT 0,
+                    failed_count INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT {NOW_UTC},
+                    started_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            ''')
+            # Столбец появился позже самой таблицы
+            await conn.execute(
+                "ALTER TABLE scheduled_broadcasts ADD COLUMN IF NOT EXISTS campaign_id BIGINT DEFAULT 0"
+            )
+
+            await conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS campaigns (
+                    id BIGSERIAL PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    version INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT {NOW_UTC},
+                    UNIQUE (name, version)
+                )
+            ''')
+
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS delivery_log (
+                    id BIGSERIAL PRIMARY KEY,
+                    campaign_id INTEGER NOT NULL,
+                    stage SMALLINT NOT NULL,
+                    user_id BIGINT NOT NULL,
+                    status SMALLINT NOT NULL,
+                    latency_ms INTEGER NOT NULL,
+                    created_at BIGINT NOT NULL
+                )
+            ''')
+            await conn.execute("CREATE INDEX IF NOT EXISTS idx_delivery_log_user_id ON delivery_log (user_id)")
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS delivery_rollup (
+                    campaign_id INTEGER NOT NULL,
+                    stage SMALLINT NOT NULL,
+                    hour BIGINT NOT NULL,
+                    status SMALLINT NOT NULL,
+                    count BIGINT NOT NULL,
+                    latency_ms_sum BIGINT NOT NULL,
+                    latency_ms_max INTEGER NOT NULL,
+                    PRIMARY KEY (campaign_id, stage, hour, status)
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS delivery_rollup_state (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    last_id BIGINT NOT NULL
+                )
+            ''')
+            await conn.execute(
+                "INSERT INTO delivery_rollup_state (id, last_id) VALUES (1, 0) ON CONFLICT DO NOTHING"
+            )
+
+            await conn.executemany(
+                "INSERT INTO campaigns (name, version, payload) VALUES ($1, 1, $2) ON CONFLICT DO NOTHING",
+                [
+                    (database.WELCOME_CAMPAIGN, json.dumps(database.WELCOME_MESSAGES, ensure_ascii=False)),
+                    (database.MAILING_CAMPAIGN, json.dumps(database.DEFAULT_MAILING_TEMPLATE, ensure_ascii=False)),
+                ]
+            )
+        logger.info("Таблицы базы данных PostgreSQL созданы/проверены")
+
+    # Подписчики
+
+    async def add_subscriber(self, user_id: int, username: str, first_name: str, campaign_version: int = 1):
+        pool = await self._get_pool()
+        await pool.execute(
+            f"""INSERT INTO subscribers
+                (user_id, username, first_name, welcome_stage, is_active, campaign_version)
+                VALUES ($1, $2, $3, 0, TRUE, $4)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    subscribed_at = {NOW_UTC},
+                    welcome_stage = 0,
+                    is_active = TRUE,
+                    campaign_version = excluded.campaign_version""",
+            user_id, username, first_name, campaign_version
+        )
+        logger.debug("Добавлен подписчик: %s", user_id)
+
+    async def update_welcome_stage(self, user_id: int, new_stage: int):
+        pool = await self._get_pool()
+        await pool.execute("UPDATE subscribers SET welcome_stage = $1 WHERE user_id = $2", new_stage, user_id)
+
+    async def is_user_subscribed(self, user_id: int):
+        pool = await self._get_pool()
+        row = await pool.fetchval(
+            "SELECT 1 FROM subscribers WHERE user_id = $1 AND is_active = TRUE", user_id
+        )
+        return row is not None
+
+    async def get_all_subscribers(self):
+        pool = await self._get_pool()
+        rows = await pool.fetch("SELECT user_id FROM subscribers WHERE is_active = TRUE")
+        return [row[0] for row in rows]
+
+    async def get_all_users(self):
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            f"SELECT user_id, username, first_name, {_ts('subscribed_at')}, is_active FROM subscribers"
+        )
+        return [tuple(row) for row in rows]
+
+    async def count_subscribers(self, **filters):
+        where, params = _subscriber_filters(**filters)
+        pool = await self._get_pool()
+        return await pool.fetchval(f"SELECT COUNT(*) FROM subscribers s WHERE {where}", *params)
+
+    async def iter_subscribers(self, chunk_size: int = 1000, **filters):
+        where, params = _subscriber_filters(**filters)
+        key, limit = f"${len(params) + 1}", f"${len(params) + 2}"
+        last_user_id = None
+        pool = await self._get_pool()
+
+        while True:
+            # Каждая страница - отдельный короткий запрос, соединение между ними возвращается в пул
+            if last_user_id is None:
+                rows = await pool.fetch(
+                    f"SELECT s.user_id FROM subscribers s WHERE {where} ORDER BY s.user_id LIMIT {key}",
+                    *params, chunk_size
+                )
+            else:
+                rows = await pool.fetch(
+                    f"SELECT s.user_id FROM subscribers s WHERE {where} AND s.user_id > {key} "
+                    f"ORDER BY s.user_id LIMIT {limit}",
+                    *params, last_user_id, chunk_size
+                )
+            if not rows:
+                return
+
+            for row in rows:
+                yield row[0]
+
+            last_user_id = rows[-1][0]
+            if len(rows) < chunk_size:
+                return
+
+    async def count_users(self):
+        pool = await self._get_pool()
+        return await pool.fetchval("SELECT COUNT(*) FROM subscribers")
+
+    async def _iter_table_chunks(self, table: str, key: str, columns, chunk_size: int):
+        select = "SELECT " + ", ".join(
+            _ts(column) if column.endswith("_at") else column for column in columns
+        ) + f" FROM {table}"
+        key_index = columns.index(key)
+        last_key = None
+        pool = await self._get_pool()
+
+        while True:
+            if last_key is None:
+                rows = await pool.fetch(f"{select} ORDER BY {key} LIMIT $1", chunk_size)
+            else:
+                rows = await pool.fetch(f"{select} WHERE {key} > $1 ORDER BY {key} LIMIT $2",
+                                        last_key, chunk_size)
+            if not rows:
+                return
+            yield [tuple(row) for row in rows]
+            last_key = rows[-1][key_index]
+            if len(rows) < chunk_size:
+                return
+
+    def iter_subscriber_chunks(self, chunk_size: int = 10000):
+        import database
+        return self._iter_table_chunks("subscribers", "user_id", database.SUBSCRIBER_EXPORT_COLUMNS, chunk_size)
+
+    async def import_subscriber_batch(self, rows, campaign_version: int = 1, welcome_schedule=None,
+                                      stagger_minutes: int = 0):
+        # Повторы user_id внутри порции: как и в SQLite, побеждает последняя строка
+        batch = {}
+        for user_id, username, first_name, subscribed_at, welcome_stage, is_active, version in rows:
+            offset = random.randrange(stagger_minutes) if stagger_minutes > 0 else 0
+            batch[user_id] = (
+                user_id, username, first_name, subscribed_at, welcome_stage,
+                True if is_active is None else bool(is_active),
+                campaign_version if version is None else version, offset
+            )
+
+        pool = await self._get_pool()
+        async with pool.acquire() as conn, conn.transaction():
+            await conn.execute('''
+                CREATE TEMP TABLE import_batch (
+                    user_id BIGINT PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    subscribed_at TEXT,
+                    welcome_stage INTEGER,
+                    is_active BOOLEAN,
+                    campaign_version INTEGER,
+                    offset_minutes INTEGER
+                ) ON COMMIT DROP
+            ''')
+            # COPY - самый быстрый способ загрузки порции в PostgreSQL
+            await conn.copy_records_to_table(
+                "import_batch", records=batch.values(),
+                columns=("user_id", "username", "first_name", "subscribed_at", "welcome_stage",
+                         "is_active", "campaign_version", "offset_minutes")
+            )
+
+            new_count = await conn.fetchval(
+                "SELECT COUNT(*) FROM import_batch b WHERE NOT EXISTS "
+                "(SELECT 1 FROM subscribers s WHERE s.user_id = b.user_id)"
+            )
+
+            if welcome_schedule:
+                stages = [int(stage) for stage, _ in welcome_schedule]
+                delays = [int(delay) for _, delay in welcome_schedule]
+                # Задержка по номеру стадии (массив с 1) - для отсчета от пройденной стадии
+                stage_delays = dict(zip(stages, delays))
+                await conn.execute(
+                    f"""INSERT INTO scheduled_messages (user_id, message_stage, scheduled_for)
+                        SELECT b.user_id, st.stage,
+                               {NOW_UTC} + make_interval(mins => GREATEST(
+                                   st.delay - COALESCE(($3::int[])[b.welcome_stage + 1], 0), 0
+                               ) + b.offset_minutes)
+                        FROM import_batch b, unnest($1::int[], $2::int[]) AS st (stage, delay)
+                        WHERE b.is_active AND st.stage > COALESCE(b.welcome_stage, -1)
+                          AND NOT EXISTS (SELECT 1 FROM subscribers s WHERE s.user_id = b.user_id)""",
+                    stages, delays, [stage_delays.get(stage, 0) for stage in range(max(stages) + 1)]
+                )
+
+            await conn.execute(
+                f"""INSERT INTO subscribers
+                    (user_id, username, first_name, subscribed_at, welcome_stage, is_active, campaign_version)
+                    SELECT user_id, username, first_name, COALESCE(subscribed_at::timestamp, {NOW_UTC}),
+                           COALESCE(welcome_stage, 0), is_active, campaign_version
+                    FROM import_batch
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        username = excluded.username,
+                        first_name = excluded.first_name"""
+            )
+        return new_count
+
+    # Запланированные сообщения
+
+    async def add_scheduled_message(self, user_id: int, message_stage: int, delay_minutes: int):
+        pool = await self._get_pool()
+        await pool.execute(
+            f"""INSERT INTO scheduled_messages (user_id, message_stage, scheduled_for)
+                VALUES ($1, $2, {NOW_UTC} + make_interval(mins => $3))""",
+            user_id, message_stage, int(delay_minutes)
+        )
+
+    async def get_pending_messages(self):
+        pool = await self._get_pool()
+        rows = await pool.fetch(f'''
+            SELECT sm.id, sm.user_id, sm.message_stage, s.username, s.campaign_version
+            FROM scheduled_messages sm
+            JOIN subscribers s ON sm.user_id = s.user_id
+            WHERE sm.sent = FALSE AND sm.scheduled_for <= {NOW_UTC}
+            ORDER BY sm.scheduled_for ASC
+        ''')
+        return [tuple(row) for row in rows]
+
+    async def claim_pending_messages(self, limit: int = 500, lease_minutes: int = 10):
+        pool = await self._get_pool()
+        # SKIP LOCKED: строки, которые сейчас захватывает другой экземпляр,
+        # пропускаются без ожидания его транзакции
+        rows = await pool.fetch(
+            f"""WITH due AS (
+                    SELECT id FROM scheduled_messages
+                    WHERE sent = FALSE AND scheduled_for <= {NOW_UTC}
+                      AND (claimed_at IS NULL OR claimed_at <= {NOW_UTC} - make_interval(mins => $2))
+                    ORDER BY scheduled_for ASC
+                    LIMIT $1
+                    FOR UPDATE SKIP LOCKED
+                )
+                UPDATE scheduled_messages sm
+                SET claimed_at = {NOW_UTC}
+                FROM due, subscribers s
+                WHERE sm.id = due.id AND s.user_id = sm.user_id
+                RETURNING sm.id, sm.user_id, sm.message_stage, s.username, s.campaign_version""",
+            limit, lease_minutes
+        )
+        return sorted(tuple(row) for row in rows)
+
+    async def release_messages(self, message_ids):
+        pool = await self._get_pool()
+        await pool.execute(
+            "UPDATE scheduled_messages SET claimed_at = NULL WHERE id = ANY($1::bigint[]) AND sent = FALSE",
+            [int(message_id) for message_id in message_ids]
+        )
+
+    async def mark_message_sent(self, message_id: int):
+        pool = await self._get_pool()
+        await pool.execute("UPDATE scheduled_messages SET sent = TRUE WHERE id = $1", message_id)
+
+    async def cleanup_old_messages(self, chunk_size: int = 500, pause: float = 0.05,
+                                   archive_path: str = None, vacuum_pages: int = 200,
+                                   retention_days: int = 7):
+        """Порционная очистка старых отправленных сообщений
+
+        Как и в SQLite, строки удаляются диапазонами id короткими
+        транзакциями. Место возвращает autovacuum PostgreSQL, поэтому
+        vacuum_pages не используется, а pages_freed всегда 0.
+        """
+        import database
+
+        started = time.perf_counter()
+        stats = {
+            "rows_deleted": 0,
+            "chunks": 0,
+            "lock_time": 0.0,
+            "max_lock_time": 0.0,
+            "pages_freed": 0,
+            "duration": 0.0,
+        }
+
+        pool = await self._get_pool()
+        cutoff = await pool.fetchval(f"SELECT {NOW_UTC} - make_interval(days => $1)", retention_days)
+        min_id, max_id = await pool.fetchrow(
+            "SELECT MIN(id), MAX(id) FROM scheduled_messages WHERE sent = TRUE AND created_at < $1", cutoff
+        )
+
+        if min_id is not None:
+            for low in range(min_id, max_id + 1, chunk_size):
+                lock_started = time.perf_counter()
+                async with pool.acquire() as conn, conn.transaction():
+                    rows = await conn.fetch(
+                        f"""DELETE FROM scheduled_messages
+                            WHERE id BETWEEN $1 AND $2 AND sent = TRUE AND created_at < $3
+                            RETURNING id, user_id, message_stage, {_ts('scheduled_for')}, sent, {_ts('created_at')}""",
+                        low, low + chunk_size - 1, cutoff
+                    )
+                    # Архив пишется до фиксации: при ошибке транзакция откатится
+                    if rows and archive_path:
+                        await asyncio.to_thread(database._archive_rows, archive_path, [tuple(row) for row in rows])
+                lock_time = time.perf_counter() - lock_started
+
+                stats["chunks"] += 1
+                stats["rows_deleted"] += len(rows)
+                stats["lock_time"] += lock_time
+                stats["max_lock_time"] = max(stats["max_lock_time"], lock_time)
+
+                await asyncio.sleep(pause)
+
+        stats["duration"] = time.perf_counter() - started
+        logger.info(
+            f"Очищены старые отправленные сообщения: удалено {stats['rows_deleted']} "
+            f"за {stats['chunks']} порций, "
+            f"блокировка {stats['lock_time']:.3f}с (макс. {stats['max_lock_time']:.3f}с), "
+            f"всего {stats['duration']:.2f}с"
+        )
+        return stats
+
+    # Комментарии
+
+    async def add_comment(self, user_id: int, username: str, first_name: str, message_text: str):
+        pool = await self._get_pool()
+        await pool.execute(
+            "INSERT INTO comments (user_id, username, first_name, message_text) VALUES ($1, $2, $3, $4)",
+            user_id, username, first_name, message_text
+        )
+        logger.debug("Добавлен комментарий от пользователя: %s", user_id)
+
+    async def get_all_comments(self):
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            f"SELECT id, user_id, username, first_name, message_text, {_ts('created_at')} "
+            f"FROM comments ORDER BY created_at DESC, id DESC"
+        )
+        return [tuple(row) for row in rows]
+
+    async def count_comments(self):
+        pool = await self._get_pool()
+        return await pool.fetchval("SELECT COUNT(*) FROM comments")
+
+    async def search_comments(self, query: str, limit: int = 5, offset: int = 0):
+        tsquery = build_tsquery(query)
+        if not tsquery:
+            return [], False
+
+        pool = await self._get_pool()
+        # Берем на одну строку больше, чтобы без COUNT(*) узнать о следующей странице
+        rows = await pool.fetch(
+            f"""SELECT c.id, c.user_id, c.username, c.first_name,
+                       ts_headline('simple', c.message_text, q, $2),
+                       {_ts('c.created_at')}
+                FROM comments c, to_tsquery('simple', $1) q
+                WHERE c.search_vector @@ q
+                ORDER BY ts_rank(c.search_vector, q) DESC, c.id DESC
+                LIMIT $3 OFFSET $4""",
+            tsquery, "StartSel=\x02, StopSel=\x03, MaxWords=24, MinWords=8", limit + 1, offset
+        )
+        rows = [tuple(row) for row in rows]
+        return rows[:limit], len(rows) > limit
+
+    def iter_comment_chunks(self, chunk_size: int = 10000):
+        import database
+        return self._iter_table_chunks("comments", "id", database.COMMENT_EXPORT_COLUMNS, chunk_size)
+
+    # Кампании
+
+    async def get_latest_campaign_versions(self):
+        pool = await self._get_pool()
+        rows = await pool.fetch("SELECT name, MAX(version) FROM campaigns GROUP BY name")
+        return {row[0]: row[1] for row in rows}
+
+    async def get_campaign(self, name: str, version: int = None):
+        pool = await self._get_pool()
+        if version is None:
+            row = await pool.fetchrow(
+                "SELECT version, payload FROM campaigns WHERE name = $1 ORDER BY version DESC LIMIT 1", name
+            )
+        else:
+            row = await pool.fetchrow(
+                "SELECT version, payload FROM campaigns WHERE name = $1 AND version = $2", name, version
+            )
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    async def add_campaign_version(self, name: str, payload):
+        pool = await self._get_pool()
+        version = await pool.fetchval(
+            """INSERT INTO campaigns (name, version, payload)
+               SELECT $1, COALESCE(MAX(version), 0) + 1, $2 FROM campaigns WHERE name = $1
+               RETURNING version""",
+            name, json.dumps(payload, ensure_ascii=False)
+        )
+        logger.info(f"Опубликована версия {version} кампании {name}")
+        return version
+
+    async def get_campaign_id(self, name: str, version: int = None):
+        pool = await self._get_pool()
+        if version is None:
+            return await pool.fetchval(
+                "SELECT id FROM campaigns WHERE name = $1 ORDER BY version DESC LIMIT 1", name
+            )
+        return await pool.fetchval("SELECT id FROM campaigns WHERE name = $1 AND version = $2", name, version)
+
+    # Журнал доставки
+
+    async def add_deliveries(self, records):
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            await conn.copy_records_to_table(
+                "delivery_log", records=records,
+                columns=("campaign_id", "stage", "user_id", "status", "latency_ms", "created_at")
+            )
+
+    async def rollup_deliveries(self, settle_seconds: int = 300, raw_retention_hours: int = 48,
+                                chunk_size: int = 5000, pause: float = 0.05):
+        """Свертка журнала доставки в почасовые итоги и удаление старых строк
+
+        Граница свертки блокируется (FOR UPDATE) на время транзакции, поэтому
+        одновременная свертка из нескольких экземпляров не учтет строки дважды.
+        settle_seconds должен быть больше времени между record() и flush():
+        идентификаторы выдаются до фиксации транзакции, и строка с меньшим id
+        может появиться позже строки с большим.
+        """
+        now = int(time.time())
+        stats = {"rolled_up": 0, "pruned": 0}
+
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                last_id = await conn.fetchval("SELECT last_id FROM delivery_rollup_state WHERE id = 1 FOR UPDATE")
+                upper_id = await conn.fetchval(
+                    "SELECT MAX(id) FROM delivery_log WHERE id > $1 AND created_at < $2",
+                    last_id, now - settle_seconds
+                )
+                if upper_id is not None:
+                    await conn.execute(
+                        """INSERT INTO delivery_rollup
+                           (campaign_id, stage, hour, status, count, latency_ms_sum, latency_ms_max)
+                           SELECT campaign_id, stage, created_at - created_at % 3600, status,
+                                  COUNT(*), SUM(latency_ms), MAX(latency_ms)
+                           FROM delivery_log
+                           WHERE id > $1 AND id <= $2
+                           GROUP BY campaign_id, stage, created_at - created_at % 3600, status
+                           ON CONFLICT (campaign_id, stage, hour, status) DO UPDATE SET
+                               count = delivery_rollup.count + excluded.count,
+                               latency_ms_sum = delivery_rollup.latency_ms_sum + excluded.latency_ms_sum,
+                               latency_ms_max = GREATEST(delivery_rollup.latency_ms_max, excluded.latency_ms_max)""",
+                        last_id, upper_id
+                    )
+                    stats["rolled_up"] = await conn.fetchval(
+                        "SELECT COUNT(*) FROM delivery_log WHERE id > $1 AND id <= $2", last_id, upper_id
+                    )
+                    await conn.execute("UPDATE delivery_rollup_state SET last_id = $1 WHERE id = 1", upper_id)
+                    last_id = upper_id
+
+            while True:
+                result = await conn.execute(
+                    """DELETE FROM delivery_log WHERE id IN (
+                           SELECT id FROM delivery_log WHERE id <= $1 AND created_at < $2 LIMIT $3
+                       )""",
+                    last_id, now - raw_retention_hours * 3600, chunk_size
+                )
+                deleted = int(result.split()[-1])
+                stats["pruned"] += deleted
+                if deleted < chunk_size:
+                    break
+                await asyncio.sleep(pause)
+
+        logger.info(
+            f"Журнал доставки: в итоги добавлено {stats['rolled_up']} строк, удалено {stats['pruned']}"
+        )
+        return stats
+
+    async def get_delivery_report(self, since_hours: int = 24):
+        since = int(time.time()) - since_hours * 3600
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            """WITH totals AS (
+                   SELECT campaign_id, stage, status, count, latency_ms_sum, latency_ms_max
+                   FROM delivery_rollup WHERE hour >= $1 - $1 % 3600
+                   UNION ALL
+                   SELECT campaign_id, stage, status, COUNT(*), SUM(latency_ms), MAX(latency_ms)
+                   FROM delivery_log
+                   WHERE id > (SELECT last_id FROM delivery_rollup_state WHERE id = 1) AND created_at >= $1
+                   GROUP BY campaign_id, stage, status
+               )
+               -- status 1 - доставлено (delivery.STATUS_DELIVERED)
+               SELECT c.name, c.version, t.stage,
+                      SUM(CASE WHEN t.status = 1 THEN t.count ELSE 0 END)::bigint,
+                      SUM(CASE WHEN t.status = 1 THEN 0 ELSE t.count END)::bigint,
+                      (SUM(t.latency_ms_sum) / SUM(t.count))::float8,
+                      MAX(t.latency_ms_max)
+               FROM totals t
+               LEFT JOIN campaigns c ON c.id = t.campaign_id
+               GROUP BY t.campaign_id, t.stage, c.name, c.version
+               ORDER BY c.name, c.version, t.stage""",
+            since
+        )
+        return [tuple(row) for row in rows]
+
+    # Отложенные рассылки
+
+    async def add_scheduled_broadcast(self, payload: dict, segment: dict, rate: float, run_at: str,
+                                      window_seconds: float = None, campaign_id: int = 0):
+        pool = await self._get_pool()
+        broadcast_id = await pool.fetchval(
+            """INSERT INTO scheduled_broadcasts (payload, segment, rate, window_seconds, run_at, campaign_id)
+               VALUES ($1, $2, $3, $4, $5::text::timestamp, $6)
+               RETURNING id""",
+            json.dumps(payload, ensure_ascii=False), json.dumps(segment), rate, window_seconds, run_at,
+            campaign_id or 0
+        )
+        logger.info(f"Запланирована рассылка {broadcast_id} на {run_at} UTC")
+        return broadcast_id
+
+    async def claim_due_broadcasts(self):
+        pool = await self._get_pool()
+        rows = await pool.fetch(
+            f"""UPDATE scheduled_broadcasts
+                SET status = 'running', started_at = {NOW_UTC}
+                WHERE id IN (
+                    SELECT id FROM scheduled_broadcasts
+                    WHERE status = 'pending' AND run_at <= {NOW_UTC}
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, payload, segment, rate, window_seconds, campaign_id"""
+        )
+        return [(row[0], json.loads(row[1]), json.loads(row[2]), row[3], row[4], row[5] or 0) for row in rows]
+
+    async def finish_broadcast(self, broadcast_id: int, status: str, sent_count: int = 0, failed_count: int = 0):
+        pool = await self._get_pool()
+        await pool.execute(
+            f"""UPDATE scheduled_broadcasts
+                SET status = $1, sent_count = $2, failed_count = $3, finished_at = {NOW_UTC}
+                WHERE id = $4""",
+            status, sent_count, failed_count, broadcast_id
+        )
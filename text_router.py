@@ -0,0 +1,95 @@
+import logging
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiogram import types
+
+logger = logging.getLogger(__name__)
+
+TextHandler = Callable[[types.Message], Awaitable[None]]
+
+
+class TextRouter:
+    """Маршрутизация текстовых сообщений по точному тексту кнопки
+
+    Вместо цепочки фильтров F.text == "...", которые aiogram проверяет по
+    очереди для каждого сообщения, кнопки reply-клавиатуры сопоставляются
+    обработчикам через один поиск в словаре. Все остальные тексты уходят в
+    fallback-обработчик (свободный текст / комментарии).
+    """
+
+    def __init__(self):
+        self.routes: Dict[str, TextHandler] = {}
+        self.fallback_handler: Optional[TextHandler] = None
+
+    def route(self, text: str):
+        """Декоратор: регистрация обработчика для точного текста"""
+        def decorator(handler: TextHandler) -> TextHandler:
+            if text in self.routes:
+                raise ValueError(f"Обработчик для текста {text!r} уже зарегистрирован")
+            self.routes[text] = handler
+            return handler
+        return decorator
+
+    def fallback(self, handler: TextHandler) -> TextHandler:
+        """Декоратор: обработчик для текстов, не совпавших ни с одной кнопкой"""
+        self.fallback_handler = handler
+        return handler
+
+    async def dispatch(self, message: types.Message):
+        """Вызов обработчика для сообщения"""
+        handler = self.routes.get(message.text, self.fallback_handler)
+        if handler is None:
+            return None
+        return await handler(message)
+
+
+def benchmark(button_counts=(5, 20, 100, 500), iterations: int = 20_000):
+    """Сравнение стоимости маршрутизации: цепочка фильтров aiogram против словаря
+
+    Для каждого числа кнопок измеряется среднее время на апдейт для
+    худшего (и самого частого) случая - свободного текста, который не
+    совпадает ни с одной кнопкой и доходит до fallback.
+    """
+    import time
+    from datetime import datetime
+
+    from aiogram import F
+
+    message = types.Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=types.Chat(id=1, type="private"),
+        text="Спасибо за подборку курсов!",
+    )
+
+    results = []
+    for count in button_counts:
+        texts = [f"Кнопка {i}" for i in range(count)]
+
+        # Так aiogram перебирает обработчики: фильтры проверяются по порядку
+        filters = [(F.text == text).resolve for text in texts]
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for resolve in filters:
+                if resolve(message):
+                    break
+        linear = (time.perf_counter() - started) / iterations
+
+        routes = {text: None for text in texts}
+        started = time.perf_counter()
+        for _ in range(iterations):
+            routes.get(message.text)
+        lookup = (time.perf_counter() - started) / iterations
+
+        results.append((count, linear, lookup))
+
+    return results
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("⏱  МАРШРУТИЗАЦИЯ ТЕКСТА: стоимость на апдейт")
+    print("=" * 50)
+    print(f"{'Кнопок':>8} {'Фильтры, мкс':>14} {'Словарь, мкс':>14} {'Ускорение':>10}")
+    for count, linear, lookup in benchmark():
+        print(f"{count:>8} {linear * 1e6:>14.2f} {lookup * 1e6:>14.3f} {linear / lookup:>9.0f}x")
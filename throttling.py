@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты апдейтов от одного пользователя (token bucket)
+
+    Подключается как outer middleware, поэтому лишние апдейты отсекаются
+    до фильтров, обработчиков и запросов к базе. Каждый пользователь имеет
+    корзину на burst токенов, пополняемую со скоростью rate токенов в
+    секунду. Если токена нет, апдейт либо откладывается (не дольше
+    max_delay секунд), либо отбрасывается.
+
+    Корзины хранятся в OrderedDict с ограничением max_users: давно
+    неактивные пользователи вытесняются, записи старше ttl удаляются.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, max_delay: float = 0.0,
+                 max_users: int = 100_000, ttl: float = 600.0, exempt_ids=()):
+        if rate <= 0:
+            raise ValueError(f"rate должен быть больше 0 (THROTTLE_RATE), получено {rate}")
+        if burst < 1:
+            raise ValueError(f"burst должен быть не меньше 1 (THROTTLE_BURST), получено {burst}")
+        self.rate = rate
+        self.burst = burst
+        self.max_delay = max_delay
+        self.max_users = max_users
+        self.ttl = ttl
+        self.exempt_ids = set(exempt_ids)
+
+        # user_id -> [токены, время последнего пополнения]
+        self._buckets: "OrderedDict[int, list]" = OrderedDict()
+
+        self.stats = {
+            "passed": 0,
+            "delayed": 0,
+            "dropped": 0,
+            "evicted": 0,
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt_ids:
+            return await handler(event, data)
+
+        delay = self._acquire(user.id, time.monotonic())
+        if delay is None:
+            self.stats["dropped"] += 1
+            logger.debug(f"Апдейт от пользователя {user.id} отброшен ограничителем")
+            return None
+
+        if delay > 0:
+            self.stats["delayed"] += 1
+            await asyncio.sleep(delay)
+
+        self.stats["passed"] += 1
+        return await handler(event, data)
+
+    def _acquire(self, user_id: int, now: float):
+        """Списание токена: возвращает задержку в секундах или None (отбросить)"""
+        bucket = self._buckets.get(user_id)
+        if bucket is None or now - bucket[1] > self.ttl:
+            bucket = [float(self.burst), now]
+            self._buckets[user_id] = bucket
+            self._evict(now)
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        self._buckets.move_to_end(user_id)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+
+        # Токена нет: сколько ждать до следующего
+        delay = (1 - bucket[0]) / self.rate
+        if delay > self.max_delay:
+            return None
+
+        # Резервируем токен заранее, чтобы очередь задержанных апдейтов не росла
+        bucket[0] -= 1
+        return delay
+
+    def _evict(self, now: float):
+        """Вытеснение устаревших и лишних корзин (самые старые - в начале)"""
+        while self._buckets:
+            user_id, bucket = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_users and now - bucket[1] <= self.ttl:
+                break
+            del self._buckets[user_id]
+            self.stats["evicted"] += 1
+
+    @property
+    def tracked_users(self) -> int:
+        """Количество отслеживаемых пользователей"""
+        return len(self._buckets)
@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import tempfile
+import time
+
+# Добавляем путь для импорта database
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import database as db
+
+# Размер порции чтения при выгрузке и размер транзакции при загрузке
+EXPORT_CHUNK_SIZE = 10_000
+IMPORT_BATCH_SIZE = 50_000
+
+
+def _detect_format(path: str, fmt: str = None) -> str:
+    if fmt:
+        return fmt
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+async def export_table(table: str, path: str, fmt: str = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """Потоковая выгрузка subscribers или comments в CSV / JSON Lines
+
+    В памяти одновременно находится только одна порция строк.
+    Возвращает количество выгруженных строк.
+    """
+    if table == "subscribers":
+        columns, chunks = db.SUBSCRIBER_EXPORT_COLUMNS, db.iter_subscriber_chunks(chunk_size)
+    elif table == "comments":
+        columns, chunks = db.COMMENT_EXPORT_COLUMNS, db.iter_comment_chunks(chunk_size)
+    else:
+        raise ValueError(f"Неизвестная таблица: {table}")
+
+    fmt = _detect_format(path, fmt)
+    total = 0
+    out = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            async for rows in chunks:
+                writer.writerows(rows)
+                total += len(rows)
+        else:
+            async for rows in chunks:
+                out.write("".join(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+                ))
+                total += len(rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return total
+
+
+def _optional_int(value):
+    return None if value is None or value == "" else int(value)
+
+
+def _optional_bool(value):
+    """is_active из CSV ("1", "True") или JSON (true, 1); пусто - None"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "t", "yes")
+    return bool(value)
+
+
+def _read_subscribers(path: str, fmt: str = None):
+    """Построчное чтение файла подписчиков в порядке db.SUBSCRIBER_EXPORT_COLUMNS
+
+    Обязателен только user_id; отсутствующие welcome_stage, is_active и
+    campaign_version - None (значения по умолчанию при загрузке).
+    """
+    fmt = _detect_format(path, fmt)
+    source = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+    try:
+        records = csv.DictReader(source) if fmt == "csv" else (json.loads(line) for line in source if line.strip())
+        for record in records:
+            yield (
+                int(record["user_id"]),
+                record.get("username") or "No username",
+                record.get("first_name") or "No name",
+                record.get("subscribed_at") or None,
+                _optional_int(record.get("welcome_stage")),
+                _optional_bool(record.get("is_active")),
+                _optional_int(record.get("campaign_version")),
+            )
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+async def import_subscribers(path: str, fmt: str = None, batch_size: int = IMPORT_BATCH_SIZE,
+                             schedule_welcome: bool = False, stagger_minutes: int = 0):
+    """Массовая загрузка подписчиков порциями по batch_size строк
+
+    Каждая порция - одна транзакция с executemany. Стадия, активность и
+    версия серии из файла (формат export) сохраняются. С schedule_welcome
+    новым активным подписчикам планируется приветственная серия: стадии
+    после сохраненной welcome_stage, а без нее - все, начиная с нулевой.
+    Возвращает (строк, новых).
+    """
+    await db.create_tables()
+
+    welcome_schedule = None
+    campaign_version = 1
+    row = await db.get_campaign(db.WELCOME_CAMPAIGN)
+    if row is not None:
+        campaign_version = row[0]
+        if schedule_welcome:
+            welcome_schedule = [
+                (stage, message_data.get("delay_minutes", 0)) for stage, message_data in enumerate(row[1])
+            ]
+
+    total = new = 0
+    batch = []
+    for record in _read_subscribers(path, fmt):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            new += await db.import_subscriber_batch(batch, campaign_version, welcome_schedule, stagger_minutes)
+            total += len(batch)
+            batch = []
+            print(f"📥 Загружено: {total}", file=sys.stderr)
+    if batch:
+        new += await db.import_subscriber_batch(batch, campaign_version, welcome_schedule, stagger_minutes)
+        total += len(batch)
+    return total, new
+
+
+async def benchmark(rows: int = 1_000_000, batch_size: int = IMPORT_BATCH_SIZE):
+    """Замер скорости загрузки и выгрузки на временной базе SQLite
+
+    Рабочая база не затрагивается: на время замера DATABASE_PATH
+    указывает на файл во временном каталоге. С DATABASE_URL функции db -
+    методы PostgreSQL, и подмена пути их не изолирует, поэтому замер
+    не запускается.
+    """
+    if db.DATABASE_URL:
+        print("❌ Замер выполняется только на SQLite: уберите DATABASE_URL, "
+              "иначе тестовые подписчики попадут в рабочую базу", file=sys.stderr)
+        return
+
+    database_path = db.DATABASE_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DATABASE_PATH = os.path.join(tmp, "benchmark.db")
+        try:
+            source = os.path.join(tmp, "subscribers.csv")
+            with open(source, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(("user_id", "username", "first_name"))
+                writer.writerows((user_id, f"user{user_id}", "Имя") for user_id in range(1, rows + 1))
+
+            started = time.perf_counter()
+            total, new = await import_subscribers(source, batch_size=batch_size)
+            import_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            exported = await export_table("subscribers", os.path.join(tmp, "export.jsonl"))
+            export_time = time.perf_counter() - started
+        finally:
+            db.DATABASE_PATH = database_path
+
+    print("=" * 50)
+    print(f"📥 Импорт: {total} строк ({new} новых) за {import_time:.1f}с - {total / import_time:,.0f} строк/с")
+    print(f"📤 Экспорт: {exported} строк за {export_time:.1f}с - {exported / export_time:,.0f} строк/с")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Импорт и экспорт подписчиков и комментариев")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Выгрузить таблицу в CSV / JSONL")
+    export_parser.add_argument("table", choices=("subscribers", "comments"))
+    export_parser.add_argument("path", help="Файл (.csv / .jsonl) или - для stdout")
+    export_parser.add_argument("--format", choices=("csv", "jsonl"))
+
+    import_parser = subparsers.add_parser("import", help="Загрузить подписчиков из CSV / JSONL")
+    import_parser.add_argument("path", help="Файл (.csv / .jsonl) или - для stdin")
+    import_parser.add_argument("--format", choices=("csv", "jsonl"))
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    import_parser.add_argument("--schedule-welcome", action="store_true",
+                               help="Запланировать приветственную серию новым подписчикам")
+    import_parser.add_argument("--stagger-minutes", type=int, default=0,
+                               help="Случайно растянуть старт серии на столько минут")
+
+    benchmark_parser = subparsers.add_parser("benchmark", help="Замер скорости на временной базе")
+    benchmark_parser.add_argument("--rows", type=int, default=1_000_000)
+    benchmark_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        count = asyncio.run(export_table(args.table, args.path, args.format))
+        print(f"✅ Выгружено строк: {count}", file=sys.stderr)
+    elif args.command == "import":
+        count, new = asyncio.run(import_subscribers(
+            args.path, args.format, args.batch_size, args.schedule_welcome, args.stagger_minutes
+        ))
+        print(f"✅ Загружено строк: {count}, новых подписчиков: {new}", file=sys.stderr)
+    else:
+        asyncio.run(benchmark(args.rows, args.batch_size))
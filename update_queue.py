@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from log_setup import fields
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueueMiddleware(BaseMiddleware):
+    """Ограниченная очередь обработки апдейтов с обратным давлением на polling
+
+    Подключается как outer middleware на dp.update и только кладет апдейт
+    в очередь на max_size элементов; обрабатывают очередь concurrency
+    фоновых обработчиков. Polling нужно запускать с handle_as_tasks=False:
+    тогда при заполненной очереди put() задерживает цикл polling, новые
+    апдейты остаются на стороне Telegram, а число одновременных
+    обработчиков и память не растут при всплеске - растет только задержка.
+
+    Порядок обработки апдейтов одного пользователя при concurrency > 1 не
+    гарантируется (как и при handle_as_tasks=True).
+    """
+
+    def __init__(self, concurrency: int = 16, max_size: int = 200, slow_wait: float = 5.0):
+        self.concurrency = concurrency
+        self.max_size = max_size
+        # Ожидание в очереди дольше slow_wait секунд попадает в лог
+        self.slow_wait = slow_wait
+
+        self._queue: asyncio.Queue = None
+        self._workers = []
+        self._in_progress = 0
+
+        self.stats = {
+            "processed": 0,
+            "failed": 0,
+            "blocked": 0,        # сколько раз polling ждал места в очереди
+            "blocked_time": 0.0,
+            "wait_time": 0.0,    # суммарное ожидание в очереди
+            "max_wait": 0.0,
+            "max_depth": 0,
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self._queue is None:
+            # Обработчики не запущены (например, до start()) - обрабатываем сразу
+            return await handler(event, data)
+
+        item = (handler, event, data, time.monotonic())
+        if self._queue.full():
+            self.stats["blocked"] += 1
+            started = time.monotonic()
+            await self._queue.put(item)
+            self.stats["blocked_time"] += time.monotonic() - started
+        else:
+            self._queue.put_nowait(item)
+        self.stats["max_depth"] = max(self.stats["max_depth"], self._queue.qsize())
+        return None
+
+    def start(self):
+        """Запуск обработчиков очереди (внутри работающего цикла событий)"""
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"update-worker-{i}") for i in range(self.concurrency)
+        ]
+        logger.info(
+            "🧵 Очередь апдейтов запущена",
+            extra=fields(concurrency=self.concurrency, max_size=self.max_size)
+        )
+
+    async def _worker(self):
+        while True:
+            handler, event, data, enqueued = await self._queue.get()
+            wait = time.monotonic() - enqueued
+            self.stats["wait_time"] += wait
+            self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            if wait >= self.slow_wait:
+                logger.warning(
+                    "⏳ Долгое ожидание апдейта в очереди",
+                    extra=fields(event="update_queue_wait", wait=f"{wait:.1f}s", depth=self._queue.qsize())
+                )
+
+            self._in_progress += 1
+            try:
+                await handler(event, data)
+            except Exception as e:
+                # Ошибки обработчиков больше не доходят до polling - логируем здесь
+                self.stats["failed"] += 1
+                logger.exception("❌ Ошибка обработки апдейта", extra=fields(event="update_failed", error=e))
+            finally:
+                self._in_progress -= 1
+                self.stats["processed"] += 1
+                self._queue.task_done()
+
+    async def drain(self, timeout: float) -> int:
+        """Ожидание обработки уже принятых апдейтов и остановка обработчиков
+
+        Вызывается после остановки polling. Возвращает количество апдейтов,
+        которые не успели обработаться за timeout секунд.
+        """
+        if self._queue is None:
+            return 0
+        try:
+            await asyncio.wait_for(self._queue.join(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+
+        left = self._queue.qsize() + self._in_progress
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queue = None
+        self._workers = []
+        return left
+
+    @property
+    def depth(self) -> int:
+        """Апдейтов в очереди (без обрабатываемых)"""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def in_progress(self) -> int:
+        """Апдейтов в обработке прямо сейчас"""
+        return self._in_progress
+
+    @property
+    def average_wait(self) -> float:
+        processed = self.stats["processed"] + self._in_progress
+        return self.stats["wait_time"] / processed if processed else 0.0
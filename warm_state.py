@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import database as db
+from log_setup import fields
+
+logger = logging.getLogger(__name__)
+
+# Версия формата файла снимка; снимок другой версии игнорируется
+SNAPSHOT_VERSION = 1
+
+
+class SubscriptionCache:
+    """Кэш подтвержденных подписок поверх database.is_user_subscribed
+
+    Запоминаются только положительные ответы: новый подписчик сразу
+    добавляется через add(), а отключение подписки в базе вступает в силу
+    не позже чем через ttl секунд. Время проверки - по часам системы,
+    чтобы записи из снимка можно было проверить на возраст после перезапуска.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_size: int = 100_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        # user_id -> время подтверждения подписки (time.time())
+        self._checked: "OrderedDict[int, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def is_subscribed(self, user_id: int) -> bool:
+        checked_at = self._checked.get(user_id)
+        if checked_at is not None and time.time() - checked_at <= self.ttl:
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        subscribed = await db.is_user_subscribed(user_id)
+        if subscribed:
+            self.add(user_id)
+        else:
+            self._checked.pop(user_id, None)
+        return subscribed
+
+    def add(self, user_id: int, checked_at: float = None):
+        self._checked[user_id] = time.time() if checked_at is None else checked_at
+        self._checked.move_to_end(user_id)
+        while len(self._checked) > self.max_size:
+            self._checked.popitem(last=False)
+
+    def snapshot(self) -> list:
+        return [[user_id, checked_at] for user_id, checked_at in self._checked.items()]
+
+    def restore(self, items) -> int:
+        """Загрузка записей из снимка (устаревшие пропускаются), возвращает количество"""
+        now = time.time()
+        restored = 0
+        for user_id, checked_at in items:
+            if now - checked_at <= self.ttl:
+                self.add(int(user_id), checked_at)
+                restored += 1
+        return restored
+
+    def __len__(self) -> int:
+        return len(self._checked)
+
+
+class MediaFileCache:
+    """file_id медиа, уже загруженных в Telegram, по их URL
+
+    Повторная отправка по file_id не требует, чтобы Telegram снова скачивал
+    файл по URL - это быстрее и не зависит от доступности хостинга.
+    """
+
+    def __init__(self, max_size: int = 1000):
+        self.max_size = max_size
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+
+    def get(self, url: str):
+        return self._file_ids.get(url)
+
+    def remember(self, url: str, sent_message):
+        """Сохранение file_id из ответа send_photo / send_video"""
+        if sent_message.photo:
+            file_id = sent_message.photo[-1].file_id
+        elif sent_message.video:
+            file_id = sent_message.video.file_id
+        else:
+            return
+        self._file_ids[url] = file_id
+        self._file_ids.move_to_end(url)
+        while len(self._file_ids) > self.max_size:
+            self._file_ids.popitem(last=False)
+
+    def discard(self, url: str):
+        self._file_ids.pop(url, None)
+
+    def snapshot(self) -> dict:
+        return dict(self._file_ids)
+
+    def restore(self, file_ids: dict) -> int:
+        self._file_ids.update(file_ids)
+        return len(file_ids)
+
+    def __len__(self) -> int:
+        return len(self._file_ids)
+
+
+def save_snapshot(path: str, state: dict):
+    """Атомарная запись снимка: временный файл и os.replace"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": SNAPSHOT_VERSION, "saved_at": time.time(), **state}, f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(path: str, max_age: float = None):
+    """Чтение снимка; None, если файла нет, он поврежден или старше max_age секунд"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning("⚠️ Снимок состояния не прочитан", extra=fields(path=path, error=e))
+        return None
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        logger.warning("⚠️ Снимок состояния другой версии, пропускаем", extra=fields(path=path))
+        return None
+    if max_age is not None and time.time() - snapshot.get("saved_at", 0) > max_age:
+        logger.info("🕰 Снимок состояния устарел, пропускаем", extra=fields(path=path))
+        return None
+    return snapshot